@@ -0,0 +1,231 @@
+import os
+import json
+import asyncio
+import hashlib
+import inspect
+import functools
+from collections import OrderedDict
+from time import monotonic
+from typing import NamedTuple
+from fastapi import Header, Response
+from fastapi.encoders import jsonable_encoder
+from common.responses import Conflict
+from data.statements import register_statement
+from data.database_queries import read_query, update_query, delete_query
+
+
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_KEY_TTL_SECONDS', 86400))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+
+# A request that holds a key this long without finishing, for example because its process died, loses it.
+CLAIM_TTL_SECONDS = 60
+# How long a duplicate waits for a request with the same key in another process before it gives up.
+WAIT_SECONDS = 10
+POLL_SECONDS = 0.1
+PURGE_INTERVAL_SECONDS = 600
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    # None when the handler returned data, which FastAPI serializes with the status code of the route.
+    status_code: int | None
+    body: bytes
+    media_type: str | None
+
+
+class _KeyInProgress(Exception):
+    pass
+
+
+class _LRUCache:
+    '''
+    The responses of the most recently used keys of this process, each kept until its TTL is over.
+    '''
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key) -> StoredResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        stored, expires_at = entry
+        if expires_at < monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return stored
+
+    def put(self, key, stored: StoredResponse):
+        self._entries[key] = (stored, monotonic() + IDEMPOTENCY_KEY_TTL_SECONDS)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_cache = _LRUCache(IDEMPOTENCY_CACHE_SIZE)
+_in_flight: dict[tuple, asyncio.Future] = {}
+_next_purge = 0.0
+
+# Claims the key, or takes it over when the request that had it is over its TTL. When it is held already the stored
+# row is returned instead; no row at all means it was claimed by a request that hasn't committed yet.
+# $1 is the user, $2 the endpoint, $3 the key, $4 the fingerprint of the request and $5 the claim TTL in seconds.
+claimed_idempotency_key = register_statement('claimed_idempotency_key', '''WITH claimed AS (INSERT INTO idempotency_keys (user_id, scope, key, fingerprint, expires_at)
+                                                                                           VALUES ($1, $2, $3, $4, now() + make_interval(secs => $5))
+                                                                                           ON CONFLICT (user_id, scope, key) DO UPDATE
+                                                                                           SET fingerprint = EXCLUDED.fingerprint, status_code = NULL, body = NULL, media_type = NULL,
+                                                                                               created_at = now(), expires_at = EXCLUDED.expires_at
+                                                                                           WHERE idempotency_keys.expires_at < now()
+                                                                                           RETURNING user_id)
+                                                                           SELECT true, NULL::text, NULL::int, NULL::bytea, NULL::text
+                                                                           FROM claimed
+                                                                           UNION ALL
+                                                                           SELECT false, fingerprint, status_code, body, media_type
+                                                                           FROM idempotency_keys
+                                                                           WHERE user_id = $1 AND scope = $2 AND key = $3 AND NOT EXISTS (SELECT 1 FROM claimed)''')
+
+completed_idempotency_key = register_statement('completed_idempotency_key', '''UPDATE idempotency_keys
+                                                                               SET status_code = $4, body = $5, media_type = $6, expires_at = now() + make_interval(secs => $7)
+                                                                               WHERE user_id = $1 AND scope = $2 AND key = $3''')
+
+released_idempotency_key = register_statement('released_idempotency_key', '''DELETE FROM idempotency_keys
+                                                                             WHERE user_id = $1 AND scope = $2 AND key = $3 AND body IS NULL''')
+
+expired_idempotency_keys = register_statement('expired_idempotency_keys', '''DELETE FROM idempotency_keys
+                                                                             WHERE expires_at < now()''')
+
+
+def idempotent(scope: str):
+    '''
+    This decorator makes a POST handler honour the Idempotency-Key header.\n
+    Parameters:\n
+    - scope: str\n
+        - The name of the endpoint, keys are unique per user and endpoint.\n
+    The first request with a key runs the handler and its response is stored for IDEMPOTENCY_KEY_TTL_SECONDS
+    (default one day) in the idempotency_keys table and in an in-process LRU cache of IDEMPOTENCY_CACHE_SIZE keys.
+    A retry with the same key gets the stored response back without running the handler again. A duplicate that
+    arrives while the first request is still running waits for its response. Reusing a key for a different request
+    body is answered with 409 Conflict. If the handler raises, the key is released and can be retried.
+    Requests without the header are not affected. The handler must take the user as current_user.
+    '''
+
+    def decorator(endpoint):
+        signature = inspect.signature(endpoint)
+
+        @functools.wraps(endpoint)
+        async def wrapper(*args, idempotency_key: str | None = None, **kwargs):
+            if not idempotency_key:
+                return await endpoint(*args, **kwargs)
+
+            arguments = signature.bind(*args, **kwargs).arguments
+            key = (int(arguments['current_user']), scope, idempotency_key)
+            fingerprint = _fingerprint(arguments)
+
+            while True:
+                stored = _cache.get(key)
+                if stored is not None:
+                    return _replay(stored, fingerprint)
+
+                in_flight = _in_flight.get(key)
+                if in_flight is None:
+                    break
+                # shield: a duplicate that is cancelled must not cancel the future the others wait on.
+                await asyncio.shield(in_flight)
+
+            _in_flight[key] = asyncio.get_running_loop().create_future()
+            try:
+                try:
+                    stored = await _claim(key, fingerprint)
+                except _KeyInProgress:
+                    return Conflict(content='A request with this Idempotency-Key is still being processed.')
+                if stored is not None:
+                    _cache.put(key, stored)
+                    return _replay(stored, fingerprint)
+
+                try:
+                    result = await endpoint(*args, **kwargs)
+                except BaseException:
+                    await _release(key)
+                    raise
+
+                stored = _stored_response(result, fingerprint)
+                await _complete(key, stored)
+                _cache.put(key, stored)
+                return result
+            finally:
+                _in_flight.pop(key).set_result(None)
+
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter('idempotency_key',
+                              inspect.Parameter.KEYWORD_ONLY,
+                              default=Header(default=None, alias='Idempotency-Key', max_length=255),
+                              annotation=str | None)
+        ])
+        return wrapper
+
+    return decorator
+
+
+def _fingerprint(arguments: dict) -> str:
+    request = {name: value for name, value in arguments.items() if name != 'current_user'}
+    return hashlib.sha256(json.dumps(jsonable_encoder(request), sort_keys=True).encode()).hexdigest()
+
+
+def _stored_response(result, fingerprint: str) -> StoredResponse:
+    if isinstance(result, Response):
+        return StoredResponse(fingerprint, result.status_code, bytes(result.body), result.media_type)
+    return StoredResponse(fingerprint, None, json.dumps(jsonable_encoder(result)).encode(), None)
+
+
+def _replay(stored: StoredResponse, fingerprint: str):
+    if stored.fingerprint != fingerprint:
+        return Conflict(content='The Idempotency-Key has already been used for a different request.')
+    if stored.status_code is None:
+        return json.loads(stored.body)
+    return Response(content=stored.body, status_code=stored.status_code, media_type=stored.media_type)
+
+
+async def _claim(key: tuple, fingerprint: str) -> StoredResponse | None:
+    # Returns None once the key is claimed by this request, or the stored response of the request that had it.
+    await _purge_expired()
+
+    deadline = monotonic() + WAIT_SECONDS
+    while True:
+        rows = await read_query(sql=claimed_idempotency_key,
+                                sql_params=(*key, fingerprint, CLAIM_TTL_SECONDS))
+        if rows and rows[0][0]:
+            return None
+
+        if rows and rows[0][3] is not None:
+            return StoredResponse(*rows[0][1:])
+
+        # Held by a request in another process that is still running.
+        if monotonic() > deadline:
+            raise _KeyInProgress()
+        await asyncio.sleep(POLL_SECONDS)
+
+
+async def _complete(key: tuple, stored: StoredResponse):
+    await update_query(sql=completed_idempotency_key,
+                       sql_params=(*key, stored.status_code, stored.body, stored.media_type, IDEMPOTENCY_KEY_TTL_SECONDS))
+
+
+async def _release(key: tuple):
+    await delete_query(sql=released_idempotency_key,
+                       sql_params=key)
+
+
+async def _purge_expired():
+    # At most once per PURGE_INTERVAL_SECONDS in every process, expired keys are claimed over anyway.
+    global _next_purge
+    if monotonic() < _next_purge:
+        return
+    _next_purge = monotonic() + PURGE_INTERVAL_SECONDS
+    await update_query(sql=expired_idempotency_keys)
@@ -0,0 +1,203 @@
+import re
+from bisect import bisect_left
+from time import perf_counter
+from data.statements import statement_stats
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    '''
+    A latency histogram in seconds with fixed buckets, rendered as a Prometheus histogram.\n
+    observe() only bumps a bucket counter, the cumulative counts are built when the metrics are rendered.
+    '''
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class StatementMetrics:
+    __slots__ = ('latency', 'rows', 'errors')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+
+_statements: dict[str, StatementMetrics] = {}
+_pool_waits: dict[str, Histogram] = {}
+_routes: dict[tuple[str, str, int], Histogram] = {}
+
+_normalized: dict[str, str] = {}
+_NORMALIZED_CACHE_SIZE = 2048
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r'(?<![$\w])\d+(?:\.\d+)?\b')
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_statement(sql: str) -> str:
+    '''
+    This function returns the label a statement is recorded under: the name of a registered statement,
+    otherwise the SQL with literals replaced by ? and whitespace collapsed.\n
+    The result is cached, so the regular expressions only run the first time a SQL text is seen.
+    '''
+    name = getattr(sql, 'name', None)
+    if name is not None:
+        return name
+
+    normalized = _normalized.get(sql)
+    if normalized is None:
+        normalized = _string_literal.sub('?', sql)
+        normalized = _number_literal.sub('?', normalized)
+        normalized = _whitespace.sub(' ', normalized).strip()
+        if len(_normalized) < _NORMALIZED_CACHE_SIZE:
+            _normalized[sql] = normalized
+    return normalized
+
+
+def _statement(sql: str) -> StatementMetrics:
+    label = normalize_statement(sql)
+    metrics = _statements.get(label)
+    if metrics is None:
+        metrics = _statements[label] = StatementMetrics()
+    return metrics
+
+
+def record_statement(sql: str, elapsed: float, rows: int):
+    metrics = _statement(sql)
+    metrics.latency.observe(elapsed)
+    metrics.rows += rows
+
+
+def record_statement_error(sql: str, elapsed: float):
+    metrics = _statement(sql)
+    metrics.latency.observe(elapsed)
+    metrics.errors += 1
+
+
+def record_pool_wait(pool: str, elapsed: float):
+    histogram = _pool_waits.get(pool)
+    if histogram is None:
+        histogram = _pool_waits[pool] = Histogram()
+    histogram.observe(elapsed)
+
+
+def record_route(method: str, route: str, status: int, elapsed: float):
+    key = (method, route, status)
+    histogram = _routes.get(key)
+    if histogram is None:
+        histogram = _routes[key] = Histogram()
+    histogram.observe(elapsed)
+
+
+def reset_metrics():
+    _statements.clear()
+    _pool_waits.clear()
+    _routes.clear()
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics() -> str:
+    '''
+    This function renders all recorded metrics in the Prometheus text exposition format.
+    '''
+    lines = ['# HELP wallet_db_statement_duration_seconds Execution time of SQL statements.',
+             '# TYPE wallet_db_statement_duration_seconds histogram']
+    for statement, metrics in _statements.items():
+        lines.extend(metrics.latency.lines('wallet_db_statement_duration_seconds', f'statement="{_label(statement)}"'))
+
+    lines.extend(['# HELP wallet_db_statement_rows_total Rows returned or affected by SQL statements.',
+                  '# TYPE wallet_db_statement_rows_total counter'])
+    lines.extend(f'wallet_db_statement_rows_total{{statement="{_label(statement)}"}} {metrics.rows}'
+                 for statement, metrics in _statements.items())
+
+    lines.extend(['# HELP wallet_db_statement_errors_total SQL statements that raised an error.',
+                  '# TYPE wallet_db_statement_errors_total counter'])
+    lines.extend(f'wallet_db_statement_errors_total{{statement="{_label(statement)}"}} {metrics.errors}'
+                 for statement, metrics in _statements.items())
+
+    # Every registered statement, also those that never ran, with the stats kept by its prepared handles.
+    prepared = statement_stats()
+    lines.extend(['# HELP wallet_db_prepared_statement_calls_total Executions of registered statements by their prepared handle.',
+                  '# TYPE wallet_db_prepared_statement_calls_total counter'])
+    lines.extend(f'wallet_db_prepared_statement_calls_total{{statement="{_label(name)}"}} {stats["calls"]}'
+                 for name, stats in prepared.items())
+
+    lines.extend(['# HELP wallet_db_prepared_statement_seconds_total Total execution time of registered statements.',
+                  '# TYPE wallet_db_prepared_statement_seconds_total counter'])
+    lines.extend(f'wallet_db_prepared_statement_seconds_total{{statement="{_label(name)}"}} {stats["total_time"]}'
+                 for name, stats in prepared.items())
+
+    lines.extend(['# HELP wallet_db_prepared_statement_rows_total Rows returned or affected by registered statements.',
+                  '# TYPE wallet_db_prepared_statement_rows_total counter'])
+    lines.extend(f'wallet_db_prepared_statement_rows_total{{statement="{_label(name)}"}} {stats["rows"]}'
+                 for name, stats in prepared.items())
+
+    lines.extend(['# HELP wallet_db_pool_acquire_seconds Time spent waiting for a pooled connection.',
+                  '# TYPE wallet_db_pool_acquire_seconds histogram'])
+    for pool, histogram in _pool_waits.items():
+        lines.extend(histogram.lines('wallet_db_pool_acquire_seconds', f'pool="{pool}"'))
+
+    lines.extend(['# HELP wallet_http_request_duration_seconds Latency of HTTP requests per route.',
+                  '# TYPE wallet_http_request_duration_seconds histogram'])
+    for (method, route, status), histogram in _routes.items():
+        lines.extend(histogram.lines('wallet_http_request_duration_seconds',
+                                     f'method="{method}",route="{_label(route)}",status="{status}"'))
+
+    return '\n'.join(lines) + '\n'
+
+
+class RouteMetricsMiddleware:
+    '''
+    ASGI middleware that records the latency of every HTTP request under its route template,
+    such as /api/transactions/{transaction_id}, so the label set stays bounded.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or ('/static' if scope['path'].startswith('/static/') else 'unmatched')
+            record_route(scope['method'], path, status, perf_counter() - start)
@@ -0,0 +1,56 @@
+import json
+import base64
+import binascii
+from datetime import datetime
+
+
+def encode_cursor(sort_by: str, sort: str, value, id: int) -> str:
+    '''
+    This function returns an opaque cursor that points right after the row with the given sort value and id.\n
+    Parameters:\n
+    - sort_by: str\n
+        - The column the rows are sorted by.\n
+    - sort: str\n
+        - 'asc' or 'desc'.\n
+    - value\n
+        - The value of the sort column in the last row of the page, a datetime or a number.\n
+    - id: int\n
+        - The id of the last row of the page, it breaks ties between equal sort values.
+    '''
+
+    if isinstance(value, datetime):
+        value = {'datetime': value.isoformat()}
+    payload = json.dumps({'sort_by': sort_by, 'sort': sort, 'value': value, 'id': id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_by: str, sort: str):
+    '''
+    This function returns the (value, id) pair a cursor points after.
+    It raises ValueError when the cursor is malformed or was issued for a different sort.
+    '''
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        value, id = payload['value'], int(payload['id'])
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value['datetime'])
+        elif not isinstance(value, (int, float)):
+            raise ValueError
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor.')
+
+    if payload.get('sort_by') != sort_by or payload.get('sort') != sort:
+        raise ValueError('The cursor was issued for a different sort, start again without it.')
+
+    return value, id
+
+
+def keyset_condition(column: str, sort: str, first_parameter: int) -> str:
+    '''
+    This function returns the WHERE condition for the rows after a cursor, for example
+    (transaction_date, id) > ($2, $3). With an index on (..., column, id) it is an index range scan.
+    '''
+
+    operator = '<' if sort == 'desc' else '>'
+    return f'({column}, id) {operator} (${first_parameter}, ${first_parameter + 1})'
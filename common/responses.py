@@ -21,6 +21,11 @@ class NoContent(Response):
         super().__init__(status_code=204)
 
 
+class Conflict(Response):
+    def __init__(self, content=''):
+        super().__init__(status_code=409, content=content)
+
+
 class InternalServerError(Response):
     def __init__(self):
         super().__init__(status_code=500)
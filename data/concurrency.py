@@ -0,0 +1,69 @@
+import os
+import asyncio
+import inspect
+from contextvars import ContextVar
+from data.connection import current_request_connection, own_request_connection
+from data.unit_of_work import current_unit_of_work
+
+
+MAX_CONCURRENT_QUERIES = int(os.getenv('DB_MAX_CONCURRENT_QUERIES', 3))
+
+_in_fan_out: ContextVar[bool] = ContextVar('in_fan_out', default=False)
+
+
+async def run_concurrently(*awaitables) -> list:
+    '''
+    This function runs independent service calls at the same time and returns their results in order,
+    like asyncio.gather: sender, receiver = await run_concurrently(get_user(1), get_user(2)).\n
+    Every call runs on a pooled connection of its own, as one connection can only run one query at a time.
+    At most DB_MAX_CONCURRENT_QUERIES (default 3) of them run at once per request, so a single request
+    cannot take the whole pool. If one call fails, the others are cancelled and the error is raised.\n
+    The calls run one after another inside a unit of work, which has to keep all its queries on its
+    own connection, and inside another run_concurrently call, which already holds the request's slots.
+    '''
+
+    if len(awaitables) < 2 or current_unit_of_work() is not None or _in_fan_out.get():
+        try:
+            return [await awaitable for awaitable in awaitables]
+        finally:
+            _close_unstarted(awaitables)
+
+    scope = current_request_connection()
+    if scope is None:
+        limit = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    else:
+        if scope.fan_out_limit is None:
+            scope.fan_out_limit = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+        limit = scope.fan_out_limit
+
+    tasks = [asyncio.ensure_future(_run_on_own_connection(awaitable, limit, scope is not None))
+             for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # Let the cancelled calls give their connections back before the error goes up.
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _run_on_own_connection(awaitable, limit: asyncio.Semaphore, in_request: bool):
+    # Runs in its own task, so the context variables set here don't leak into the request.
+    _in_fan_out.set(True)
+    try:
+        async with limit:
+            if not in_request:
+                # Outside a request every query borrows a connection from the pool anyway.
+                return await awaitable
+            async with own_request_connection():
+                return await awaitable
+    finally:
+        _close_unstarted((awaitable,))
+
+
+def _close_unstarted(awaitables):
+    # A call cancelled before it got a slot was never started; closing it avoids the "never awaited" warning.
+    for awaitable in awaitables:
+        if inspect.iscoroutine(awaitable) and inspect.getcoroutinestate(awaitable) == inspect.CORO_CREATED:
+            awaitable.close()
@@ -1,20 +1,317 @@
 import os
+import asyncio
 import asyncpg
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from common.metrics import record_pool_wait
 
 
-async def _get_connection_pool():
+_pool: asyncpg.Pool | None = None
+_pool_lock = asyncio.Lock()
+
+REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 2))
+REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 1))
+
+# A replica that has replayed everything it received is up to date, even if the primary has been idle for a while.
+replica_lag_query = '''SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                                   ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                              END'''
+
+
+class WalletConnection(asyncpg.Connection):
+    '''
+    asyncpg connection that keeps the statements prepared for it from data.statements.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = {}
+
+
+class Replica:
+    '''
+    A read replica pool together with its last measured replication lag in seconds.
+    '''
+
+    def __init__(self, dsn: str, pool: asyncpg.Pool):
+        self.dsn = dsn
+        self.pool = pool
+        self.lag: float | None = None
+        self.healthy = False
+
+
+_replicas: list[Replica] = []
+_replica_monitor: asyncio.Task | None = None
+_next_replica = 0
+
+
+def _replica_dsns() -> list[str]:
+    return [dsn.strip() for dsn in os.getenv('DB_REPLICA_DSNS', '').split(',') if dsn.strip()]
+
+
+async def create_connection_pool() -> asyncpg.Pool | None:
+    '''
+    This function creates the application-wide connection pool.\n
+    It is called once from the FastAPI lifespan handler; asyncpg opens DB_MIN_SIZE connections up front,
+    so the first requests don't pay for the connection handshake.\n
+    When DB_REPLICA_DSNS lists read replicas (comma separated DSNs), a pool is created for each of them as well.
+    '''
+    global _pool
+
+    async with _pool_lock:
+        if _pool is not None:
+            return _pool
+        try:
+            _pool = await asyncpg.create_pool(
+                user=os.getenv('DB_USER', 'postgres'),
+                password=os.getenv('DB_PASSWORD', '123456'),
+                host=os.getenv('DB_HOST', 'postgres'),
+                port=int(os.getenv('DB_PORT', 5432)),
+                database=os.getenv('DB_NAME', 'e_wallet'),
+                min_size=int(os.getenv('DB_MIN_SIZE', 1)),
+                max_size=int(os.getenv('DB_MAX_SIZE', 10)),
+                connection_class=WalletConnection
+            )
+            print("Connection pool created!")
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return None
+
+        await _create_replica_pools()
+        return _pool
+
+
+async def _create_replica_pools():
+    global _replica_monitor
+
+    for dsn in _replica_dsns():
+        try:
+            pool = await asyncpg.create_pool(
+                dsn=dsn,
+                min_size=int(os.getenv('DB_MIN_SIZE', 1)),
+                max_size=int(os.getenv('DB_MAX_SIZE', 10)),
+                connection_class=WalletConnection
+            )
+        except Exception as e:
+            print(f"Replica {dsn} is not available: {e}")
+            continue
+        replica = Replica(dsn, pool)
+        await _check_replica(replica)
+        _replicas.append(replica)
+
+    if _replicas:
+        print(f"{len(_replicas)} replica pool(s) created!")
+        _replica_monitor = asyncio.create_task(_monitor_replicas())
+
+
+async def _check_replica(replica: Replica):
+    # A replica that can't be reached or lags behind is skipped until a later check finds it healthy again.
+    try:
+        async with replica.pool.acquire() as conn:
+            replica.lag = float(await conn.fetchval(replica_lag_query))
+        replica.healthy = replica.lag <= REPLICA_MAX_LAG
+    except Exception:
+        replica.lag = None
+        replica.healthy = False
+
+
+async def _monitor_replicas():
+    while True:
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+        await asyncio.gather(*(_check_replica(replica) for replica in _replicas))
+
+
+async def close_connection_pool():
+    '''
+    This function closes the application-wide connection pool and the replica pools on shutdown.
+    '''
+    global _pool, _replica_monitor
+
+    async with _pool_lock:
+        if _replica_monitor is not None:
+            _replica_monitor.cancel()
+            _replica_monitor = None
+        replicas = list(_replicas)
+        _replicas.clear()
+        for replica in replicas:
+            await replica.pool.close()
+
+        if _pool is None:
+            return
+        await _pool.close()
+        _pool = None
+        print("Connection pool closed!")
+
+
+async def get_connection_pool() -> asyncpg.Pool | None:
+    '''
+    This function returns the application-wide connection pool.\n
+    The pool is normally created by the lifespan handler in main.py. Code running outside the
+    application (scripts, shells) creates it lazily on first use.
+    '''
+    if _pool is not None:
+        return _pool
+
+    return await create_connection_pool()
+
+
+_use_primary: ContextVar[bool] = ContextVar('use_primary', default=False)
+
+
+@asynccontextmanager
+async def use_primary():
+    '''
+    Reads made inside this block go to the primary, for code that must see writes that a replica may not have yet.
+    '''
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def _choose_replica() -> Replica | None:
+    global _next_replica
+
+    healthy = [replica for replica in _replicas if replica.healthy]
+    if not healthy:
+        return None
+    _next_replica = (_next_replica + 1) % len(healthy)
+    return healthy[_next_replica]
+
+
+async def get_read_pool() -> asyncpg.Pool | None:
+    '''
+    This function returns the pool a read-only query should run on: a healthy replica, round robin,
+    unless the read is pinned to the primary or no replica is within DB_REPLICA_MAX_LAG seconds.
+    '''
+    if not _use_primary.get():
+        scope = current_request_connection()
+        # Once a request has used the primary, its later reads stay there so they see its own writes.
+        if scope is None or not scope.used_primary:
+            replica = _choose_replica()
+            if replica is not None:
+                return replica.pool
+
+    return await get_connection_pool()
+
+
+class RequestConnection:
+    '''
+    The connections shared by everything that runs while one HTTP request is handled, one per pool.\n
+    They are acquired on first use only, so requests that never touch the database
+    don't take a connection, and they are released once the request is done.
+    '''
+
+    def __init__(self):
+        self._connections = {}
+        self._locks = {}
+        self.used_primary = False
+        # Bounds the queries of the request that data.concurrency runs at the same time, created on first use.
+        self.fan_out_limit: asyncio.Semaphore | None = None
+
+    @asynccontextmanager
+    async def connection(self, pool: asyncpg.Pool | None = None):
+        if pool is None:
+            pool = await get_connection_pool()
+            if pool is None:
+                raise RuntimeError("Failed to create connection pool")
+        if pool is _pool:
+            self.used_primary = True
+
+        # asyncpg allows one operation at a time per connection, so concurrent callers take turns.
+        lock = self._locks.setdefault(pool, asyncio.Lock())
+        async with lock:
+            conn = self._connections.get(pool)
+            if conn is None:
+                conn = self._connections[pool] = await _timed_acquire(pool)
+            yield conn
+
+    async def release(self):
+        connections, self._connections = self._connections, {}
+        for pool, connection in connections.items():
+            await pool.release(connection)
+
+
+_request_connection: ContextVar[RequestConnection | None] = ContextVar('request_connection', default=None)
+
+
+def current_request_connection() -> RequestConnection | None:
+    return _request_connection.get()
+
+
+async def request_connection_scope():
+    '''
+    FastAPI dependency that opens a connection scope for the current request.\n
+    The query helpers in data.database_queries find the scope through a context variable, so the
+    services don't need to pass the connection around.
+    '''
+    scope = RequestConnection()
+    token = _request_connection.set(scope)
+    try:
+        yield scope
+    finally:
+        _request_connection.reset(token)
+        await scope.release()
+
+
+@asynccontextmanager
+async def own_request_connection():
+    '''
+    This function gives the code inside the block a connection scope of its own, so its queries can run
+    at the same time as the rest of the request instead of waiting for the request's connection.\n
+    The scope follows the request to the primary if the request already used it, and the other way round.
+    '''
+    parent = current_request_connection()
+    scope = RequestConnection()
+    scope.used_primary = parent is not None and parent.used_primary
+    token = _request_connection.set(scope)
+    try:
+        yield scope
+    finally:
+        _request_connection.reset(token)
+        await scope.release()
+        if parent is not None and scope.used_primary:
+            parent.used_primary = True
+
+
+@asynccontextmanager
+async def acquire_connection(readonly: bool = False):
+    '''
+    This function yields the connection of the current request scope if there is one,
+    otherwise it borrows a connection from the pool for the duration of the block.\n
+    With readonly=True the connection may come from a read replica, see get_read_pool.
+    '''
+    pool = await get_read_pool() if readonly else await get_connection_pool()
+    if pool is None:
+        raise RuntimeError("Failed to create connection pool")
+
+    scope = current_request_connection()
+    if scope is not None:
+        async with scope.connection(pool) as conn:
+            yield conn
+        return
+
+    async with pooled_connection(pool) as conn:
+        yield conn
+
+
+async def _timed_acquire(pool: asyncpg.Pool):
+    start = perf_counter()
+    conn = await pool.acquire()
+    record_pool_wait('primary' if pool is _pool else 'replica', perf_counter() - start)
+    return conn
+
+
+@asynccontextmanager
+async def pooled_connection(pool: asyncpg.Pool):
+    '''
+    This function borrows a connection from the given pool for the duration of the block
+    and records how long it waited for it.
+    '''
+    conn = await _timed_acquire(pool)
     try:
-        pool = await asyncpg.create_pool(
-            user=os.getenv('DB_USER', 'postgres'),
-            password=os.getenv('DB_PASSWORD', '123456'),
-            host=os.getenv('DB_HOST', 'postgres'), 
-            port=int(os.getenv('DB_PORT', 5432)),
-            database=os.getenv('DB_NAME', 'e_wallet'),
-            min_size=int(os.getenv('DB_MIN_SIZE', 1)),
-            max_size=int(os.getenv('DB_MAX_SIZE', 10))
-        )
-        print("Connection pool created!")
-        return pool
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
\ No newline at end of file
+        yield conn
+    finally:
+        await pool.release(conn)
@@ -1,41 +1,178 @@
-from data.connection import _get_connection_pool
+import re
+from contextlib import asynccontextmanager
+from time import perf_counter
+from common.metrics import record_statement, record_statement_error
+from data.connection import acquire_connection, get_read_pool, pooled_connection
+from data.loaders import clear_loaders
+from data.slow_queries import log_if_slow
+from data.unit_of_work import current_unit_of_work
+from data.statements import Statement, run_prepared, prepared_statement, rows_from_status
+
+
+_locking_clause = re.compile(r'\bFOR\s+(UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b', re.IGNORECASE)
+
+
+def _is_read_only(sql: str) -> bool:
+    # read_query is also used for INSERT/UPDATE ... RETURNING and locking reads, those must stay on the primary.
+    statement = sql.lstrip().upper()
+    return statement.startswith(('SELECT', 'WITH')) and not _locking_clause.search(sql) \
+        and not any(keyword in statement for keyword in ('INSERT ', 'UPDATE ', 'DELETE ', 'SETVAL('))
+
+
+@asynccontextmanager
+async def _acquire_connection(readonly: bool = False):
+    # Statements issued inside a unit of work join its transaction.
+    uow = current_unit_of_work()
+    if uow is not None:
+        yield uow.connection
+        return
+
+    async with acquire_connection(readonly=readonly) as conn:
+        yield conn
+
+
+async def _run(conn, method: str, sql: str, sql_params):
+    start = perf_counter()
+    try:
+        if isinstance(sql, Statement):
+            result = await run_prepared(conn, sql, method, sql_params)
+        else:
+            result = await getattr(conn, method)(sql, *sql_params)
+    except Exception:
+        record_statement_error(sql, perf_counter() - start)
+        raise
+
+    elapsed = perf_counter() - start
+    record_statement(sql, elapsed, _row_count(method, result))
+    log_if_slow(sql, sql_params, elapsed)
+    return result
+
+
+def _row_count(method: str, result) -> int:
+    if method == 'execute':
+        return rows_from_status(result)
+    if method == 'fetchrow':
+        return 0 if result is None else 1
+    return len(result)
 
 
 async def read_query(sql: str, sql_params=()):
-    pool = await _get_connection_pool()
-    if pool is None:
-        raise RuntimeError("Failed to create connection pool")
+    '''
+    Plain SELECT statements may run on a read replica, see data.connection.get_read_pool.
+    Wrap the call in data.connection.use_primary() when it has to see a write made just before.
+    '''
+    readonly = _is_read_only(sql)
+    if not readonly:
+        clear_loaders()
 
-    async with pool.acquire() as conn:
-        result = await conn.fetch(sql, *sql_params)
+    async with _acquire_connection(readonly=readonly) as conn:
+        result = await _run(conn, 'fetch', sql, sql_params)
         return result
 
 
 async def insert_query(sql: str, sql_params=()) -> int:
-    pool = await _get_connection_pool()
-    if pool is None:
-        raise RuntimeError("Failed to create connection pool")
-
-    async with pool.acquire() as conn:
-        result = await conn.fetchrow(sql, *sql_params)
+    clear_loaders()
+    async with _acquire_connection() as conn:
+        result = await _run(conn, 'fetchrow', sql, sql_params)
         return result['id'] if result and 'id' in result else None
 
 
 async def update_query(sql: str, sql_params=()) -> bool:
-    pool = await _get_connection_pool()
-    if pool is None:
-        raise RuntimeError("Failed to create connection pool")
-
-    async with pool.acquire() as conn:
-        result = await conn.execute(sql, *sql_params)
+    clear_loaders()
+    async with _acquire_connection() as conn:
+        result = await _run(conn, 'execute', sql, sql_params)
         return result
 
 
 async def delete_query(sql: str, sql_params=()) -> bool:
-    pool = await _get_connection_pool()
+    clear_loaders()
+    async with _acquire_connection() as conn:
+        result = await _run(conn, 'execute', sql, sql_params)
+        return result == "DELETE 1"
+
+
+async def insert_many_returning(sql: str, rows) -> list[int]:
+    '''
+    This function inserts many rows with a single unnest-array statement and returns their generated ids
+    in the order of rows.\n
+    The statement takes one array parameter per column and returns the ids in the order of the arrays. Numbering
+    the rows WITH ORDINALITY and drawing the ids before the insert maps every id to its row, for example:\n
+        WITH input AS (SELECT nextval(pg_get_serial_sequence('transactions', 'id')) AS id, input.*
+                       FROM unnest($1::float8[], $2::int[], $3::int[]) WITH ORDINALITY AS input(amount, sender_id, receiver_id, ordinality)),
+             inserted AS (INSERT INTO transactions(id, amount, sender_id, receiver_id)
+                          SELECT id, amount, sender_id, receiver_id FROM input)
+        SELECT id FROM input ORDER BY ordinality
+    '''
+    if not rows:
+        return []
+
+    clear_loaders()
+    columns = [list(column) for column in zip(*rows)]
+
+    async with _acquire_connection() as conn:
+        result = await _run(conn, 'fetch', sql, columns)
+        return [row['id'] for row in result]
+
+
+async def copy_records(table_name: str, records, columns) -> str:
+    '''
+    This function loads records into a table with COPY, using the binary protocol.
+    '''
+    clear_loaders()
+    async with _acquire_connection() as conn:
+        return await conn.copy_records_to_table(table_name, records=records, columns=list(columns))
+
+
+async def copy_file_to_table(table_name: str, source, columns, format: str = 'binary') -> str:
+    '''
+    This function loads a file or a file-like object into a table with COPY, without decoding it first.
+    '''
+    clear_loaders()
+    async with _acquire_connection() as conn:
+        return await conn.copy_to_table(table_name, source=source, columns=list(columns), format=format)
+
+
+async def copy_query_to(sql: str, output, format: str = 'csv', header: bool = False) -> str:
+    '''
+    This function writes the result of a query with COPY ... TO STDOUT.\n
+    output is a path, a file-like object or a coroutine function that receives every chunk of bytes.
+    '''
+    async with _acquire_connection(readonly=True) as conn:
+        return await conn.copy_from_query(str(sql), output=output, format=format,
+                                          header=header if format == 'csv' else None)
+
+
+async def stream_query(sql: str, sql_params=(), batch_size: int = 500):
+    '''
+    This function yields the rows of a query one by one, fetching them from a server-side cursor
+    batch_size rows at a time, so large results are never held in memory at once.\n
+    Outside a unit of work it runs on its own pooled connection inside a read-only transaction,
+    which keeps the request connection free for other queries while the rows are consumed.
+    That connection comes from a read replica when one is healthy.
+    '''
+    uow = current_unit_of_work()
+    if uow is not None:
+        async for row in _cursor(uow.connection, sql, sql_params, batch_size):
+            yield row
+        return
+
+    pool = await get_read_pool()
     if pool is None:
         raise RuntimeError("Failed to create connection pool")
 
-    async with pool.acquire() as conn:
-        result = await conn.execute(sql, *sql_params)
-        return result == "DELETE 1"
+    async with pooled_connection(pool) as conn:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            async for row in _cursor(conn, sql, sql_params, batch_size):
+                yield row
+
+
+async def _cursor(conn, sql: str, sql_params, batch_size: int):
+    if isinstance(sql, Statement):
+        prepared = await prepared_statement(conn, sql)
+        if prepared is not None:
+            async for row in prepared.cursor(*sql_params, prefetch=batch_size):
+                yield row
+            return
+
+    async for row in conn.cursor(sql, *sql_params, prefetch=batch_size):
+        yield row
@@ -0,0 +1,156 @@
+import asyncio
+from contextvars import ContextVar, copy_context
+
+
+class DataLoader:
+    '''
+    Batches and caches loads of rows by key for the duration of one request.\n
+    Keys requested during the same event loop tick are fetched together with one call of batch_load,
+    which receives a list of keys and returns a dict of the found values by key. Every key is fetched at
+    most once per request, later loads get the cached value; missing keys load as None.\n
+    A batch runs with the context, and so the connections, of one of the callers that still wait for it.
+    If that caller is cancelled, the batch is cancelled too and the keys others wait for go in a new batch.
+    '''
+
+    def __init__(self, batch_load):
+        self._batch_load = batch_load
+        self._cache: dict = {}
+        self._queue: list = []
+        # The event loop keeps only weak references to tasks, the batches in flight are kept here.
+        self._tasks: set = set()
+
+    def load(self, key) -> asyncio.Future:
+        future = self._cache.get(key)
+        if future is not None and not future.cancelled():
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = self._cache[key] = loop.create_future()
+        self._queue.append((key, future, copy_context()))
+        if len(self._queue) == 1:
+            # Runs after every coroutine that is ready in this tick had the chance to ask for its keys.
+            loop.call_soon(self._dispatch)
+        return future
+
+    async def load_many(self, keys) -> dict:
+        keys = list(dict.fromkeys(keys))
+        values = await asyncio.gather(*(self.load(key) for key in keys))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def prime(self, key, value):
+        future = self._cache.get(key)
+        if future is None or future.done():
+            future = self._cache[key] = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+
+    def clear(self):
+        # Loads in flight keep their futures, only settled values are dropped.
+        self._cache = {key: future for key, future in self._cache.items() if not future.done()}
+
+    def _dispatch(self):
+        queue, self._queue = self._queue, []
+        batch = [(key, future, context) for key, future, context in queue if not future.done()]
+        if not batch:
+            return
+
+        _, owner, context = batch[0]
+        task = asyncio.get_running_loop().create_task(self._fetch(batch), context=context)
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._batch_done(task, batch))
+        # Once the caller is cancelled its connections are released, the batch must not use them any longer.
+        owner.add_done_callback(lambda future: task.cancel() if future.cancelled() else None)
+
+    async def _fetch(self, batch: list):
+        keys = [key for key, _, _ in batch]
+        try:
+            values = await self._batch_load(keys)
+        except Exception as e:
+            for key, future, _ in batch:
+                # A failed load is not cached, the next load of the key tries again.
+                if self._cache.get(key) is future:
+                    del self._cache[key]
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future, _ in batch:
+            if not future.done():
+                future.set_result(values.get(key))
+
+    def _batch_done(self, task: asyncio.Task, batch: list):
+        self._tasks.discard(task)
+        if not task.cancelled():
+            return
+
+        waiting = [entry for entry in batch if not entry[1].done()]
+        if not batch[0][1].cancelled():
+            for _, future, _ in waiting:
+                future.cancel()
+            return
+
+        # The caller the batch ran for was cancelled, the keys the others wait for go in a new batch.
+        if waiting and not self._queue:
+            asyncio.get_running_loop().call_soon(self._dispatch)
+        self._queue.extend(waiting)
+
+
+_request_loaders: ContextVar[dict | None] = ContextVar('request_loaders', default=None)
+
+
+async def request_loaders_scope():
+    '''
+    FastAPI dependency that gives the current request its own set of loaders.
+    '''
+    token = _request_loaders.set({})
+    try:
+        yield
+    finally:
+        _request_loaders.reset(token)
+
+
+def get_loader(name: str, batch_load) -> DataLoader | None:
+    '''
+    This function returns the loader with the given name of the current request, creating it on first use,
+    or None outside a request.
+    '''
+    loaders = _request_loaders.get()
+    if loaders is None:
+        return None
+
+    loader = loaders.get(name)
+    if loader is None:
+        loader = loaders[name] = DataLoader(batch_load)
+    return loader
+
+
+async def load(name: str, batch_load, key):
+    '''
+    This function loads one value by key through the request loader, or straight from batch_load outside a request.
+    '''
+    loader = get_loader(name, batch_load)
+    if loader is None:
+        return (await batch_load([key])).get(key)
+    return await loader.load(key)
+
+
+async def load_many(name: str, batch_load, keys) -> dict:
+    '''
+    This function loads many values by key through the request loader, or straight from batch_load outside a request.
+    Keys that are not found are left out of the result.
+    '''
+    loader = get_loader(name, batch_load)
+    if loader is None:
+        keys = list(dict.fromkeys(keys))
+        return await batch_load(keys) if keys else {}
+    return await loader.load_many(keys)
+
+
+def clear_loaders():
+    '''
+    This function drops the values cached by the loaders of the current request. It is called after every
+    write, so a request never sees a row as it was before its own change.
+    '''
+    loaders = _request_loaders.get()
+    if loaders:
+        for loader in loaders.values():
+            loader.clear()
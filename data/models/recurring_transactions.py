@@ -12,10 +12,11 @@ class RecurringTransaction(BaseModel):
     sender_id: Optional[int] = None
     receiver_id: int
     categories_id: Optional[int] = None
+    version: Optional[int] = None
 
     @classmethod
     def from_query_result(cls, id, recurring_transaction_date, next_payment, status,
-                          condition, amount, sender_id, receiver_id, categories_id,):
+                          condition, amount, sender_id, receiver_id, categories_id, version=None):
         return cls(
             id=id,
             recurring_transaction_date=recurring_transaction_date,
@@ -26,4 +27,5 @@ class RecurringTransaction(BaseModel):
             sender_id=sender_id,
             receiver_id=receiver_id,
             categories_id=categories_id,
+            version=version
         )
\ No newline at end of file
@@ -13,10 +13,11 @@ class Transaction(BaseModel):
     sender_id: Optional[int] = None
     receiver_id: int
     cards_id: Optional[int] = None
+    version: Optional[int] = None
 
     @classmethod
     def from_query_result(cls, id, status, condition, transaction_date, amount, 
-                          category_name, sender_id, receiver_id, cards_id):
+                          category_name, sender_id, receiver_id, cards_id, version=None):
         return cls(
             id=id,
             status=status,
@@ -26,5 +27,6 @@ class Transaction(BaseModel):
             category_name=category_name,
             sender_id=sender_id,
             receiver_id=receiver_id,
-            cards_id=cards_id
+            cards_id=cards_id,
+            version=version
         )
\ No newline at end of file
@@ -0,0 +1,59 @@
+import json
+from pydantic import BaseModel
+from typing import Optional
+from data.models.user import User
+from data.models.cards import Card
+from data.models.categories import Category
+
+
+class TransferPrecheck(BaseModel):
+    sender: Optional[User] = None
+    receiver: Optional[User] = None
+    is_contact: bool = False
+    card: Optional[Card] = None
+    category: Optional[Category] = None
+
+    @classmethod
+    def from_query_result(cls, sender, receiver, is_contact, card, category):
+        # The rows come as JSON objects from row_to_json, None when there is no such row.
+        return cls(
+            sender=User.model_validate_json(sender) if sender else None,
+            receiver=User.model_validate_json(receiver) if receiver else None,
+            is_contact=is_contact,
+            card=Card.model_validate_json(card) if card else None,
+            category=Category.model_validate_json(category) if category else None
+        )
+
+    @property
+    def sender_blocked(self) -> bool:
+        return self.sender is not None and self.sender.status == 'blocked'
+
+    @property
+    def receiver_available(self) -> bool:
+        return self.receiver is not None and self.receiver.status not in ('pending', 'blocked')
+
+
+class BatchTransferPrecheck(BaseModel):
+    sender: Optional[User] = None
+    card: Optional[Card] = None
+    receivers: dict[int, User] = {}
+    contacts: set[int] = set()
+
+    @classmethod
+    def from_query_result(cls, sender, card, receivers):
+        # The receivers come as a JSON array from json_agg, each with an is_contact flag; None when none was found.
+        receivers = json.loads(receivers) if receivers else []
+        return cls(
+            sender=User.model_validate_json(sender) if sender else None,
+            card=Card.model_validate_json(card) if card else None,
+            receivers={receiver['id']: User.model_validate(receiver) for receiver in receivers},
+            contacts={receiver['id'] for receiver in receivers if receiver['is_contact']}
+        )
+
+    @property
+    def sender_blocked(self) -> bool:
+        return self.sender is not None and self.sender.status == 'blocked'
+
+    def receiver_available(self, receiver_id: int) -> bool:
+        receiver = self.receivers.get(receiver_id)
+        return receiver is not None and receiver.status not in ('pending', 'blocked')
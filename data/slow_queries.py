@@ -0,0 +1,72 @@
+import os
+import sys
+import asyncio
+import logging
+import random
+from common.metrics import normalize_statement
+from data.connection import get_connection_pool, pooled_connection
+
+
+logger = logging.getLogger('wallet.slow_queries')
+
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 500)) / 1000
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1))
+MAX_PENDING_EXPLAINS = 2
+
+_pending_explains: set[asyncio.Task] = set()
+
+# Frames from these modules are plumbing, the caller worth reporting is the first frame outside them.
+_plumbing_modules = ('data.', 'common.metrics', 'asyncio', 'contextlib')
+
+
+def redact(sql_params) -> list[str]:
+    '''
+    This function describes the statement parameters by type (and length for strings), without their values.
+    '''
+    return [f'<{type(value).__name__}:{len(value)}>' if isinstance(value, (str, bytes, list, tuple))
+            else f'<{type(value).__name__}>' for value in sql_params]
+
+
+def calling_function() -> str:
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith(_plumbing_modules):
+            return f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+def log_if_slow(sql: str, sql_params, elapsed: float):
+    '''
+    This function logs a statement that took longer than SLOW_QUERY_THRESHOLD_MS, together with its redacted
+    parameters and the function that issued it.\n
+    For a sample of them (SLOW_QUERY_EXPLAIN_SAMPLE_RATE) the query plan is captured in the background
+    with EXPLAIN (ANALYZE off, FORMAT JSON), which plans the statement without running it again.
+    '''
+    if elapsed < SLOW_QUERY_THRESHOLD:
+        return
+
+    statement = normalize_statement(sql)
+    caller = calling_function()
+    logger.warning('Slow query (%.1f ms) from %s: %s params=%s', elapsed * 1000, caller, statement, redact(sql_params))
+
+    if random.random() < SLOW_QUERY_EXPLAIN_SAMPLE_RATE and len(_pending_explains) < MAX_PENDING_EXPLAINS:
+        task = asyncio.create_task(_explain(str(sql), tuple(sql_params), statement, caller))
+        _pending_explains.add(task)
+        task.add_done_callback(_pending_explains.discard)
+
+
+async def _explain(sql: str, sql_params, statement: str, caller: str):
+    try:
+        pool = await get_connection_pool()
+        if pool is None:
+            return
+        # A connection of its own, the request connection may be busy or already released.
+        async with pooled_connection(pool) as conn:
+            plan = await conn.fetchval(f'EXPLAIN (ANALYZE off, FORMAT JSON) {sql}', *sql_params)
+    except Exception as e:
+        logger.info('Could not explain slow query from %s: %s (%s)', caller, statement, e)
+        return
+
+    logger.warning('Plan of slow query from %s: %s\n%s', caller, statement, plan)
@@ -0,0 +1,129 @@
+import asyncpg
+from time import perf_counter
+
+
+class Statement(str):
+    '''
+    SQL text registered under a name.\n
+    It is still a str, so it can be passed anywhere plain SQL is accepted, but the query helpers
+    in data.database_queries execute it through a statement prepared once per connection,
+    the first time it runs there.
+    '''
+
+    def __new__(cls, name: str, sql: str):
+        statement = super().__new__(cls, sql)
+        statement.name = name
+        statement.calls = 0
+        statement.total_time = 0.0
+        statement.rows = 0
+        return statement
+
+    def record(self, elapsed: float, rows: int):
+        self.calls += 1
+        self.total_time += elapsed
+        self.rows += rows
+
+
+_statements: dict[str, Statement] = {}
+
+
+def register_statement(name: str, sql: str) -> Statement:
+    '''
+    This function registers a named SQL statement and returns it.\n
+    Parameters:\n
+    - name: str\n
+        - A unique name for the statement, normally the name of the module-level constant.\n
+    - sql: str\n
+        - The SQL text of the statement.
+    '''
+
+    registered = _statements.get(name)
+    if registered is not None:
+        if registered != sql:
+            raise ValueError(f'Statement {name} is already registered with different SQL.')
+        return registered
+
+    statement = Statement(name, sql)
+    _statements[name] = statement
+    return statement
+
+
+def registered_statements() -> list[Statement]:
+    return list(_statements.values())
+
+
+def statement_stats() -> dict[str, dict]:
+    '''
+    This function returns the calls, total time in seconds and rows of every registered statement.
+    '''
+    return {
+        statement.name: {
+            "calls": statement.calls,
+            "total_time": statement.total_time,
+            "rows": statement.rows
+        } for statement in _statements.values()
+    }
+
+
+async def prepared_statement(conn, statement: Statement):
+    '''
+    This function returns the prepared handle of a registered statement on the given connection,
+    preparing it first if needed, or None if the connection doesn't keep prepared statements.
+    '''
+    cache = getattr(conn, 'prepared_statements', None)
+    if cache is None:
+        return None
+
+    prepared = cache.get(statement.name)
+    if prepared is None:
+        prepared = await _prepare(conn, statement)
+    return prepared
+
+
+async def _prepare(conn, statement: Statement):
+    prepared = await conn.prepare(str(statement))
+    conn.prepared_statements[statement.name] = prepared
+    return prepared
+
+
+def rows_from_status(status: str) -> int:
+    count = status.rsplit(' ', 1)[-1] if status else ''
+    return int(count) if count.isdigit() else 0
+
+
+async def run_prepared(conn, statement: Statement, method: str, sql_params=()):
+    '''
+    This function executes a registered statement by its prepared handle and records its stats.\n
+    Parameters:\n
+    - conn\n
+        - The connection to run the statement on.\n
+    - statement: Statement\n
+        - The registered statement.\n
+    - method: str\n
+        - 'fetch', 'fetchrow' or 'execute', with the same results as the asyncpg connection methods.\n
+    - sql_params\n
+        - The statement parameters.
+    '''
+
+    prepared = await prepared_statement(conn, statement)
+    if prepared is None:
+        return await getattr(conn, method)(str(statement), *sql_params)
+
+    start = perf_counter()
+    try:
+        rows = await prepared.fetch(*sql_params)
+    except asyncpg.InvalidCachedStatementError:
+        # The schema changed under the prepared statement, prepare it again.
+        prepared = await _prepare(conn, statement)
+        rows = await prepared.fetch(*sql_params)
+    elapsed = perf_counter() - start
+
+    if method == 'execute':
+        status = prepared.get_statusmsg()
+        statement.record(elapsed, rows_from_status(status))
+        return status
+
+    statement.record(elapsed, len(rows))
+    if method == 'fetchrow':
+        return rows[0] if rows else None
+    return rows
@@ -0,0 +1,99 @@
+import asyncio
+import functools
+import asyncpg
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from data.connection import acquire_connection
+
+
+RETRYABLE_ERRORS = (asyncpg.SerializationError, asyncpg.DeadlockDetectedError)
+
+
+class StaleVersionError(Exception):
+    '''
+    Raised when a row is updated with the version it had when the client read it, but it has been changed since.
+    Unlike a serialization failure it is not retried, the client has to look at the new row first.
+    '''
+
+
+class UnitOfWork:
+    '''
+    A single connection with an open transaction.\n
+    The query helpers in data.database_queries run on it while the unit of work is active,
+    so everything inside the block commits or rolls back together.
+    '''
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def savepoint(self):
+        '''
+        This function returns a nested transaction. asyncpg issues it as a SAVEPOINT, so a failure
+        inside it only rolls back the statements made since the savepoint.
+        '''
+        return self.connection.transaction()
+
+
+_current_unit_of_work: ContextVar[UnitOfWork | None] = ContextVar('current_unit_of_work', default=None)
+
+
+def current_unit_of_work() -> UnitOfWork | None:
+    return _current_unit_of_work.get()
+
+
+@asynccontextmanager
+async def unit_of_work(isolation: str = 'repeatable_read'):
+    '''
+    This function opens a unit of work: async with unit_of_work() as uow.\n
+    Parameters:\n
+    - isolation: str\n
+        - The transaction isolation level. Default is 'repeatable_read', so concurrent updates of the
+          same row fail with a serialization error instead of silently overwriting each other.\n
+    A unit of work opened inside another one becomes a savepoint of the outer transaction.
+    '''
+
+    outer = current_unit_of_work()
+    if outer is not None:
+        async with outer.savepoint():
+            yield outer
+        return
+
+    async with acquire_connection() as conn:
+        async with conn.transaction(isolation=isolation):
+            uow = UnitOfWork(conn)
+            token = _current_unit_of_work.set(uow)
+            try:
+                yield uow
+            finally:
+                _current_unit_of_work.reset(token)
+
+
+def retry_on_serialization_failure(attempts: int = 3, backoff: float = 0.05):
+    '''
+    This decorator re-runs a coroutine function that opens a unit of work when the database
+    aborts it with a serialization failure or a deadlock.\n
+    Parameters:\n
+    - attempts: int\n
+        - How many times the function is run before the error is raised. Default is 3.\n
+    - backoff: float\n
+        - The delay in seconds before the first retry; it doubles on every further retry.\n
+    Calls made inside an already open unit of work are not retried, the outer one owns the retry.
+    '''
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if current_unit_of_work() is not None:
+                return await func(*args, **kwargs)
+
+            for attempt in range(attempts):
+                try:
+                    return await func(*args, **kwargs)
+                except RETRYABLE_ERRORS:
+                    if attempt == attempts - 1:
+                        raise
+                    await asyncio.sleep(backoff * 2 ** attempt)
+
+        return wrapper
+
+    return decorator
@@ -1,9 +1,13 @@
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Depends
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, PlainTextResponse
 
+from common.metrics import RouteMetricsMiddleware, render_metrics
 from common.wallet_info import detailed_info
+from data.connection import create_connection_pool, close_connection_pool, request_connection_scope
+from data.loaders import request_loaders_scope
 from routers.admin import admin_router
 from routers.cards import cards_router
 from routers.categories import categories_router
@@ -14,7 +18,16 @@ from routers.recurring_transactions import recurring_transactions_router
 from routers.contacts import contacts_router
 import uvicorn
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.pool = await create_connection_pool()
+    yield
+    await close_connection_pool()
+
+
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(request_connection_scope), Depends(request_loaders_scope)])
+app.add_middleware(RouteMetricsMiddleware)
 app.include_router(categories_router)
 app.include_router(users_router)
 app.include_router(transactions_router)
@@ -34,5 +47,11 @@ async def home_page(request: Request):
     return templates.TemplateResponse("home_page.html", {"request": request, "detailed_info": detailed_info})
 
 
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -1,8 +1,11 @@
+import json
 from fastapi import APIRouter, status, HTTPException, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from common import authorization
 from schemas.transactions import TransactionFilters
 from services import admin_services
-from services.admin_services import view_user_transactions, pending_transactions
+from services.admin_services import view_user_transactions, stream_user_transactions, pending_transactions
 
 admin_router = APIRouter(prefix='/api/admin')
 
@@ -66,6 +69,31 @@ async def get_user_transactions_(
     return result
 
 
+@admin_router.get('/transactions/{user_id}/stream', tags=["Admin"])
+async def stream_user_transactions_(
+        user_id: int,
+        current_user: int = Depends(authorization.get_current_user),
+        filters: TransactionFilters = Depends()
+):
+    if await admin_services.check_if_not_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have admin permissions"
+        )
+
+    # Every matching transaction, limit and offset are ignored. The rows are read from a server-side cursor
+    # and sent as they come, so the whole history is never held in memory.
+    return StreamingResponse(_json_array(stream_user_transactions(user_id, filters)), media_type='application/json')
+
+
+async def _json_array(items):
+    separator = '['
+    async for item in items:
+        yield separator + json.dumps(jsonable_encoder(item))
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
 @admin_router.post('/deny/{user_id}', tags=["Admin"])
 async def deny_user_pending_transactions(
         user_id: int,
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends
 from typing import List
 from common.authorization import get_current_user
 from common.responses import BadRequest, NotFound
+from data.concurrency import run_concurrently
 from data.models.contacts import Contact
 from schemas.contacts import ContactsViewAll, ContactView
 from services import contacts_service, user_services
@@ -33,9 +34,11 @@ async def get_users_contacts(search: str | None = None,
          contact = [ContactsViewAll.contacts_view(username=username_contact)]
          return contact
 
+      users = await user_services.get_users_by_ids([users_contact.contact_user_id for users_contact in users_contacts])
+
       contacts_view = []
       for users_contact in users_contacts:
-         users_contact = await user_services.get_user_by_id(user_id=users_contact.contact_user_id)
+         users_contact = users.get(users_contact.contact_user_id)
             
          if not users_contact:
             return NotFound(content='This contact is not available.')
@@ -63,8 +66,8 @@ async def get_users_contact_by_id(contact_user_id: int,
    
    if await contacts_service.contact_id_exists(current_user=current_user,
                                                reciever_id=contact_user_id):
-      contact_view = await contacts_service.view_contact_by_id(contact_user_id=contact_user_id)
-      user_contact = await user_services.get_user_by_id(user_id=contact_user_id)
+      contact_view, user_contact = await run_concurrently(contacts_service.view_contact_by_id(contact_user_id=contact_user_id),
+                                                          user_services.get_user_by_id(user_id=contact_user_id))
       
       if contact_view is None:
          return NotFound(content='Required data not found.')
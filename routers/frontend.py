@@ -8,6 +8,7 @@ from schemas.cards import CardCreate
 from security import password_hashing
 from schemas.user import UserCreate
 from services import user_services
+from data.concurrency import run_concurrently
 from common.helper_functions import check_password, get_card_id_by_card_number
 from services.cards_services import create, delete
 
@@ -65,8 +66,8 @@ async def login_user(request: Request, email: str = Form(...), password: str = F
 
 @frontend_router.get("/profile", response_class=HTMLResponse, tags=['Frontend'])
 async def profile(request: Request, current_user: int = Depends(get_current_user)):
-    user_info = await user_services.view_profile(current_user)
-    card_info = await user_services.view(current_user)  # Fetch card and transaction info
+    user_info, card_info = await run_concurrently(user_services.view_profile(current_user),
+                                                  user_services.view(current_user))  # Fetch card and transaction info
     if not user_info:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return templates.TemplateResponse("profile.html", {"request": request, "user": user_info, "card_info": card_info})
@@ -103,8 +104,8 @@ async def deposit_funds(request: Request, amount: float = Form(...), current_use
                                           {"request": request, "error_message": "Minimum deposit is $25."})
 
     deposit_result = await user_services.deposit_money(current_user, int(amount))
-    if "successfully" not in deposit_result:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=deposit_result)
+    if not deposit_result.successful:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=deposit_result.message)
 
     return RedirectResponse(url="/profile?message=success", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -117,8 +118,8 @@ async def get_withdraw_form(request: Request, current_user: int = Depends(get_cu
 @frontend_router.post("/withdraw", response_class=HTMLResponse, tags=['Frontend'])
 async def withdraw_funds(request: Request, amount: float = Form(...), current_user: int = Depends(get_current_user)):
     withdraw_result = await user_services.withdraw_money(current_user, int(amount))
-    if "successfully" not in withdraw_result:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=withdraw_result)
+    if not withdraw_result.successful:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=withdraw_result.message)
     return JSONResponse(content={"message": "success"}, status_code=status.HTTP_200_OK)
 
 
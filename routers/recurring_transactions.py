@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, Query
-from common.responses import NotFound, BadRequest
+from fastapi import APIRouter, Depends, Query, Response
+from common.responses import NotFound, BadRequest, Conflict
 from common.authorization import get_current_user
+from common.idempotency import idempotent
+from data.concurrency import run_concurrently
+from data.unit_of_work import StaleVersionError
 from data.models.recurring_transactions import RecurringTransaction
 from schemas.recurring_transactions import RecurringTransactionViewAll, RecurringTransactionView
-from services import recurring_transactions_service, user_services, categories_service, cards_services, contacts_service
+from services import recurring_transactions_service, transfer_precheck_service, user_services, categories_service
 from datetime import datetime, timedelta
 from typing import List
 
@@ -18,10 +21,14 @@ async def get_users_recurring_transactions(sort: str | None = None,
                                            recurring_transactions_per_page: int = Query(default=5, gt=0),
                                            recurring_transaction_date: str | None = None,
                                            categories_id: int | None = None,
+                                           cursor: str | None = None,
+                                           response: Response = None,
                                            current_user: int = Depends(dependency=get_current_user)):
     '''
     This function returns a list of all the recurring transactions for the specified user - they are always 'outgoing'.\n
     It allows users to retrieve their recurring transactions with optional sorting, pagination, and filtering by date and category.\n
+    Sorting and pagination are done by the database; the X-Total-Count header holds the number of recurring transactions
+    that match the filters and the X-Next-Cursor header the cursor of the next page.\n
     Parameters:\n
     - sort: str | None\n
         - The sort order of the transactions. Acceptable values are 'asc' for ascending or 'desc' for descending.\n
@@ -35,45 +42,53 @@ async def get_users_recurring_transactions(sort: str | None = None,
         - Filter recurring transactions by a specific date.\n
     - categories_id: int | None\n
         - Filter recurring transactions by a specific category ID.\n
+    - cursor: str | None\n
+        - The X-Next-Cursor of the previous page. It takes the place of page and keeps deep pages as fast as the first one.\n
     - current_user: int\n
         - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
         - This parameter is used to ensure that the request is made by an authenticated user.
     '''
 
-    users_recurring_transactions = await recurring_transactions_service.view_all_recurring_transactions(current_user=current_user,
-                                                                                                        recurring_transaction_date=recurring_transaction_date,
-                                                                                                        categories_id=categories_id)
+    try:
+        users_recurring_transactions, total, next_cursor = await recurring_transactions_service.view_recurring_transactions_page(current_user=current_user,
+                                                                                                                              recurring_transaction_date=recurring_transaction_date,
+                                                                                                                              categories_id=categories_id,
+                                                                                                                              sort=sort,
+                                                                                                                              sort_by=sort_by,
+                                                                                                                              page=page,
+                                                                                                                              recurring_transactions_per_page=recurring_transactions_per_page,
+                                                                                                                              cursor=cursor)
+    except ValueError as e:
+        return BadRequest(content=str(e))
 
-    if users_recurring_transactions != [] or users_recurring_transactions != None:
-        recurring_transactions_view = []
-        for users_recurring_transaction in users_recurring_transactions:
-            sender = await user_services.get_user_by_id(user_id=users_recurring_transaction.sender_id)
-            receiver = await user_services.get_user_by_id(user_id=users_recurring_transaction.receiver_id)
-            category_name = await categories_service.get_category_by_id(category_id=users_recurring_transaction.categories_id)
+    if total == 0:
+        return NotFound(content=f'The required recurring transactions you are looking for are not available.')
 
-            if not sender or not receiver or not category_name:
-                return NotFound(content='Required data not found.')
-            
-            recurring_transactions_view.append(RecurringTransactionViewAll.recurring_transactions_view(recurring_transaction=users_recurring_transaction,
-                                                                                                            sender=sender,
-                                                                                                            receiver=receiver, 
-                                                                                                            category_name=category_name))
-        
-        if page:
-            start = (page - 1) * recurring_transactions_per_page
-            end = start + recurring_transactions_per_page
-            recurring_transactions_view = recurring_transactions_view[start:end]
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+    users, categories = await run_concurrently(user_services.get_users_by_ids([user_id for users_recurring_transaction in users_recurring_transactions
+                                                                               for user_id in (users_recurring_transaction.sender_id, users_recurring_transaction.receiver_id)]),
+                                               categories_service.get_categories_by_ids([users_recurring_transaction.categories_id
+                                                                                         for users_recurring_transaction in users_recurring_transactions]))
+    recurring_transactions_view = []
+    for users_recurring_transaction in users_recurring_transactions:
+        sender = users.get(users_recurring_transaction.sender_id)
+        receiver = users.get(users_recurring_transaction.receiver_id)
+        category_name = categories.get(users_recurring_transaction.categories_id)
+
+        if not sender or not receiver or not category_name:
+            return NotFound(content='Required data not found.')
+
+        recurring_transactions_view.append(RecurringTransactionViewAll.recurring_transactions_view(recurring_transaction=users_recurring_transaction,
+                                                                                                   sender=sender,
+                                                                                                   receiver=receiver,
+                                                                                                   category_name=category_name))
+
+    return recurring_transactions_view
 
-        if sort and (sort == 'asc' or sort == 'desc'):
-            return recurring_transactions_service.sort_recurring_transactions(recurring_transactions=recurring_transactions_view,
-                                                                            reverse=sort == 'desc',
-                                                                            attribute=sort_by)
-        else:
-            return recurring_transactions_view
-    
-    else:
-        return NotFound(content=f'The required recurring transactions you are looking for are not available.')
-    
 
 @recurring_transactions_router.get(path='/id/{recurring_transaction_id}', response_model=List[RecurringTransactionView], status_code=201, tags=['Recurrung transactions']) 
 async def get_transactions_by_id(recurring_transaction_id: int,
@@ -88,37 +103,35 @@ async def get_transactions_by_id(recurring_transaction_id: int,
         - This parameter is used to ensure that the request is made by an authenticated user.
     '''
 
-    if await recurring_transactions_service.recurring_transaction_id_exists(recurring_transaction_id=recurring_transaction_id):
-        recurring_transaction_view = await recurring_transactions_service.view_recurring_transaction_by_id(recurring_transaction_id=recurring_transaction_id,
-                                                                                                           current_user=current_user)
-        sender = await user_services.get_user_by_id(user_id=recurring_transaction_view.sender_id)
-        receiver = await user_services.get_user_by_id(user_id=recurring_transaction_view.receiver_id)
-        category_name = await categories_service.get_category_by_id(category_id=recurring_transaction_view.categories_id)
-        
-        if not sender or not receiver or not category_name:
-            return NotFound(content='Required data not found.')
-        
-        if recurring_transaction_view.status == 'pending' and recurring_transaction_view.condition == 'edited': 
-            message = f'This transaction hasn\'t been sent.'
-        if recurring_transaction_view.status == 'confirmed' and recurring_transaction_view.condition == 'sent': 
-            message = f'This transaction has been successfully sent.'
-        if recurring_transaction_view.status == 'declined' and recurring_transaction_view.condition == 'cancelled': 
-            message = f'This transaction has been cancelled.'
+    recurring_transaction_view = await recurring_transactions_service.view_recurring_transaction_by_id(recurring_transaction_id=recurring_transaction_id,
+                                                                                                       current_user=current_user)
+    if recurring_transaction_view is None:
+        return NotFound(content=f'The recurring transaction you are looking for is not available.')
 
-        if recurring_transaction_view is None:
-            return NotFound(content=f'The recurring transaction you are looking for is not available.')
-        else:
-            recurring_transaction_view = [RecurringTransactionView.recurring_transaction_view(recurring_transaction=recurring_transaction_view, 
-                                                                                              sender=sender, 
-                                                                                              receiver=receiver, 
-                                                                                              category_name=category_name,
-                                                                                              message=message)]
-            return recurring_transaction_view
-    else:
-            return NotFound(content=f'The recurring transaction you are looking for is not available.')
+    sender, receiver, category_name = await run_concurrently(user_services.get_user_by_id(user_id=recurring_transaction_view.sender_id),
+                                                             user_services.get_user_by_id(user_id=recurring_transaction_view.receiver_id),
+                                                             categories_service.get_category_by_id(category_id=recurring_transaction_view.categories_id))
+    
+    if not sender or not receiver or not category_name:
+        return NotFound(content='Required data not found.')
+    
+    if recurring_transaction_view.status == 'pending' and recurring_transaction_view.condition == 'edited': 
+        message = f'This transaction hasn\'t been sent.'
+    if recurring_transaction_view.status == 'confirmed' and recurring_transaction_view.condition == 'sent': 
+        message = f'This transaction has been successfully sent.'
+    if recurring_transaction_view.status == 'declined' and recurring_transaction_view.condition == 'cancelled': 
+        message = f'This transaction has been cancelled.'
+
+    recurring_transaction_view = [RecurringTransactionView.recurring_transaction_view(recurring_transaction=recurring_transaction_view, 
+                                                                                      sender=sender, 
+                                                                                      receiver=receiver, 
+                                                                                      category_name=category_name,
+                                                                                      message=message)]
+    return recurring_transaction_view
 
 
 @recurring_transactions_router.post(path='/', status_code=201, tags=['Recurrung transactions']) 
+@idempotent(scope='recurring_transactions')
 async def create_recurring_transaction(recurring_transaction: RecurringTransaction,
                                        current_user: int = Depends(dependency=get_current_user)):
     '''
@@ -135,24 +148,21 @@ async def create_recurring_transaction(recurring_transaction: RecurringTransacti
     receiver_id = recurring_transaction.receiver_id
     categories_id = recurring_transaction.categories_id
 
-    sender = await user_services.get_user_by_id(user_id=sender_id)
-    receiver = await user_services.get_user_by_id(user_id=receiver_id)
-    contact = await contacts_service.contact_id_exists(current_user=current_user,
-                                                       reciever_id=recurring_transaction.receiver_id)
-    category_name = await categories_service.get_category_by_id(category_id=categories_id)
-    receiver_status = await user_services.get_user_by_status(user_id=receiver.id)
+    precheck = await transfer_precheck_service.precheck_transfer(sender_id=sender_id,
+                                                                 receiver_id=receiver_id,
+                                                                 card_user_id=current_user,
+                                                                 categories_id=categories_id)
+    sender = precheck.sender
+    receiver = precheck.receiver
+    category_name = precheck.category
 
-    if not sender or not receiver or not contact or not category_name or not receiver_status:
+    if not sender or not receiver or not precheck.is_contact or not category_name or not precheck.card:
         return NotFound(content='Required data not found. Therefore you cannot continue forward.')
     
-    user_status = await user_services.get_user_by_status(user_id=current_user)
-    if user_status == 'blocked':
+    if precheck.sender_blocked:
         return BadRequest(content=f'You have been blocked. Therefore the current option is not available for you.')
     
-    card_id = await cards_services.get_card_by_user_id(cards_user_id=current_user)
-    cards_balance = await cards_services.get_card_info_by_id(card_id=card_id)
-    cards_balance = cards_balance.balance
-    if cards_balance <= 0:
+    if precheck.card.balance <= 0:
         return BadRequest(content=f'Your card\'s balance is lower than 0. Therefore the current option is not available for you.')
 
     if not recurring_transaction.recurring_transaction_date:
@@ -164,7 +174,7 @@ async def create_recurring_transaction(recurring_transaction: RecurringTransacti
     if not recurring_transaction.condition:
         recurring_transaction.condition = 'edited'
     
-    if contact == True and receiver_status != 'pending' and receiver_status != 'blocked':
+    if precheck.receiver_available:
         recurring_transaction_create = await recurring_transactions_service.create_recurring_transaction(recurring_transaction=recurring_transaction)
     else:
         return BadRequest(content=f'The contact is not available. Please, add them to you contacts list first.')
@@ -194,18 +204,21 @@ async def preview_recurring_transaction(recurring_transaction_id: int,
         - The ID of the recurring transaction to retrieve details for.\n
     - recurring_transaction : RecurringTransaction\n
         - The recurring transaction's details which will be manipulated.\n
+        - When editing, version is required: the version of the recurring transaction the edit is based on; if it has been changed since, the answer is 409 Conflict.\n
     - current_user : int\n
         - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
         - This parameter is used to ensure that the request is made by an authenticated user.
     '''
     
     if await recurring_transactions_service.recurring_transaction_id_exists(recurring_transaction_id=recurring_transaction_id):
-        sender = await user_services.get_user_by_id(user_id=recurring_transaction.sender_id)
-        receiver = await user_services.get_user_by_id(user_id=recurring_transaction.receiver_id)
-        category = await categories_service.get_category_by_id(category_id=recurring_transaction.categories_id)
+        sender, receiver, category = await run_concurrently(user_services.get_user_by_id(user_id=recurring_transaction.sender_id),
+                                                            user_services.get_user_by_id(user_id=recurring_transaction.receiver_id),
+                                                            categories_service.get_category_by_id(category_id=recurring_transaction.categories_id))
 
         condition_action = recurring_transaction.condition
         category_name = category.name
+        if condition_action == 'edited' and recurring_transaction.version is None:
+            return BadRequest(content=f'The version of the recurring transaction is required to edit it.')
 
         if recurring_transaction.status == 'pending' and recurring_transaction.condition == 'edited': 
             message = f'This transaction hasn\'t been sent.'
@@ -220,21 +233,24 @@ async def preview_recurring_transaction(recurring_transaction_id: int,
                 new_amount = recurring_transaction.amount
                 new_categories_id = recurring_transaction.categories_id
                 new_receiver_id = recurring_transaction.receiver_id
-                recurring_transaction_edited = await recurring_transactions_service.preview_edited_recurring_transaction(recurring_transaction_id=recurring_transaction_id,
-                                                                                                                         new_next_payment=new_next_payment,
-                                                                                                                         new_amount=new_amount,
-                                                                                                                         new_categories_id=new_categories_id,
-                                                                                                                         new_receiver_id=new_receiver_id )
+                try:
+                    recurring_transaction_edited = await recurring_transactions_service.preview_edited_recurring_transaction(recurring_transaction_id=recurring_transaction_id,
+                                                                                                                             current_user=current_user,
+                                                                                                                             version=recurring_transaction.version,
+                                                                                                                             new_next_payment=new_next_payment,
+                                                                                                                             new_amount=new_amount,
+                                                                                                                             new_categories_id=new_categories_id,
+                                                                                                                             new_receiver_id=new_receiver_id)
+                except StaleVersionError:
+                    return Conflict(content=f'The recurring transaction has been changed in the meantime. Please, review it and try again.')
                 if recurring_transaction_edited is not None: 
                     message = f'The recurring transaction has been successfully edited.'
                 else:
                     return BadRequest(content=f'Recurring transaction editing has failed.')
                 recurring_transaction_ready = recurring_transaction_edited
             elif condition_action == 'sent' and recurring_transaction.status == 'pending':
-                amount = recurring_transaction.amount
                 status = recurring_transaction.status
                 recurring_transaction_sent = await recurring_transactions_service.preview_sent_recurring_transaction(recurring_transaction_id=recurring_transaction_id,
-                                                                                                                     amount=amount,
                                                                                                                      status=status,
                                                                                                                      condition_action=condition_action,
                                                                                                                      current_user=current_user)
@@ -247,7 +263,8 @@ async def preview_recurring_transaction(recurring_transaction_id: int,
                 status = 'declined'
                 recurring_transaction_cancelled = await recurring_transactions_service.preview_cancelled_recurring_transaction(recurring_transaction_id=recurring_transaction_id,
                                                                                                                                status=status,
-                                                                                                                               condition_action=condition_action)
+                                                                                                                               condition_action=condition_action,
+                                                                                                                               current_user=current_user)
                 if recurring_transaction_cancelled is not None: 
                     message = f'The recurring transaction has been cancelled.'
                 else:
@@ -255,11 +272,9 @@ async def preview_recurring_transaction(recurring_transaction_id: int,
                 recurring_transaction_ready = recurring_transaction_cancelled
 
         elif current_user == receiver.id and condition_action == 'sent' and recurring_transaction.status == 'confirmed':
-            amount = recurring_transaction.amount
             status = 'confirmed'
             condition_action = 'sent'
             recurring_transaction_confirmed = await recurring_transactions_service.preview_confirmed_recurring_transaction(recurring_transaction_id=recurring_transaction_id,
-                                                                                                                           amount=amount,
                                                                                                                            status=status,
                                                                                                                            condition_action=condition_action,
                                                                                                                            current_user=current_user)
@@ -270,11 +285,9 @@ async def preview_recurring_transaction(recurring_transaction_id: int,
             recurring_transaction_ready = recurring_transaction_confirmed
             
         elif current_user == receiver.id and condition_action == 'sent' and recurring_transaction.status == 'declined':
-            amount = recurring_transaction.amount
             status = 'declined'
             condition_action = 'cancelled'
             recurring_transaction_declined = await recurring_transactions_service.preview_declined_recurring_transaction(recurring_transaction_id=recurring_transaction_id,
-                                                                                                                         amount=amount,
                                                                                                                          status=status,
                                                                                                                          condition_action=condition_action,
                                                                                                                          current_user=current_user)
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
+from fastapi.responses import JSONResponse
 from datetime import datetime
 from typing import List
 from common.authorization import get_current_user
-from common.responses import BadRequest, NotFound
+from common.responses import BadRequest, NotFound, Conflict
+from common.idempotency import idempotent
+from data.concurrency import run_concurrently
+from data.unit_of_work import StaleVersionError
 from data.models.transactions import Transaction
-from schemas.transactions import TransactionViewAll, TransactionView
-from services import transactions_service, user_services, cards_services, contacts_service
+from schemas.transactions import TransactionViewAll, TransactionView, TransactionBatch, TransactionBatchItem, TransactionBatchResult
+from services import transactions_service, transfer_precheck_service, user_services, cards_services
 
 
 transactions_router = APIRouter(prefix='/api/transactions')
@@ -20,9 +24,13 @@ async def get_users_transactions(sort: str | None = None,
                                  direction: str | None = None,
                                  sender: int | None = None,
                                  receiver: int | None = None,
+                                 cursor: str | None = None,
+                                 response: Response = None,
                                  current_user: int = Depends(dependency=get_current_user)):
    '''
    This function returns a list of all the transactions for the specified user.\n
+   Sorting and pagination are done by the database, which also returns the usernames and the direction; the X-Total-Count
+   header holds the number of transactions that match the filters and the X-Next-Cursor header the cursor of the next page.\n
    Parameters:\n
    - sort: str | None\n
       - The sort order of the transactions. Acceptable values are 'asc' for ascending or 'desc' for descending.\n
@@ -40,52 +48,45 @@ async def get_users_transactions(sort: str | None = None,
       - Filter transactions by the sender's user ID.\n
    - receiver: int | None\n
       - Filter transactions by the receiver's user ID.\n
+   - cursor: str | None\n
+      - The X-Next-Cursor of the previous page. It takes the place of page and keeps deep pages as fast as the first one.\n
    - current_user: int\n
       - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
       - This parameter is used to ensure that the request is made by an authenticated user.
    ''' 
 
-   users_transactions = await transactions_service.view_all_transactions(current_user=current_user,
-                                                                         transaction_date=transaction_date,
-                                                                         sender=sender,
-                                                                         receiver=receiver,
-                                                                         direction=direction)
-   
-   if users_transactions != [] or users_transactions != None:
-      transactions_view = []
-      for users_transaction in users_transactions:
-         sender = await user_services.get_user_by_id(user_id=users_transaction.sender_id)
-         receiver = await user_services.get_user_by_id(user_id=users_transaction.receiver_id)
-
-         if current_user == sender.id and current_user == receiver.id:
-            direction = 'incoming'
-         elif current_user == sender.id: 
-            direction = 'outgoing'
-         elif current_user == receiver.id:
-            direction = 'incoming'
-            
-         if not sender or not receiver:
-            return NotFound(content='Required data not found.')
-         
-         transactions_view.append(TransactionViewAll.transactions_view(transaction=users_transaction,
-                                                                              sender=sender,
-                                                                              receiver=receiver,
-                                                                              direction=direction))
-      
-      if page:
-         start = (page - 1) * transactions_per_page
-         end = start + transactions_per_page
-         transactions_view = transactions_view[start:end]
-
-      if sort and (sort == 'asc' or sort == 'desc'):
-         return transactions_service.sort_transactions(transactions=transactions_view,
-                                                      reverse=sort == 'desc',
-                                                      attribute=sort_by)
+   try:
+      if cursor:
+         transactions_view, next_cursor = await transactions_service.view_transactions_after(current_user=current_user,
+                                                                                            cursor=cursor,
+                                                                                            transaction_date=transaction_date,
+                                                                                            sender=sender,
+                                                                                            receiver=receiver,
+                                                                                            direction=direction,
+                                                                                            sort=sort,
+                                                                                            sort_by=sort_by,
+                                                                                            transactions_per_page=transactions_per_page)
       else:
-         return transactions_view
-      
-   else:
-      return NotFound(content=f'The required transactions you are looking for are not available.')
+         transactions_view, total, next_cursor = await transactions_service.view_transactions_page(current_user=current_user,
+                                                                                                   transaction_date=transaction_date,
+                                                                                                   sender=sender,
+                                                                                                   receiver=receiver,
+                                                                                                   direction=direction,
+                                                                                                   sort=sort,
+                                                                                                   sort_by=sort_by,
+                                                                                                   page=page,
+                                                                                                   transactions_per_page=transactions_per_page)
+         if total == 0:
+            return NotFound(content=f'The required transactions you are looking for are not available.')
+
+         response.headers['X-Total-Count'] = str(total)
+   except ValueError as e:
+      return BadRequest(content=str(e))
+
+   if next_cursor:
+      response.headers['X-Next-Cursor'] = next_cursor
+
+   return transactions_view
 
 
 @transactions_router.get(path='/id/{transaction_id}', response_model=List[TransactionView], status_code=201, tags=['Transactions']) 
@@ -101,39 +102,17 @@ async def get_transaction_by_id(transaction_id: int,
       - This parameter is used to ensure that the request is made by an authenticated user.
    '''
    
-   if await transactions_service.transaction_id_exists(transaction_id=transaction_id):
-      transaction_view = await transactions_service.view_transaction_by_id(transaction_id=transaction_id,
-                                                                           current_user=current_user)
-      sender = await user_services.get_user_by_id(user_id=transaction_view.sender_id)
-      receiver = await user_services.get_user_by_id(user_id=transaction_view.receiver_id)
+   transaction_view = await transactions_service.view_transaction_by_id(transaction_id=transaction_id,
+                                                                        current_user=current_user)
 
-      if current_user == sender.id and current_user == receiver.id:
-         direction = 'incoming'
-      if current_user == sender.id: 
-         direction = 'outgoing'
-      if current_user == receiver.id:
-         direction = 'incoming'
-      if transaction_view.status == 'pending' and transaction_view.condition == 'edited': 
-         message = f'This transaction hasn\'t been sent.'
-      if transaction_view.status == 'confirmed' and transaction_view.condition == 'sent': 
-         message = f'This transaction has been successfully sent.'
-      if transaction_view.status == 'declined' and transaction_view.condition == 'cancelled': 
-         message = f'This transaction has been cancelled.'
-      
-      if transaction_view is None:
-         return NotFound(content='Required data not found.')
-      else:
-         transaction_view = [TransactionView.transaction_view(transaction=transaction_view,
-                                                              sender=sender,
-                                                              receiver=receiver,
-                                                              direction=direction,
-                                                              message=message)]
-         return transaction_view
+   if transaction_view is None:
+      return NotFound(content=f'The transaction you are looking for is not available.')
    else:
-            return NotFound(content=f'The transaction you are looking for is not available.')
+      return [transaction_view]
    
 
 @transactions_router.post(path='/wallet', status_code=201, tags=['Transactions']) 
+@idempotent(scope='transactions.wallet')
 async def create_transaction_wallet(transaction: Transaction,
                                     current_user: int = Depends(dependency=get_current_user)):
    '''
@@ -153,18 +132,18 @@ async def create_transaction_wallet(transaction: Transaction,
    receiver_id = current_user
    cards_user_id = current_user
 
-   sender = await user_services.get_user_by_id(user_id=sender_id)
-   receiver = await user_services.get_user_by_id(user_id=receiver_id)
-   card_id = await cards_services.get_card_by_user_id(cards_user_id=cards_user_id)
+   sender, receiver, card_id = await run_concurrently(user_services.get_user_by_id(user_id=sender_id),
+                                                      user_services.get_user_by_id(user_id=receiver_id),
+                                                      cards_services.get_card_by_user_id(cards_user_id=cards_user_id))
 
    if not sender or not receiver or not card_id:
          return NotFound(content='Required data not found. Therefore you cannot continue forward.')
 
-   user_status = await user_services.get_user_by_status(user_id=current_user)
+   user_status, cards_balance = await run_concurrently(user_services.get_user_by_status(user_id=current_user),
+                                                       cards_services.get_card_info_by_id(card_id=card_id))
    if user_status == 'blocked':
       return BadRequest(content=f'You have been blocked. Therefore the current option is not available for you.')
    
-   cards_balance = await cards_services.get_card_info_by_id(card_id=card_id)
    cards_balance = cards_balance.balance
    if cards_balance <= 0:
       return BadRequest(content=f'Your card\'s balance is lower than 0. Therefore the current option is not available for you.')
@@ -198,6 +177,7 @@ async def create_transaction_wallet(transaction: Transaction,
 
 
 @transactions_router.post(path='/user', status_code=201, tags=['Transactions']) 
+@idempotent(scope='transactions.user')
 async def create_transaction_user(transaction: Transaction,
                                   current_user: int = Depends(dependency=get_current_user)):
    '''
@@ -214,26 +194,19 @@ async def create_transaction_user(transaction: Transaction,
    receiver_id = transaction.receiver_id
    cards_user_id = current_user
 
-   sender = await user_services.get_user_by_id(user_id=sender_id)
-   receiver = await user_services.get_user_by_id(user_id=receiver_id)
+   precheck = await transfer_precheck_service.precheck_transfer(sender_id=sender_id,
+                                                                receiver_id=receiver_id,
+                                                                card_user_id=cards_user_id)
+   sender = precheck.sender
+   receiver = precheck.receiver
 
-   if not sender or not receiver:
+   if not sender or not receiver or not precheck.card:
       return NotFound(content='Required data not found. Therefore you cannot continue forward.')
 
-   contact = await contacts_service.contact_id_exists(current_user=current_user,
-                                                      reciever_id=transaction.receiver_id)
-   receiver_status = await user_services.get_user_by_status(user_id=receiver.id)
-   card_id = await cards_services.get_card_by_user_id(cards_user_id=cards_user_id)
-   card_holder = await cards_services.get_card_info_by_id(card_id=card_id)
-   card_number = await cards_services.get_card_info_by_id(card_id=card_id)
-   
-   user_status = await user_services.get_user_by_status(user_id=current_user)
-   if user_status == 'blocked':
+   if precheck.sender_blocked:
       return BadRequest(content=f'You have been blocked. Therefore the current option is not available for you.')
    
-   cards_balance = await cards_services.get_card_info_by_id(card_id=card_id)
-   cards_balance = cards_balance.balance
-   if cards_balance <= 0:
+   if precheck.card.balance <= 0:
       return BadRequest(content=f'Your card\'s balance is lower than 0. Therefore the current option is not available for you.')
 
    if not transaction.transaction_date:
@@ -247,7 +220,7 @@ async def create_transaction_user(transaction: Transaction,
    if current_user == sender.id: 
       direction = 'outgoing'
 
-   if contact == True and receiver_status != 'pending' and receiver_status != 'blocked':
+   if precheck.is_contact and precheck.receiver_available:
       transaction_create = await transactions_service.create_transaction_to_users_balance(transaction=transaction,
                                                                                           current_user=current_user)
    else:
@@ -267,7 +240,89 @@ async def create_transaction_user(transaction: Transaction,
    return transaction_create
    
 
+@transactions_router.post(path='/batch', response_model=TransactionBatchResult, status_code=201, tags=['Transactions'])
+@idempotent(scope='transactions.batch')
+async def create_transactions_batch(batch: TransactionBatch,
+                                    current_user: int = Depends(dependency=get_current_user)):
+   '''
+   This function makes many transactions to other users' balances at once, for example a payroll.\n
+   The transactions are sent straight away, the amounts are taken from the sender's wallet until the receivers confirm
+   or decline them. Every receiver must be in the sender's contacts, as for /user.\n
+   Parameters:\n
+   - batch : TransactionBatch\n
+      - The transactions and the mode. With 'all_or_nothing' (the default) no transaction is created if any of them
+        is rejected or the wallet can't cover all of them; with 'best_effort' the others are created.\n
+   - current_user: int\n
+      - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
+      - This parameter is used to ensure that the request is made by an authenticated user.\n
+   Returns the result of every transaction in the order they were given.
+   '''
+
+   transactions = batch.transactions
+   precheck = await transfer_precheck_service.precheck_batch_transfer(sender_id=current_user,
+                                                                      receiver_ids=[transaction.receiver_id for transaction in transactions])
+
+   if not precheck.sender or not precheck.card:
+      return NotFound(content='Required data not found. Therefore you cannot continue forward.')
+
+   if precheck.sender_blocked:
+      return BadRequest(content=f'You have been blocked. Therefore the current option is not available for you.')
+
+   if precheck.card.balance <= 0:
+      return BadRequest(content=f'Your card\'s balance is lower than 0. Therefore the current option is not available for you.')
+
+   rejections = {}
+   for index, transaction in enumerate(transactions):
+      if transaction.amount < 0.01:
+         rejections[index] = 'The amount must be at least $0.01.'
+      elif transaction.receiver_id == current_user:
+         rejections[index] = 'Please, use /api/transactions/wallet for a transaction to your wallet.'
+      elif transaction.receiver_id not in precheck.receivers:
+         rejections[index] = 'Required data not found. Therefore you cannot continue forward.'
+      elif transaction.receiver_id not in precheck.contacts or not precheck.receiver_available(transaction.receiver_id):
+         rejections[index] = 'The contact is not available. Please, add them to you contacts list first.'
+
+   all_or_nothing = batch.mode == 'all_or_nothing'
+   accepted = [] if all_or_nothing and rejections else [index for index in range(len(transactions)) if index not in rejections]
+
+   generated_ids = {}
+   if accepted:
+      created_ids = await transactions_service.create_sent_transactions(transactions=[transactions[index] for index in accepted],
+                                                                        current_user=current_user,
+                                                                        card_id=precheck.card.id,
+                                                                        all_or_nothing=all_or_nothing)
+      generated_ids = dict(zip(accepted, created_ids))
+
+   results = []
+   for index, transaction in enumerate(transactions):
+      generated_id = generated_ids.get(index)
+      if index in rejections:
+         status, message = 'rejected', rejections[index]
+      elif generated_id is not None:
+         status, message = 'created', 'Transaction successfully sent.'
+      elif index in generated_ids:
+         status, message = 'rejected', 'You don\'t have enough cash in your virtual wallet.'
+      else:
+         status, message = 'skipped', 'Not created, another transaction of the batch was rejected.'
+      results.append(TransactionBatchItem(index=index,
+                                          receiver_id=transaction.receiver_id,
+                                          amount=transaction.amount,
+                                          status=status,
+                                          transaction_id=generated_id,
+                                          message=message))
+
+   result = TransactionBatchResult(mode=batch.mode,
+                                   created=sum(item.status == 'created' for item in results),
+                                   results=results)
+
+   if all_or_nothing and not result.created:
+      return JSONResponse(status_code=400, content=result.model_dump())
+
+   return result
+
+
 @transactions_router.post(path='/category', status_code=201, tags=['Transactions']) 
+@idempotent(scope='transactions.category')
 async def create_transaction_category(transaction: Transaction,
                                       current_user: int = Depends(dependency=get_current_user)):
    '''
@@ -284,26 +339,19 @@ async def create_transaction_category(transaction: Transaction,
    receiver_id = transaction.receiver_id
    cards_user_id = receiver_id
 
-   sender = await user_services.get_user_by_id(user_id=sender_id)
-   receiver = await user_services.get_user_by_id(user_id=receiver_id)
+   precheck = await transfer_precheck_service.precheck_transfer(sender_id=sender_id,
+                                                                receiver_id=receiver_id,
+                                                                card_user_id=cards_user_id)
+   sender = precheck.sender
+   receiver = precheck.receiver
 
-   if not sender or not receiver:
+   if not sender or not receiver or not precheck.card:
       return NotFound(content='Required data not found. Therefore you cannot continue forward.')
-   
-   contact = await contacts_service.contact_id_exists(current_user=current_user,
-                                                      reciever_id=transaction.receiver_id)
-   receiver_status = await user_services.get_user_by_status(user_id=receiver.id)
-   card_id = await cards_services.get_card_by_user_id(cards_user_id=cards_user_id)
-   card_holder = await cards_services.get_card_info_by_id(card_id=card_id)
-   card_number = await cards_services.get_card_info_by_id(card_id=card_id)
-
-   user_status = await user_services.get_user_by_status(user_id=current_user)
-   if user_status == 'blocked':
+
+   if precheck.sender_blocked:
       return BadRequest(content=f'You have been blocked. Therefore the current option is not available for you.')
    
-   cards_balance = await cards_services.get_card_info_by_id(card_id=card_id)
-   cards_balance = cards_balance.balance
-   if cards_balance <= 0:
+   if precheck.card.balance <= 0:
       return BadRequest(content=f'Your card\'s balance is lower than 0. Therefore the current option is not available for you.')
    
    if not transaction.transaction_date:
@@ -317,7 +365,7 @@ async def create_transaction_category(transaction: Transaction,
    if current_user == sender.id: 
       direction = 'outgoing'
 
-   if contact == True and receiver_status != 'pending' and receiver_status != 'blocked':
+   if precheck.is_contact and precheck.receiver_available:
       transaction_create = await transactions_service.create_transaction_to_users_category(transaction=transaction,
                                                                                            current_user=current_user)
    else:
@@ -348,14 +396,15 @@ async def preview_transaction(transaction_id: int,
       - The ID of the transaction to retrieve details for.\n
    - transaction : Transaction\n
       - The transaction details which will be manipulated.\n
+      - When editing, version is required: the version of the transaction the edit is based on; if it has been changed since, the answer is 409 Conflict.\n
    - current_user : int\n
       - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
       - This parameter is used to ensure that the request is made by an authenticated user.
    '''
 
    if await transactions_service.transaction_id_exists(transaction_id=transaction_id):
-      sender = await user_services.get_user_by_id(user_id=transaction.sender_id)
-      receiver = await user_services.get_user_by_id(user_id=transaction.receiver_id)
+      sender, receiver = await run_concurrently(user_services.get_user_by_id(user_id=transaction.sender_id),
+                                                user_services.get_user_by_id(user_id=transaction.receiver_id))
 
       if current_user == sender.id and current_user == receiver.id:
          direction = 'incoming'
@@ -371,26 +420,31 @@ async def preview_transaction(transaction_id: int,
          message = f'This transaction has been cancelled.'
 
       condition_action = transaction.condition
+      if condition_action == 'edited' and transaction.version is None:
+         return BadRequest(content=f'The version of the transaction is required to edit it.')
       
       if current_user == sender.id and current_user == receiver.id:
          if condition_action == 'edited':
             new_amount = transaction.amount
             new_category_name = transaction.category_name
             new_receiver_id = transaction.receiver_id
-            transaction_edited = await transactions_service.preview_edited_transaction(transaction_id=transaction_id,
-                                                                                       new_amount=new_amount,
-                                                                                       new_category_name=new_category_name,
-                                                                                       new_receiver_id=new_receiver_id)
+            try:
+               transaction_edited = await transactions_service.preview_edited_transaction(transaction_id=transaction_id,
+                                                                                          current_user=current_user,
+                                                                                          version=transaction.version,
+                                                                                          new_amount=new_amount,
+                                                                                          new_category_name=new_category_name,
+                                                                                          new_receiver_id=new_receiver_id)
+            except StaleVersionError:
+               return Conflict(content=f'The transaction has been changed in the meantime. Please, review it and try again.')
             if transaction_edited is not None: 
                message = f'The transaction has been successfully edited.'
             else:
                return BadRequest(content=f'Transaction editing has failed.')
             transaction_ready = transaction_edited
          elif condition_action == 'sent' and transaction.status == 'pending':
-            amount = transaction.amount
             status = 'confirmed'
             transaction_sent = await transactions_service.preview_sent_transaction(transaction_id=transaction_id,
-                                                                                   amount=amount,
                                                                                    status=status,
                                                                                    condition_action=condition_action,
                                                                                    current_user=current_user)
@@ -403,7 +457,8 @@ async def preview_transaction(transaction_id: int,
             status = 'declined'
             transaction_cancelled = await transactions_service.preview_cancelled_transaction(transaction_id=transaction_id, 
                                                                                           status=status,
-                                                                                          condition_action=condition_action)
+                                                                                          condition_action=condition_action,
+                                                                                          current_user=current_user)
             if transaction_cancelled is not None: 
                message = f'The transaction has been cancelled.'
             else:
@@ -415,20 +470,23 @@ async def preview_transaction(transaction_id: int,
             new_amount = transaction.amount
             new_category_name = transaction.category_name
             new_receiver_id = transaction.receiver_id
-            transaction_edited = await transactions_service.preview_edited_transaction(transaction_id=transaction_id,
-                                                                                       new_amount=new_amount,
-                                                                                       new_category_name=new_category_name,
-                                                                                       new_receiver_id=new_receiver_id)
+            try:
+               transaction_edited = await transactions_service.preview_edited_transaction(transaction_id=transaction_id,
+                                                                                          current_user=current_user,
+                                                                                          version=transaction.version,
+                                                                                          new_amount=new_amount,
+                                                                                          new_category_name=new_category_name,
+                                                                                          new_receiver_id=new_receiver_id)
+            except StaleVersionError:
+               return Conflict(content=f'The transaction has been changed in the meantime. Please, review it and try again.')
             if transaction_edited is not None: 
                message = f'The transaction has been successfully edited.'
             else:
                return BadRequest(content=f'Transaction editing has failed.')
             transaction_ready = transaction_edited
          elif condition_action == 'sent' and transaction.status == 'pending':
-            amount = transaction.amount
             status = transaction.status
             transaction_sent = await transactions_service.preview_sent_transaction(transaction_id=transaction_id,
-                                                                                    amount=amount,
                                                                                     status=status,
                                                                                     condition_action=condition_action,
                                                                                     current_user=current_user)
@@ -441,7 +499,8 @@ async def preview_transaction(transaction_id: int,
             status = 'declined'
             transaction_cancelled = await transactions_service.preview_cancelled_transaction(transaction_id=transaction_id,
                                                                                           status=status,
-                                                                                          condition_action=condition_action)
+                                                                                          condition_action=condition_action,
+                                                                                          current_user=current_user)
             if transaction_cancelled is not None: 
                message = f'The transaction has been cancelled.'
             else:
@@ -449,11 +508,9 @@ async def preview_transaction(transaction_id: int,
             transaction_ready = transaction_cancelled
 
       elif current_user == receiver.id and condition_action == 'sent' and transaction.status == 'confirmed':
-         amount = transaction.amount
          status = 'confirmed'
          condition_action = 'sent'
          transaction_confirmed = await transactions_service.preview_confirmed_transaction(transaction_id=transaction_id,
-                                                                                          amount=amount,
                                                                                           status=status,
                                                                                           condition_action=condition_action,
                                                                                           current_user=current_user)
@@ -464,11 +521,9 @@ async def preview_transaction(transaction_id: int,
          transaction_ready = transaction_confirmed
 
       elif current_user == receiver.id and condition_action == 'sent' and transaction.status == 'declined':
-         amount = transaction.amount
          status = 'declined'
          condition_action = 'cancelled'
          transaction_declined = await transactions_service.preview_declined_transaction(transaction_id=transaction_id,
-                                                                                       amount=amount,
                                                                                        status=status,
                                                                                        condition_action=condition_action,
                                                                                        current_user=current_user)
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic import BaseModel
 
 
@@ -32,6 +33,7 @@ class RecurringTransactionView(BaseModel):
     receiver: str
     direction: str = 'outgoing'
     message: str
+    version: Optional[int] = None
 
     @classmethod
     def recurring_transaction_view(cls, recurring_transaction, sender, receiver, category_name, message):
@@ -46,5 +48,6 @@ class RecurringTransactionView(BaseModel):
             sender=sender.username,
             receiver=receiver.username,
             direction='outgoing',
-            message=message
+            message=message,
+            version=recurring_transaction.version
         )
\ No newline at end of file
@@ -1,8 +1,16 @@
-from typing import Optional
-from pydantic import BaseModel
+from typing import Optional, Literal
+from pydantic import BaseModel, Field
+from data.models.transactions import Transaction
 from datetime import datetime
 
 
+TRANSACTION_MESSAGES = {
+    ('pending', 'edited'): 'This transaction hasn\'t been sent.',
+    ('confirmed', 'sent'): 'This transaction has been successfully sent.',
+    ('declined', 'cancelled'): 'This transaction has been cancelled.'
+}
+
+
 class TransactionViewAll(BaseModel):
     transaction_date: str
     amount: float
@@ -20,6 +28,16 @@ class TransactionViewAll(BaseModel):
             direction=direction
         )
 
+    @classmethod
+    def from_query_result(cls, transaction_date, amount, sender, receiver, direction):
+        return cls(
+            transaction_date=transaction_date.strftime('%Y/%m/%d %H:%M'),
+            amount=amount,
+            sender=sender,
+            receiver=receiver,
+            direction=direction
+        )
+
 
 class TransactionView(BaseModel):
     status: str 
@@ -31,6 +49,7 @@ class TransactionView(BaseModel):
     receiver: str
     direction: str
     message: str
+    version: Optional[int] = None
   
     @classmethod
     def transaction_view(cls, transaction, sender, receiver, direction, message):
@@ -44,7 +63,23 @@ class TransactionView(BaseModel):
             sender=sender.username,
             receiver=receiver.username,
             direction=direction,
-            message=message
+            message=message,
+            version=transaction.version
+        )
+
+    @classmethod
+    def from_query_result(cls, status, condition, transaction_date, amount, category_name, sender, receiver, direction, version=None):
+        return cls(
+            status=status,
+            condition=condition,
+            transaction_date=transaction_date.strftime('%Y/%m/%d %H:%M'),
+            amount=amount,
+            category_name=category_name,
+            sender=sender,
+            receiver=receiver,
+            direction=direction,
+            message=TRANSACTION_MESSAGES.get((status, condition), ''),
+            version=version
         )
 
 
@@ -57,4 +92,28 @@ class TransactionFilters(BaseModel):
     limit: int = 10
     offset: int = 0
     sort_by: str = 'transaction_date'
-    sort_order: str = 'asc'
\ No newline at end of file
+    sort_order: str = 'asc'
+
+
+MAX_BATCH_TRANSACTIONS = 1000
+
+
+class TransactionBatch(BaseModel):
+    transactions: list[Transaction] = Field(min_length=1, max_length=MAX_BATCH_TRANSACTIONS)
+    # 'all_or_nothing' creates every transaction or none, 'best_effort' creates the ones that pass the checks.
+    mode: Literal['all_or_nothing', 'best_effort'] = 'all_or_nothing'
+
+
+class TransactionBatchItem(BaseModel):
+    index: int
+    receiver_id: int
+    amount: float
+    status: Literal['created', 'rejected', 'skipped']
+    transaction_id: Optional[int] = None
+    message: str
+
+
+class TransactionBatchResult(BaseModel):
+    mode: str
+    created: int
+    results: list[TransactionBatchItem]
@@ -28,6 +28,16 @@ class UserInfo(BaseModel):
     phone_number: int
 
 
+class BalanceUpdate(BaseModel):
+    message: str
+    balance: Optional[float] = None
+
+    @property
+    def successful(self) -> bool:
+        # Only a change that was made has a new balance.
+        return self.balance is not None
+
+
 class UserInfoUpdate(BaseModel):
     email: str
     password: str
@@ -0,0 +1,59 @@
+'''
+Admin command line tool for bulk loading and exporting the transactions and users tables.
+
+Run it from the project root with the same DB_* environment variables as the application:
+
+    python -m scripts.bulk_copy import transactions transactions.csv
+    python -m scripts.bulk_copy export users users.bin --format binary
+'''
+import argparse
+import asyncio
+import sys
+from data.connection import close_connection_pool
+from services import bulk_copy_service
+
+
+def _report(unit: str):
+    def on_progress(processed: int):
+        print(f'\r{processed:,} {unit}', end='', file=sys.stderr, flush=True)
+    return on_progress
+
+
+async def _run(args) -> int:
+    try:
+        if args.command == 'import':
+            mode = 'r' if args.format == 'csv' else 'rb'
+            with open(args.path, mode, newline='' if args.format == 'csv' else None) as source:
+                count = await bulk_copy_service.import_table(args.table, source,
+                                                             format=args.format,
+                                                             chunk_size=args.chunk_size,
+                                                             on_progress=_report('rows imported'))
+            print(f'\nImported {count:,} rows into {args.table}.', file=sys.stderr)
+        else:
+            count = await bulk_copy_service.export_table(args.table, args.path,
+                                                         format=args.format,
+                                                         on_progress=_report('bytes written'))
+            print(f'\nExported {count:,} rows from {args.table}.', file=sys.stderr)
+    except ValueError as e:
+        print(f'\n{e}', file=sys.stderr)
+        return 1
+    finally:
+        await close_connection_pool()
+
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Bulk import and export of wallet tables with COPY.')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('table', choices=sorted(bulk_copy_service.TABLES))
+    parser.add_argument('path', help='The file to read from or write to.')
+    parser.add_argument('--format', choices=['csv', 'binary'], default='csv')
+    parser.add_argument('--chunk-size', type=int, default=bulk_copy_service.DEFAULT_CHUNK_SIZE,
+                        help='CSV rows validated and copied at a time (import only).')
+
+    return asyncio.run(_run(parser.parse_args(argv)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -61,6 +61,7 @@ CREATE TABLE IF NOT EXISTS recurring_transactions (
   sender_id INT NOT NULL,
   receiver_id INT NOT NULL,
   categories_id INT NOT NULL,
+  version INT NOT NULL DEFAULT 1,
   CONSTRAINT fk_recurring_transactions_categories1 FOREIGN KEY (categories_id)
     REFERENCES categories (id) ON DELETE NO ACTION ON UPDATE NO ACTION,
   CONSTRAINT fk_recurring_transactions_users1 FOREIGN KEY (sender_id)
@@ -80,6 +81,7 @@ CREATE TABLE IF NOT EXISTS transactions (
   sender_id INT NOT NULL,
   receiver_id INT NOT NULL,
   cards_id INT NOT NULL,
+  version INT NOT NULL DEFAULT 1,
   CONSTRAINT fk_transactions_cards1 FOREIGN KEY (cards_id)
     REFERENCES cards (id) ON DELETE NO ACTION ON UPDATE NO ACTION,
   CONSTRAINT fk_transactions_users1 FOREIGN KEY (sender_id)
@@ -98,3 +100,70 @@ CREATE TABLE IF NOT EXISTS users_has_categories (
   CONSTRAINT fk_users_has_categories_users1 FOREIGN KEY (users_id)
     REFERENCES users (id) ON DELETE NO ACTION ON UPDATE NO ACTION
 );
+
+-- Indexes for the transaction history of a user, sorted by date or amount
+CREATE INDEX IF NOT EXISTS idx_transactions_sender_date ON transactions (sender_id, transaction_date, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_receiver_date ON transactions (receiver_id, transaction_date, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_sender_amount ON transactions (sender_id, amount, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_receiver_amount ON transactions (receiver_id, amount, id);
+CREATE INDEX IF NOT EXISTS idx_recurring_transactions_sender_date ON recurring_transactions (sender_id, recurring_transaction_date, id);
+CREATE INDEX IF NOT EXISTS idx_recurring_transactions_sender_amount ON recurring_transactions (sender_id, amount, id);
+
+-- Row versions for optimistic concurrency of edits, for databases created before the column was added
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
+ALTER TABLE recurring_transactions ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
+
+-- Table `ledger_entries`, append-only. Every transfer adds one entry per account it moves money between,
+-- in cents, and the entries of a transfer sum to zero. users.balance and cards.balance are the sum of the
+-- entries of their account, see services.ledger_service.
+CREATE TABLE IF NOT EXISTS ledger_entries (
+  id BIGSERIAL PRIMARY KEY,
+  ref TEXT NOT NULL,
+  account_type TEXT CHECK (account_type IN ('user', 'card', 'clearing', 'external')) NOT NULL,
+  account_id INT NOT NULL,
+  amount BIGINT NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT uq_ledger_entries_ref_account UNIQUE (ref, account_type, account_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_ledger_entries_account ON ledger_entries (account_type, account_id, id);
+
+CREATE OR REPLACE FUNCTION ledger_entries_append_only() RETURNS trigger AS $$
+BEGIN
+  RAISE EXCEPTION 'ledger_entries is append-only, post a correcting transfer instead';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ledger_entries_append_only ON ledger_entries;
+CREATE TRIGGER trg_ledger_entries_append_only
+  BEFORE UPDATE OR DELETE OR TRUNCATE ON ledger_entries
+  FOR EACH STATEMENT EXECUTE FUNCTION ledger_entries_append_only();
+
+-- Opening entries for the balances of databases created before the ledger, so every balance is the sum of its entries
+INSERT INTO ledger_entries (ref, account_type, account_id, amount)
+SELECT 'opening:' || balances.account_type || ':' || balances.account_id, entry.account_type, entry.account_id, entry.amount
+FROM (SELECT 'user' AS account_type, id AS account_id, ROUND(balance::NUMERIC * 100)::BIGINT AS amount FROM users
+      UNION ALL
+      SELECT 'card', id, ROUND(balance::NUMERIC * 100)::BIGINT FROM cards) AS balances
+CROSS JOIN LATERAL (VALUES (balances.account_type, balances.account_id, balances.amount),
+                           ('external', 0, -balances.amount)) AS entry(account_type, account_id, amount)
+WHERE balances.amount <> 0
+  AND NOT EXISTS (SELECT 1 FROM ledger_entries
+                  WHERE ledger_entries.account_type = balances.account_type AND ledger_entries.account_id = balances.account_id);
+
+-- Table `idempotency_keys`, the responses of transaction-creating requests by their Idempotency-Key, see common.idempotency.
+-- A row without a body belongs to a request that is still running.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  user_id INT NOT NULL,
+  scope TEXT NOT NULL,
+  key VARCHAR(255) NOT NULL,
+  fingerprint TEXT NOT NULL,
+  status_code INT NULL,
+  body BYTEA NULL,
+  media_type TEXT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  expires_at TIMESTAMP NOT NULL,
+  PRIMARY KEY (user_id, scope, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
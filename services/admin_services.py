@@ -1,10 +1,12 @@
 from typing import Optional
 
-from data.database_queries import insert_query, read_query, delete_query, update_query
+from data.database_queries import insert_query, read_query, delete_query, update_query, stream_query
+from data.unit_of_work import unit_of_work, retry_on_serialization_failure
 from data.models.user import User
 from pydantic import EmailStr
 from schemas.transactions import TransactionFilters
 from schemas.user import AdminUserInfo
+from services import ledger_service
 
 async def get_all_users(search: Optional[str] = None, page: int = 1, size: int = 10) -> list[AdminUserInfo]:
     sql = "SELECT id, username, email, phone_number, is_admin, create_at, status, balance FROM users"
@@ -43,61 +45,89 @@ async def view_user_transactions(user_id: int, current_user: int, filters: Trans
     if not admin_status or not admin_status[0][0]:
         return "Not authorized. Must be an admin"
 
+    query, params = _user_transactions_query(user_id, filters)
+
+    get_user_data = await read_query(query, params)
+    return [_user_transaction_dict(user_data) for user_data in get_user_data]
+
+
+async def stream_user_transactions(user_id: int, filters: TransactionFilters, batch_size: int = 500):
+    '''
+    Streaming variant of view_user_transactions: yields the transactions one by one instead of loading them all.
+    The limit and offset of the filters are ignored, every matching transaction is yielded.
+    The caller is responsible for checking that the current user is an admin.
+    '''
+    query, params = _user_transactions_query(user_id, filters, paginate=False)
+
+    async for user_data in stream_query(query, params, batch_size):
+        yield _user_transaction_dict(user_data)
+
+
+def _user_transactions_query(user_id: int, filters: TransactionFilters, paginate: bool = True):
     query = """
         SELECT status, transaction_date, amount, sender_id, receiver_id, cards_id 
         FROM transactions 
-        WHERE (sender_id = $1 OR receiver_id = $2)
+        WHERE (sender_id = $1 OR receiver_id = $1)
     """
-    params = [user_id, user_id]
+    params = [user_id]
 
     if filters.start_date:
-        query += " AND transaction_date >= $3"
+        query += f" AND transaction_date >= ${len(params) + 1}"
         params.append(filters.start_date)
     if filters.end_date:
-        query += " AND transaction_date <= $4"
+        query += f" AND transaction_date <= ${len(params) + 1}"
         params.append(filters.end_date)
     if filters.sender_id:
-        query += " AND sender_id = $5"
+        query += f" AND sender_id = ${len(params) + 1}"
         params.append(filters.sender_id)
     if filters.recipient_id:
-        query += " AND receiver_id = $6"
+        query += f" AND receiver_id = ${len(params) + 1}"
         params.append(filters.recipient_id)
     if filters.direction:
         if filters.direction == 'incoming':
-            query += " AND receiver_id = $7"
+            query += f" AND receiver_id = ${len(params) + 1}"
             params.append(user_id)
         elif filters.direction == 'outgoing':
-            query += " AND sender_id = $8"
+            query += f" AND sender_id = ${len(params) + 1}"
             params.append(user_id)
 
-    query += f" ORDER BY {filters.sort_by} {filters.sort_order} LIMIT $9 OFFSET $10"
-    params.extend([filters.limit, filters.offset])
+    query += f" ORDER BY {filters.sort_by} {filters.sort_order}"
+    if paginate:
+        query += f" LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}"
+        params.extend([filters.limit, filters.offset])
+
+    return query, params
 
-    get_user_data = await read_query(query, params)
-    return [
-        {
-            "status": user_data[0],
-            "transaction_date": user_data[1],
-            "amount": user_data[2],
-            "sender_id": user_data[3],
-            "receiver_id": user_data[4],
-            "card_id": user_data[5]
-        } for user_data in get_user_data
-    ]
 
+def _user_transaction_dict(user_data):
+    return {
+        "status": user_data[0],
+        "transaction_date": user_data[1],
+        "amount": user_data[2],
+        "sender_id": user_data[3],
+        "receiver_id": user_data[4],
+        "card_id": user_data[5]
+    }
+
+
+@retry_on_serialization_failure()
 async def pending_transactions(current_user: int, user_id: int) -> str:
     admin_status = await read_query('SELECT is_admin FROM users WHERE id = $1', [current_user])
     if not admin_status or not admin_status[0][0]:
         return "Not authorized. Must be an admin"
 
-    pending_transactions_data = await read_query("SELECT id, amount FROM transactions WHERE status = 'pending' AND sender_id = $1", [user_id])
-    if not pending_transactions_data:
-        return "There aren't any pending transactions."
-
-    for transaction in pending_transactions_data:
-        transaction_id = transaction[0]
-        amount = transaction[1]
-        await update_query("UPDATE transactions SET status = 'declined' WHERE id = $1", [transaction_id])
-        await update_query("UPDATE users SET balance = balance + $1 WHERE id = $2", [amount, user_id])
+    async with unit_of_work():
+        declined_transactions = await read_query("UPDATE transactions SET status = 'declined', version = version + 1 WHERE status = 'pending' AND sender_id = $1 RETURNING id, amount, condition", [user_id])
+        if not declined_transactions:
+            return "There aren't any pending transactions."
+
+        # Only sent transactions have taken the money from the sender, it waits on the clearing account.
+        await ledger_service.post_transfers([
+            ledger_service.Transfer(debit=ledger_service.CLEARING,
+                                    credit=ledger_service.user_account(user_id),
+                                    amount=ledger_service.to_minor_units(amount),
+                                    ref=f'transaction:{transaction_id}:declined')
+            for transaction_id, amount, condition in declined_transactions if condition == 'sent'
+        ])
 
     return "All pending transactions have been declined."
@@ -0,0 +1,194 @@
+import csv
+from pydantic import TypeAdapter, ValidationError
+from data.database_queries import read_query, update_query, copy_records, copy_file_to_table, copy_query_to
+from data.unit_of_work import unit_of_work
+from data.models.transactions import Transaction
+from data.models.user import User
+from data.statements import rows_from_status
+
+
+# Balances are the sum of the ledger entries of an account, so they are never copied: users are imported with a
+# zero balance, and only transactions that haven't been sent, which haven't moved any money, can be imported.
+TABLES = {
+    'transactions': (Transaction, ('id', 'status', 'condition', 'transaction_date', 'amount',
+                                   'category_name', 'sender_id', 'receiver_id', 'cards_id')),
+    'users': (User, ('id', 'email', 'username', 'password', 'phone_number',
+                     'is_admin', 'create_at', 'status')),
+}
+
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def _table(table_name: str):
+    if table_name not in TABLES:
+        raise ValueError(f'Unsupported table: {table_name}. Choose one of {", ".join(TABLES)}.')
+    return TABLES[table_name]
+
+
+def _validate_chunk(model, header: list[str], lines: list[list[str]], first_line: int) -> list[tuple]:
+    '''
+    This function validates a chunk of CSV lines against the model in one pass and returns them as
+    records with the values of the header columns. Empty values are loaded as NULL.
+    '''
+
+    # Nullable fields without a default, such as User.id, are required by the model but may be left to the database.
+    missing = {name: None for name, field in model.model_fields.items() if field.is_required() and name not in header}
+    rows = [{**missing, **{column: value if value != '' else None for column, value in zip(header, line)}}
+            for line in lines]
+
+    try:
+        objects = TypeAdapter(list[model]).validate_python(rows)
+    except ValidationError as e:
+        error = e.errors()[0]
+        line_number = first_line + error['loc'][0]
+        raise ValueError(f'Invalid row on line {line_number}: {error["loc"][-1]} - {error["msg"]}.') from e
+
+    return [tuple(getattr(obj, column) for column in header) for obj in objects]
+
+
+async def import_table(table_name: str,
+                       source,
+                       format: str = 'csv',
+                       chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       on_progress=None) -> int:
+    '''
+    This function bulk loads rows into the transactions or users table with COPY.\n
+    Parameters:\n
+    - table_name: str\n
+        - 'transactions' or 'users'.\n
+    - source\n
+        - A text file object for 'csv', or a path or binary file object for 'binary'.\n
+    - format: str\n
+        - 'csv' files must have a header row with column names of the table. Every chunk of rows is validated
+          against the Transaction or User model before it is copied.\n
+        - 'binary' files are the output of export_table(format='binary') and are copied as they are.\n
+    - chunk_size: int\n
+        - The number of CSV rows validated and copied at a time.\n
+    - on_progress\n
+        - An optional callable that receives the number of rows imported so far.\n
+    All chunks are loaded in a single transaction, so a bad row leaves the table untouched. Transactions must be
+    pending and not sent yet, users get a zero balance: the ledger has no entries for anything else.
+    '''
+
+    model, columns = _table(table_name)
+
+    async with unit_of_work():
+        if format == 'binary' and table_name == 'transactions':
+            imported = await _copy_unsent_transactions(source, columns)
+            header = columns
+        elif format == 'binary':
+            status = await copy_file_to_table(table_name, source, columns, format='binary')
+            imported = int(status.split()[-1])
+            header = columns
+        elif format == 'csv':
+            reader = csv.reader(source)
+            header = next(reader, None)
+            if not header:
+                raise ValueError('The CSV file must start with a header row.')
+            unknown = [column for column in header if column not in columns]
+            if unknown:
+                raise ValueError(f'Unknown columns for {table_name}: {", ".join(unknown)}.')
+
+            imported = 0
+            chunk = []
+            for line in reader:
+                chunk.append(line)
+                if len(chunk) == chunk_size:
+                    imported += await _copy_chunk(table_name, model, header, chunk, imported, on_progress)
+                    chunk = []
+            if chunk:
+                imported += await _copy_chunk(table_name, model, header, chunk, imported, on_progress)
+        else:
+            raise ValueError(f'Unsupported format: {format}. Choose csv or binary.')
+
+        if 'id' in header and imported:
+            # Explicit ids bypass the sequence, move it past them so later inserts don't collide.
+            await read_query(f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), MAX(id)) FROM {table_name}")
+
+    if on_progress is not None and format == 'binary':
+        on_progress(imported)
+
+    return imported
+
+
+async def _copy_chunk(table_name: str, model, header: list[str], chunk: list[list[str]], imported: int, on_progress) -> int:
+    # Line 1 is the header, so the first data row of the chunk is on line imported + 2.
+    records = _validate_chunk(model, header, chunk, first_line=imported + 2)
+    if table_name == 'transactions':
+        _check_unsent(header, records, first_line=imported + 2)
+    await copy_records(table_name, records, header)
+
+    if on_progress is not None:
+        on_progress(imported + len(records))
+
+    return len(records)
+
+
+def _check_unsent(header: list[str], records: list[tuple], first_line: int):
+    # Columns left out of the file get the defaults of the table, 'pending' and 'edited'.
+    expected = {'status': 'pending', 'condition': 'edited'}
+    checked = [(header.index(column), value) for column, value in expected.items() if column in header]
+
+    for offset, record in enumerate(records):
+        if any(record[index] != value for index, value in checked):
+            raise ValueError(f'Invalid row on line {first_line + offset}: only pending transactions that '
+                             f'haven\'t been sent can be imported.')
+
+
+async def _copy_unsent_transactions(source, columns) -> int:
+    # The rows of a binary file can't be checked before COPY, they are staged in a temporary table first.
+    await update_query('CREATE TEMP TABLE transactions_import (LIKE transactions INCLUDING DEFAULTS) ON COMMIT DROP')
+    await copy_file_to_table('transactions_import', source, columns, format='binary')
+
+    sent = await read_query("SELECT count(*) FROM transactions_import WHERE status <> 'pending' OR condition <> 'edited'")
+    if sent[0][0]:
+        raise ValueError(f'{sent[0][0]} of the transactions have been sent already, only pending transactions '
+                         f'that haven\'t been sent can be imported.')
+
+    status = await update_query(f"INSERT INTO transactions ({', '.join(columns)}) "
+                                f"SELECT {', '.join(columns)} FROM transactions_import")
+    return rows_from_status(status)
+
+
+async def export_table(table_name: str,
+                       output,
+                       format: str = 'csv',
+                       on_progress=None) -> int:
+    '''
+    This function bulk exports the transactions or users table with COPY, ordered by id.\n
+    Parameters:\n
+    - table_name: str\n
+        - 'transactions' or 'users'.\n
+    - output\n
+        - A path or a binary file object the data is written to.\n
+    - format: str\n
+        - 'csv' (with a header row that import_table accepts) or 'binary'.\n
+    - on_progress\n
+        - An optional callable that receives the number of bytes written so far.\n
+    Returns the number of exported rows.
+    '''
+
+    _, columns = _table(table_name)
+    if format not in ('csv', 'binary'):
+        raise ValueError(f'Unsupported format: {format}. Choose csv or binary.')
+
+    sql = f"SELECT {', '.join(columns)} FROM {table_name} ORDER BY id"
+
+    should_close = isinstance(output, str)
+    file = open(output, 'wb') if should_close else output
+    written = 0
+
+    async def write(chunk: bytes):
+        nonlocal written
+        file.write(chunk)
+        written += len(chunk)
+        if on_progress is not None:
+            on_progress(written)
+
+    try:
+        status = await copy_query_to(sql, output=write, format=format, header=format == 'csv')
+    finally:
+        if should_close:
+            file.close()
+
+    return int(status.split()[-1])
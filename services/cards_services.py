@@ -1,5 +1,6 @@
 import datetime
 from data.database_queries import insert_query, delete_query, read_query
+from data.loaders import load, get_loader
 from common.helper_functions import convert_to_datetime
 from data.models.cards import Card
 
@@ -17,10 +18,7 @@ async def delete(card_id: int, user_id: int) -> bool:
         raise Exception(f"Error deleting card: {e}")
 
 async def get_card_by_id(card_id: int):
-    card_data = await read_query('''SELECT id, card_number, cvv, card_holder, expiration_date, card_status, user_id, balance
-                              FROM cards
-                              WHERE id = $1''', (card_id,))
-    return Card.from_query_result(*card_data[0]) if card_data else None
+    return await load('cards', _fetch_cards_by_ids, card_id)
 
 
 async def get_card_info_by_id(card_id: int) -> Card:
@@ -30,14 +28,8 @@ async def get_card_info_by_id(card_id: int) -> Card:
     - card_id : int\n
         - The ID of the card to retrieve.
     '''
-    card_data = await read_query(sql='''SELECT id, card_number, cvv, card_holder, expiration_date, card_status, user_id, balance
-                                        FROM cards
-                                        WHERE id = $1''',
-                                 sql_params=(card_id,))
-    
-    card = next((Card.from_query_result(*row) for row in card_data), None)
 
-    return card
+    return await load('cards', _fetch_cards_by_ids, card_id)
 
 
 async def get_card_by_user_id(cards_user_id: int) -> int:
@@ -48,13 +40,46 @@ async def get_card_by_user_id(cards_user_id: int) -> int:
         - The ID of the user whose card ID is being retrieved.
     '''
 
+    card = await load('user_cards', _fetch_cards_by_user_ids, cards_user_id)
+
+    card_id = card.id
+
+    return card_id
+
+
+async def _fetch_cards_by_ids(card_ids: list[int]) -> dict[int, Card]:
     card_data = await read_query(sql='''SELECT id, card_number, cvv, card_holder, expiration_date, card_status, user_id, balance
                                         FROM cards
-                                        WHERE user_id = $1''',
-                           sql_params=(cards_user_id,))
-    
-    card = next((Card.from_query_result(*row) for row in card_data), None)
+                                        WHERE id = ANY($1::int[])''',
+                                 sql_params=(card_ids,))
+
+    return {row[0]: Card.from_query_result(*row) for row in card_data}
 
-    card_id = card.id
 
-    return card_id
\ No newline at end of file
+async def _fetch_cards_by_user_ids(user_ids: list[int]) -> dict[int, Card]:
+    card_data = await read_query(sql='''SELECT DISTINCT ON (user_id) id, card_number, cvv, card_holder, expiration_date, card_status, user_id, balance
+                                        FROM cards
+                                        WHERE user_id = ANY($1::int[])
+                                        ORDER BY user_id, id''',
+                                 sql_params=(user_ids,))
+
+    cards = {row[6]: Card.from_query_result(*row) for row in card_data}
+
+    # The same cards are usually looked up by ID next.
+    cards_loader = get_loader('cards', _fetch_cards_by_ids)
+    if cards_loader is not None:
+        for card in cards.values():
+            cards_loader.prime(card.id, card)
+
+    return cards
+
+
+def prime_card(card: Card):
+    '''
+    This function caches the card of a user loaded by another query for the rest of the request,
+    both by its ID and as the card of its user.
+    '''
+    cards_loader = get_loader('cards', _fetch_cards_by_ids)
+    if cards_loader is not None:
+        cards_loader.prime(card.id, card)
+        get_loader('user_cards', _fetch_cards_by_user_ids).prime(card.user_id, card)
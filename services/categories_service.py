@@ -1,5 +1,6 @@
 from data.models.categories import Category
 from data.database_queries import read_query, insert_query, update_query
+from data.loaders import load, load_many, get_loader
 
 
 async def get_all(search=None, sort_by=None, page=1, size=10):
@@ -58,9 +59,32 @@ async def get_category_by_id(category_id: int) -> Category:
         - The ID of the category to retrieve.\n
     '''
 
-    category_data = await read_query(sql='SELECT id, name FROM categories WHERE id = $1',
-                                     sql_params=(category_id,))
+    return await load('categories', _fetch_categories_by_ids, category_id)
 
-    category = next((Category.from_query_result(*row) for row in category_data), None)
 
-    return category
+async def get_categories_by_ids(category_ids) -> dict[int, Category]:
+    '''
+    This function retrieves many categories in one query.\n
+    Parameters:\n
+    - category_ids\n
+        - The IDs of the categories to retrieve, duplicates are allowed.\n
+    Returns a dict of the found categories by ID; IDs that don't exist are left out.
+    '''
+
+    return await load_many('categories', _fetch_categories_by_ids, category_ids)
+
+
+def prime_category(category: Category):
+    '''
+    This function caches a category loaded by another query for the rest of the request.
+    '''
+    loader = get_loader('categories', _fetch_categories_by_ids)
+    if loader is not None:
+        loader.prime(category.id, category)
+
+
+async def _fetch_categories_by_ids(category_ids: list[int]) -> dict[int, Category]:
+    categories_data = await read_query(sql='SELECT id, name FROM categories WHERE id = ANY($1::int[])',
+                                       sql_params=(category_ids,))
+
+    return {row[0]: Category.from_query_result(*row) for row in categories_data}
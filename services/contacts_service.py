@@ -1,18 +1,19 @@
 from data.models.contacts import Contact
+from data.statements import register_statement
 from data.database_queries import read_query, insert_query
 from common.responses import BadRequest
 
 
-search_contacts = '''SELECT username, email, phone_number
-                     FROM users 
-                     WHERE username LIKE $1 OR email LIKE $1 OR phone_number LIKE $1'''
+search_contacts = register_statement('search_contacts', '''SELECT username, email, phone_number
+                                                           FROM users 
+                                                           WHERE username LIKE $1 OR email LIKE $1 OR phone_number LIKE $1''')
 
-id_contacts = '''SELECT users_id, contact_user_id
-                 FROM contacts
-                 WHERE users_id = $1'''
+id_contacts = register_statement('id_contacts', '''SELECT users_id, contact_user_id
+                                                   FROM contacts
+                                                   WHERE users_id = $1''')
 
-values_contacts = '''INSERT INTO contacts(users_id, contact_user_id) 
-                     VALUES($1, $2)'''
+values_contacts = register_statement('values_contacts', '''INSERT INTO contacts(users_id, contact_user_id) 
+                                                           VALUES($1, $2)''')
 
 
 async def view_all_contacts(current_user: int,
@@ -36,14 +37,9 @@ async def view_all_contacts(current_user: int,
         
         return contacts[0]
 
-    contacts_all = []
-    for row in contacts:
-        contact = Contact.from_query_result(*row)
-        if contact not in contacts_all:
-            contacts_all.append(contact)
-
-    if contacts_all:
-        return contacts_all
+    # (users_id, contact_user_id) is the primary key of contacts, so every row is a different contact.
+    if contacts:
+        return [Contact.from_query_result(*row) for row in contacts]
     else:
         return None
 
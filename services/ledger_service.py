@@ -0,0 +1,215 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple
+from data.statements import register_statement
+from data.database_queries import read_query
+from data.unit_of_work import unit_of_work
+
+
+class Account(NamedTuple):
+    kind: str
+    id: int
+
+
+# Accounts without a balance column. Money coming from or going to a card outside the wallet is booked
+# against EXTERNAL, money of a transaction sent to another user waits on CLEARING until it is confirmed or declined.
+EXTERNAL = Account('external', 0)
+CLEARING = Account('clearing', 0)
+
+
+def user_account(user_id: int) -> Account:
+    return Account('user', user_id)
+
+
+def card_account(card_id: int) -> Account:
+    return Account('card', card_id)
+
+
+class Transfer(NamedTuple):
+    debit: Account
+    credit: Account
+    amount: int
+    ref: str
+
+
+class InsufficientFundsError(Exception):
+    '''
+    Raised when a transfer that requires funds would take the balance of the debited account below zero.
+    '''
+
+
+locked_cards = register_statement('locked_cards', '''SELECT id, balance
+                                                     FROM cards
+                                                     WHERE id = ANY($1::int[])
+                                                     ORDER BY id
+                                                     FOR UPDATE''')
+
+locked_users = register_statement('locked_users', '''SELECT id, balance
+                                                     FROM users
+                                                     WHERE id = ANY($1::int[])
+                                                     ORDER BY id
+                                                     FOR UPDATE''')
+
+# The entries of the transfers and the update of the cached balances they change, in one statement. The entries of
+# an account are summed first, UPDATE ... FROM applies only one matching row per updated row.
+# $1, $2, $3 and $4 are the references, account kinds, account ids and amounts of the entries.
+posted_ledger_entries = register_statement('posted_ledger_entries', '''WITH entries AS (INSERT INTO ledger_entries (ref, account_type, account_id, amount)
+                                                                                       SELECT * FROM unnest($1::text[], $2::text[], $3::int[], $4::bigint[])
+                                                                                       RETURNING account_type, account_id, amount),
+                                                                            users_balance AS (UPDATE users
+                                                                                              SET balance = users.balance + delta.amount / 100.0
+                                                                                              FROM (SELECT account_id, sum(amount) AS amount
+                                                                                                    FROM entries
+                                                                                                    WHERE account_type = 'user'
+                                                                                                    GROUP BY account_id) AS delta
+                                                                                              WHERE users.id = delta.account_id),
+                                                                            cards_balance AS (UPDATE cards
+                                                                                              SET balance = cards.balance + delta.amount / 100.0
+                                                                                              FROM (SELECT account_id, sum(amount) AS amount
+                                                                                                    FROM entries
+                                                                                                    WHERE account_type = 'card'
+                                                                                                    GROUP BY account_id) AS delta
+                                                                                              WHERE cards.id = delta.account_id)
+                                                                       SELECT count(*) FROM entries''')
+
+# A transfer between a user and EXTERNAL touches one balance only, so it needs no lock taken up front: the conditional
+# update locks the row, checks the funds and changes the balance at once. $1 is the user, $2 the amount, positive
+# when it is paid in, $3 the reference.
+posted_external_transfer = register_statement('posted_external_transfer', '''WITH account AS (UPDATE users
+                                                                                                 SET balance = users.balance + $2::bigint / 100.0
+                                                                                                 WHERE id = $1 AND ($2::bigint > 0 OR ROUND(users.balance::NUMERIC * 100) + $2::bigint >= 0)
+                                                                                                 RETURNING id, balance),
+                                                                                  entries AS (INSERT INTO ledger_entries (ref, account_type, account_id, amount)
+                                                                                              SELECT $3::text, entry.account_type, entry.account_id, entry.amount
+                                                                                              FROM account
+                                                                                              CROSS JOIN LATERAL (VALUES ('user', account.id, $2::bigint),
+                                                                                                                         ('external', 0, -$2::bigint)) AS entry(account_type, account_id, amount))
+                                                                             SELECT balance FROM account''')
+
+# Accounts with a balance column, in the order they are locked: cards before users, each table by id.
+_LOCKED_ACCOUNTS = (('card', locked_cards), ('user', locked_users))
+
+
+def to_minor_units(amount: float) -> int:
+    '''
+    This function converts an amount of money to a whole number of cents.\n
+    Parameters:\n
+    - amount: float\n
+        - The amount in dollars, as it is stored in the balance and amount columns.
+    '''
+
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+async def post_transfer(debit: Account, credit: Account, amount: int, ref: str, require_funds: bool = False):
+    '''
+    This function moves money between two accounts of the ledger.\n
+    Parameters:\n
+    - debit: Account\n
+        - The account the money is taken from.\n
+    - credit: Account\n
+        - The account the money is given to.\n
+    - amount: int\n
+        - The amount in cents, see to_minor_units.\n
+    - ref: str\n
+        - What the transfer is for, for example 'transaction:7:sent'. An account is posted to at most once per reference,
+          so the same transfer can't be booked twice.\n
+    - require_funds: bool\n
+        - Raise InsufficientFundsError instead of taking the debited account below zero. Default is False.\n
+    The ledger_entries table is append-only, every transfer adds one entry per account and the entries of a transfer
+    sum to zero. The balance columns of users and cards are a cache of the sum of their entries, kept up to date in
+    the same statement, so reading a balance stays a single row lookup. The accounts are locked first, always in the
+    same order, so concurrent transfers between the same accounts wait for each other instead of deadlocking or
+    losing an update. Called inside an open unit of work, the transfer commits or rolls back with it.
+    '''
+
+    await post_transfers([Transfer(debit=debit, credit=credit, amount=amount, ref=ref)], require_funds=require_funds)
+
+
+async def post_transfers(transfers: list[Transfer], require_funds: bool = False):
+    '''
+    This function books many transfers at once, see post_transfer.\n
+    Parameters:\n
+    - transfers: list[Transfer]\n
+        - The transfers to book.\n
+    - require_funds: bool\n
+        - Raise InsufficientFundsError instead of taking any debited account below zero. Default is False.\n
+    The accounts of all the transfers are locked together, the entries are inserted and the balances updated by one
+    statement, so the cost doesn't grow with a round trip per transfer. Either all of them are booked or none.
+    '''
+
+    for transfer in transfers:
+        if transfer.amount <= 0:
+            raise ValueError(f'A transfer moves a positive amount, got {transfer.amount}.')
+        if transfer.debit == transfer.credit:
+            raise ValueError(f'A transfer moves money between two different accounts, got {transfer.debit} twice.')
+    if not transfers:
+        return
+
+    deltas = {}
+    for transfer in transfers:
+        deltas[transfer.debit] = deltas.get(transfer.debit, 0) - transfer.amount
+        deltas[transfer.credit] = deltas.get(transfer.credit, 0) + transfer.amount
+
+    async with unit_of_work():
+        balances = await lock_accounts(deltas)
+
+        if require_funds:
+            for account, balance in balances.items():
+                if balance + deltas[account] < 0 and deltas[account] < 0:
+                    raise InsufficientFundsError(f'{account} has {balance} cents, {-deltas[account]} are needed.')
+
+        entries = [(transfer.ref, account, amount)
+                   for transfer in transfers
+                   for account, amount in ((transfer.debit, -transfer.amount), (transfer.credit, transfer.amount))]
+        await read_query(sql=posted_ledger_entries,
+                         sql_params=([ref for ref, _, _ in entries],
+                                     [account.kind for _, account, _ in entries],
+                                     [account.id for _, account, _ in entries],
+                                     [amount for _, _, amount in entries]))
+
+
+async def post_external_transfer(user_id: int, amount: int, ref: str) -> float | None:
+    '''
+    This function pays money into or out of the wallet of a user, with EXTERNAL on the other side of the transfer.\n
+    Parameters:\n
+    - user_id: int\n
+        - The ID of the user.\n
+    - amount: int\n
+        - The amount in cents, positive when it is paid in and negative when it is paid out.\n
+    - ref: str\n
+        - What the transfer is for, see post_transfer.\n
+    It is a single conditional statement and returns the new balance, or None when a payout would take the
+    balance below zero or there is no such user; nothing is posted then.
+    '''
+
+    if amount == 0:
+        raise ValueError('A transfer moves a non-zero amount.')
+
+    rows = await read_query(sql=posted_external_transfer,
+                            sql_params=(user_id, amount, ref))
+
+    return rows[0][0] if rows else None
+
+
+async def lock_accounts(accounts) -> dict[Account, int]:
+    '''
+    This function locks the rows of the accounts with a balance column until the end of the unit of work and
+    returns their balances in cents.\n
+    Parameters:\n
+    - accounts: Iterable[Account]\n
+        - The accounts to lock. Accounts without a balance column, like EXTERNAL and CLEARING, are left out.\n
+    The rows are always locked in the same order, cards before users and each table by id.
+    '''
+
+    balances = {}
+    for kind, statement in _LOCKED_ACCOUNTS:
+        ids = sorted({account.id for account in accounts if account.kind == kind})
+        if not ids:
+            continue
+
+        rows = await read_query(sql=statement, sql_params=(ids,))
+        if len(rows) != len(ids):
+            raise ValueError(f'No {kind} account with the id {sorted(set(ids) - {row[0] for row in rows})}.')
+        balances.update({Account(kind, row[0]): to_minor_units(row[1]) for row in rows})
+
+    return balances
@@ -1,105 +1,148 @@
 from data.models.recurring_transactions import RecurringTransaction
-from data.database_queries import read_query, insert_query, update_query
-from common.responses import BadRequest
-from datetime import datetime
-
-
-sql_recurring_transactions = '''SELECT id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id
-                                FROM recurring_transactions'''
-
-sender_id_recurring_transactions = '''SELECT id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id
-                                      FROM recurring_transactions
-                                      WHERE sender_id = $1'''
-
-id_recurring_transactions = '''SELECT id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id
-                                      FROM recurring_transactions
-                                      WHERE id = $1'''
-
-values_recurring_transactions = '''INSERT INTO recurring_transactions (recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id) 
-                                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8)'''
-
-
-async def view_all_recurring_transactions(current_user: int,
-                                          recurring_transaction_date: str | None = None,
-                                          categories_id: int | None = None):
+from data.statements import register_statement
+from data.connection import use_primary
+from data.database_queries import read_query, insert_query
+from data.unit_of_work import unit_of_work, retry_on_serialization_failure, StaleVersionError
+from common.pagination import encode_cursor, decode_cursor, keyset_condition
+from services import ledger_service
+from datetime import datetime, timedelta
+
+
+id_recurring_transactions = register_statement('id_recurring_transactions', '''SELECT id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id
+                                                                                      FROM recurring_transactions
+                                                                                      WHERE id = $1''')
+
+owned_id_recurring_transactions = register_statement('owned_id_recurring_transactions', '''SELECT id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id, version
+                                                                                           FROM recurring_transactions
+                                                                                           WHERE id = $1 AND (sender_id = $2 OR receiver_id = $2)''')
+
+# The state transitions of a recurring transaction, one conditional update each, see sent_transactions in
+# services.transactions_service. $1 is the recurring transaction, $2 and $3 the new status and condition, $4 the user.
+sent_recurring_transactions = register_statement('sent_recurring_transactions', '''UPDATE recurring_transactions
+                                                                                   SET status = $2, condition = $3, version = version + 1
+                                                                                   WHERE id = $1 AND sender_id = $4 AND receiver_id <> $4 AND status = 'pending' AND condition = 'edited'
+                                                                                   RETURNING id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id, version''')
+
+confirmed_recurring_transactions = register_statement('confirmed_recurring_transactions', '''UPDATE recurring_transactions
+                                                                                             SET status = $2, condition = $3, version = version + 1
+                                                                                             WHERE id = $1 AND receiver_id = $4 AND sender_id <> $4 AND status = 'pending' AND condition = 'sent'
+                                                                                             RETURNING id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id, version''')
+
+cancelled_recurring_transactions = register_statement('cancelled_recurring_transactions', '''UPDATE recurring_transactions
+                                                                                             SET status = $2, condition = $3, version = version + 1
+                                                                                             WHERE id = $1 AND sender_id = $4 AND status = 'pending' AND condition = 'edited'
+                                                                                             RETURNING id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id, version''')
+
+declined_recurring_transactions = register_statement('declined_recurring_transactions', '''UPDATE recurring_transactions
+                                                                                           SET status = $2, condition = $3, version = version + 1
+                                                                                           WHERE id = $1 AND receiver_id = $4 AND status = 'pending' AND condition = 'sent'
+                                                                                           RETURNING id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id, version''')
+
+values_recurring_transactions = register_statement('values_recurring_transactions', '''INSERT INTO recurring_transactions (recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id) 
+                                                                                       VALUES ($1, $2, $3, $4, $5, $6, $7, $8)''')
+
+
+RECURRING_TRANSACTIONS_SORT_COLUMNS = {'recurring_transaction_date': 'recurring_transaction_date',
+                                       'transaction_date': 'recurring_transaction_date',
+                                       'amount': 'amount'}
+
+
+async def view_recurring_transactions_page(current_user: int,
+                                           recurring_transaction_date: str | None = None,
+                                           categories_id: int | None = None,
+                                           sort: str | None = None,
+                                           sort_by: str | None = None,
+                                           page: int | None = None,
+                                           recurring_transactions_per_page: int = 5,
+                                           cursor: str | None = None) -> tuple[list[RecurringTransaction], int | None, str | None]:
     '''
-    This function returns a list of all the recurring transactions for the specified user.\n
+    This function returns one page of the recurring transactions the specified user sends, sorted and paginated
+    by the database.\n
     Parameters:\n
     - current_user: int\n
-        - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
-        - This parameter is used to ensure that the request is made by an authenticated user.\n
-    - transaction_date: str | None\n
-        - Filter transactions by a specific date.\n
+        - The ID of the currently authenticated user.\n
+    - recurring_transaction_date: str | None\n
+        - Filter recurring transactions by a specific date.\n
     - categories_id: int | None\n
-        Filter recurring transactions by category ID.
+        - Filter recurring transactions by category ID.\n
+    - sort: str | None\n
+        - 'asc' or 'desc'. Default is ascending.\n
+    - sort_by: str | None\n
+        - 'recurring_transaction_date' (or 'transaction_date') or 'amount'. Default is 'recurring_transaction_date'.\n
+    - page: int | None\n
+        - The page number to retrieve. If neither page nor cursor is given, all recurring transactions are returned.\n
+    - recurring_transactions_per_page: int\n
+        - The number of recurring transactions per page. Default is 5.\n
+    - cursor: str | None\n
+        - The next cursor of the previous page. It takes the place of page and reads the page as an index range scan.\n
+    Returns the recurring transactions, the total number that match the filters (None when a cursor is used,
+    counting would read the whole history) and the cursor of the next page. It raises ValueError for a wrong date
+    format, an unsupported sort attribute or an invalid cursor.
     '''
 
-    sql_parameters = []
-    loc_sql_recurring_transactions = sql_recurring_transactions
-
-    if recurring_transaction_date or categories_id:
-        filter_by = []
-        if recurring_transaction_date:
-            try:
-                recurring_transaction_date = datetime.strptime(recurring_transaction_date, '%Y-%m-%d').date()
-            except ValueError:
-                return BadRequest(content=f'Incorrect date format, should be YYYY-MM-DD.')
-            filter_by.append(f'DATE(recurring_transaction_date) = ${len(sql_parameters) + 1}')
-            sql_parameters.append(recurring_transaction_date)
-        if categories_id:
-            filter_by.append(f'categories_id = ${len(sql_parameters) + 1}')
-            sql_parameters.append(categories_id)
-
-        if filter_by:
-            loc_sql_recurring_transactions += ' WHERE ' + ' AND '.join(filter_by)
-
-        sql_parameters = tuple(sql_parameters)
-        rows = await read_query(sql=loc_sql_recurring_transactions,
-                                sql_params=sql_parameters)
-    
-        if rows != []:
-            return [RecurringTransaction.from_query_result(*row) for row in rows]
-        else:
-            return None
-     
+    sort_by = sort_by or 'recurring_transaction_date'
+    if sort_by not in RECURRING_TRANSACTIONS_SORT_COLUMNS:
+        raise ValueError(f'Unsupported sort attribute: {sort_by}.')
+    column = RECURRING_TRANSACTIONS_SORT_COLUMNS[sort_by]
+    sort = 'desc' if sort == 'desc' else 'asc'
+
+    sql_parameters = [current_user]
+    filter_by = ['sender_id = $1']
+    if recurring_transaction_date:
+        try:
+            day = datetime.strptime(recurring_transaction_date, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError('Incorrect date format, should be YYYY-MM-DD.')
+        filter_by.append(f'recurring_transaction_date >= ${len(sql_parameters) + 1} AND recurring_transaction_date < ${len(sql_parameters) + 2}')
+        sql_parameters.extend([day, day + timedelta(days=1)])
+    if categories_id:
+        filter_by.append(f'categories_id = ${len(sql_parameters) + 1}')
+        sql_parameters.append(categories_id)
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_by=column, sort=sort)
+        filter_by.append(keyset_condition(column, sort, len(sql_parameters) + 1))
+        sql_parameters.extend([value, last_id])
+        total = ''
     else:
-        recurring_transactions = await read_query(sql=sender_id_recurring_transactions,
-                                                  sql_params=(current_user,))
-
-        recurring_transactions_all = []
-        for row in recurring_transactions:
-            recurring_transaction = RecurringTransaction.from_query_result(*row)
-            if recurring_transaction not in recurring_transactions_all:
-                recurring_transactions_all.append(recurring_transaction)
-
-        if recurring_transactions_all != []:
-            return recurring_transactions_all
+        total = ', COUNT(*) OVER() AS total_count'
+
+    sql = f'''SELECT id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id{total}
+             FROM recurring_transactions
+             WHERE {' AND '.join(filter_by)}
+             ORDER BY {column} {sort.upper()}, id {sort.upper()}'''
+
+    paginated = bool(page or cursor)
+    if cursor:
+        sql += f' LIMIT ${len(sql_parameters) + 1}'
+        sql_parameters.append(recurring_transactions_per_page)
+    elif page:
+        sql += f' LIMIT ${len(sql_parameters) + 1} OFFSET ${len(sql_parameters) + 2}'
+        sql_parameters.extend([recurring_transactions_per_page, (page - 1) * recurring_transactions_per_page])
+
+    rows = await read_query(sql=sql, sql_params=tuple(sql_parameters))
+
+    if cursor:
+        recurring_transactions = [RecurringTransaction.from_query_result(*row) for row in rows]
+        total_count = None
+    else:
+        recurring_transactions = [RecurringTransaction.from_query_result(*row[:-1]) for row in rows]
+        if rows:
+            total_count = rows[0]['total_count']
+        elif page and page > 1:
+            # A page past the end has no rows to carry the total, count it separately without LIMIT and OFFSET.
+            count = await read_query(sql=f"SELECT COUNT(*) FROM recurring_transactions WHERE {' AND '.join(filter_by)}",
+                                     sql_params=tuple(sql_parameters[:-2]))
+            total_count = count[0][0]
         else:
-            return None
+            total_count = 0
 
+    next_cursor = None
+    if paginated and len(recurring_transactions) == recurring_transactions_per_page:
+        last = recurring_transactions[-1]
+        next_cursor = encode_cursor(column, sort, getattr(last, column), last.id)
 
-def sort_recurring_transactions(recurring_transactions: list[RecurringTransaction], *,
-                                attribute='recurring_transaction_date',
-                                reverse=False):
-    '''
-    This function sorts a list of recurring transactions based on a specified attribute.\n
-    Parameters:\n
-    - recurring_transactions: list[RecurringTransaction]\n
-        - A list of RecurringTransaction objects to be sorted.
-    - attribute: str\n
-        - The attribute to sort the transactions by. Default is 'recurring_transaction_date'.\n
-    - reverse: bool\n
-        - Whether to sort in reverse order. Default is False (ascending order).
-    '''
-
-    if attribute == 'recurring_transaction_date':
-        def sort_fn(t: RecurringTransaction): return t.recurring_transaction_date
-    elif attribute == 'amount':
-        def sort_fn(t: RecurringTransaction): return t.amount
-    else:
-        return BadRequest(content=f'Unsupported sort attribute: {attribute}.')
-     
-    return sorted(recurring_transactions, key=sort_fn, reverse=reverse)
+    return recurring_transactions, total_count, next_cursor
 
 
 async def view_recurring_transaction_by_id(recurring_transaction_id: int,
@@ -111,18 +154,13 @@ async def view_recurring_transaction_by_id(recurring_transaction_id: int,
         - The ID of the transaction to retrieve details for.\n
     - current_user : int\n
         - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
-        - This parameter is used to ensure that the request is made by an authenticated user.
+        - This parameter is used to ensure that the request is made by an authenticated user.\n
+    It returns None both when there is no such recurring transaction and when the user neither sent nor receives it.
     '''
 
-    recurring_transactions = await read_query(sql=sender_id_recurring_transactions,
-                                              sql_params=(current_user,))
+    recurring_transaction_by_id = await read_query(sql=owned_id_recurring_transactions,
+                                                   sql_params=(recurring_transaction_id, current_user))
 
-    if recurring_transactions:
-        recurring_transaction_by_id = await read_query(sql=id_recurring_transactions,
-                                                       sql_params=(recurring_transaction_id,))
-    else:
-        return None
-     
     recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transaction_by_id), None)
 
     return recurring_transaction 
@@ -154,7 +192,10 @@ async def create_recurring_transaction(recurring_transaction: RecurringTransacti
         return None
 
 
+@retry_on_serialization_failure()
 async def preview_edited_recurring_transaction(recurring_transaction_id: int,
+                                               current_user: int,
+                                               version: int,
                                                new_next_payment: str | None = None,
                                                new_amount: float | None = None,
                                                new_categories_id: int | None = None,
@@ -164,47 +205,50 @@ async def preview_edited_recurring_transaction(recurring_transaction_id: int,
     Parameters:\n
     - recurring_transaction_id : int\n
         - The ID of the recurring transaction to retrieve details for.\n
-    - recurring_transaction : RecurringTransaction\n
-        - The recurring transaction's details to be added to the user's recurring transactions.\n
+    - current_user: int\n
+        - The ID of the user editing the recurring transaction, only its sender can.\n
+    - version: int\n
+        - The version of the recurring transaction the edit is based on. If the recurring transaction has been
+          changed since, StaleVersionError is raised instead of overwriting the other change.\n
+    - new_next_payment: str\n
+        - The new date of the next payment.\n
     - new_amount: float\n
         - The new amount to update the recurring transaction with.\n
-    - new_category_name: str\n
-        - The new category name to update the recurring transaction with.\n
+    - new_categories_id: int\n
+        - The new category ID to update the recurring transaction with.\n
     - new_receiver_id: int\n
-        - The new receiver ID to update the recurring transaction with.
+        - The new receiver ID to update the recurring transaction with.\n
+    The supplied fields are changed by one UPDATE that returns the edited recurring transaction. Only pending
+    recurring transactions that haven't been sent can be edited, for others it returns None.
     '''
 
-    recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                              sql_params=(recurring_transaction_id,))
-
-    recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
-
-    if recurring_transaction is None:
-        return None 
-    
-    if new_next_payment is not None:
-        edited_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET next_payment = $1 WHERE id = $2',
-                                                          sql_params=(new_next_payment, recurring_transaction_id))
-    if new_amount is not None:
-        edited_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET amount = $1 WHERE id = $2',
-                                                          sql_params=(new_amount, recurring_transaction_id))
-    if new_categories_id is not None:
-        edited_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET categories_id = $1 WHERE id = $2',
-                                                          sql_params=(new_categories_id, recurring_transaction_id))
-    if new_receiver_id is not None:
-        edited_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET receiver_id = $1 WHERE id = $2',
-                                                          sql_params=(new_receiver_id, recurring_transaction_id))
-          
-    edited_recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                                     sql_params=(recurring_transaction_id,))
-
-    edited_recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in edited_recurring_transactions), None)
+    sql_parameters = [recurring_transaction_id, current_user, version]
+    assignments = []
+    changes = {'next_payment': new_next_payment, 'amount': new_amount, 'categories_id': new_categories_id, 'receiver_id': new_receiver_id}
+    for column, value in changes.items():
+        if value is not None:
+            sql_parameters.append(value)
+            assignments.append(f'{column} = ${len(sql_parameters)}')
+    assignments.append('version = version + 1')
+
+    recurring_transactions = await read_query(sql=f'''UPDATE recurring_transactions SET {', '.join(assignments)}
+                                                     WHERE id = $1 AND sender_id = $2 AND version = $3 AND status = 'pending' AND condition = 'edited'
+                                                     RETURNING id, recurring_transaction_date, next_payment, status, condition, amount, sender_id, receiver_id, categories_id, version''',
+                                              sql_params=tuple(sql_parameters))
+
+    edited_recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
+
+    if edited_recurring_transaction is None:
+        current = await read_query(sql='SELECT version FROM recurring_transactions WHERE id = $1 AND sender_id = $2',
+                                   sql_params=(recurring_transaction_id, current_user))
+        if current and current[0][0] != version:
+            raise StaleVersionError(f'Recurring transaction {recurring_transaction_id} has been changed since version {version}.')
 
     return edited_recurring_transaction
 
 
+@retry_on_serialization_failure()
 async def preview_sent_recurring_transaction(recurring_transaction_id: int,
-                                             amount: float,
                                              status: str,
                                              condition_action: str,
                                              current_user: int):
@@ -213,47 +257,29 @@ async def preview_sent_recurring_transaction(recurring_transaction_id: int,
     Parameters:\n
     - recurring_transaction_id : int\n
         - The ID of the recurring transaction to retrieve details for.\n
-    - amount: float\n
-        - The amount to be updated in the recurring transaction.\n
     - status: str\n
         - The new status of the recurring transaction.\n
     - condition_action: str\n
         - The new condition of the recurring transaction.\n
     - current_user: int\n
-        - The ID of the currently authenticated user.
+        - The ID of the currently authenticated user.\n
+    The transition and the transfer of the amount commit together, see _post_recurring_transition.
+    It returns None if the user didn't send the recurring transaction or it isn't pending and edited any more.
     '''
 
-    recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                              sql_params=(recurring_transaction_id,))
+    async with unit_of_work():
+        recurring_transactions = await read_query(sql=sent_recurring_transactions,
+                                                  sql_params=(recurring_transaction_id, status, condition_action, current_user))
 
-    recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
+        recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
+        if recurring_transaction is not None:
+            await _post_recurring_transition(recurring_transaction, 'sent')
 
-    if recurring_transaction is None:
-        return None 
-
-    sender_id = recurring_transaction.sender_id
-    receiver_id = recurring_transaction.receiver_id
-
-    sent_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET status = $1, condition = $2 WHERE id = $3',
-                                                    sql_params=(status, condition_action, recurring_transaction_id))
-     
-    if current_user == sender_id and current_user != receiver_id:
-        updated_user_balance = await update_query(sql='UPDATE users SET balance = balance - $1 WHERE id = $2',
-                                                  sql_params=(amount, sender_id))
-    if current_user == receiver_id:
-        updated_user_balance = await update_query(sql='UPDATE users SET balance = balance + $1 WHERE id = $2',
-                                                  sql_params=(amount, receiver_id))
-
-    sent_recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                                   sql_params=(recurring_transaction_id,))
-
-    sent_recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in sent_recurring_transactions), None)
-
-    return sent_recurring_transaction
+    return recurring_transaction
 
 
+@retry_on_serialization_failure()
 async def preview_confirmed_recurring_transaction(recurring_transaction_id: int,
-                                                  amount: float,
                                                   status: str,
                                                   condition_action: str,
                                                   current_user: int):
@@ -262,45 +288,31 @@ async def preview_confirmed_recurring_transaction(recurring_transaction_id: int,
     Parameters:\n
     - recurring_transaction_id : int\n
         - The ID of the recurring transaction to retrieve details for.\n
-    - amount: float\n
-        - The amount to be updated in the recurring transaction.\n
     - status: str\n
         - The new status of the recurring transaction.\n
     - condition_action: str\n
         - The new condition of the recurring transaction.\n
     - current_user: int\n
-        - The ID of the currently authenticated user.
+        - The ID of the currently authenticated user.\n
+    It returns None if the user isn't the receiver or the recurring transaction isn't waiting for them any more.
     '''
 
-    recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                              sql_params=(recurring_transaction_id,))
-
-    recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
-
-    if recurring_transaction is None:
-        return None 
+    async with unit_of_work():
+        recurring_transactions = await read_query(sql=confirmed_recurring_transactions,
+                                                  sql_params=(recurring_transaction_id, status, condition_action, current_user))
 
-    sender_id = recurring_transaction.sender_id
-    receiver_id = recurring_transaction.receiver_id
+        recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
+        if recurring_transaction is not None:
+            await _post_recurring_transition(recurring_transaction, 'confirmed')
 
-    confirmed_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET status = $1, condition = $2 WHERE id = $3',
-                                                         sql_params=(status, condition_action, recurring_transaction_id))
-
-    if current_user != sender_id and current_user == receiver_id:
-        updated_user_balance = await update_query(sql='UPDATE users SET balance = balance + $1 WHERE id = $2',
-                                                  sql_params=(amount, receiver_id))
-          
-    confirmed_recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                                        sql_params=(recurring_transaction_id,))
-
-    confirmed_recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in confirmed_recurring_transactions), None)
-
-    return confirmed_recurring_transaction
+    return recurring_transaction
 
 
+@retry_on_serialization_failure()
 async def preview_cancelled_recurring_transaction(recurring_transaction_id: int,
                                                   status: str,
-                                                  condition_action: str):
+                                                  condition_action: str,
+                                                  current_user: int):
     '''
     This function previews a recurring transaction if it will be cancelled.\n
     Parameters:\n
@@ -310,29 +322,19 @@ async def preview_cancelled_recurring_transaction(recurring_transaction_id: int,
         - The new status of the recurring transaction.\n
     - condition_action: str\n
         - The new condition of the recurring transaction.\n
+    - current_user: int\n
+        - The ID of the currently authenticated user.\n
+    It returns None if the user didn't send the recurring transaction or it has been sent already.
     '''
 
-    recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                              sql_params=(recurring_transaction_id,))
+    recurring_transactions = await read_query(sql=cancelled_recurring_transactions,
+                                              sql_params=(recurring_transaction_id, status, condition_action, current_user))
 
-    recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
-
-    if recurring_transaction is None:
-        return None 
-
-    cancelled_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET status = $1, condition = $2 WHERE id = $3',
-                                                         sql_params=(status, condition_action, recurring_transaction_id))
-     
-    cancelled_recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                                        sql_params=(recurring_transaction_id,))
-
-    cancelled_recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in cancelled_recurring_transactions), None)
-
-    return cancelled_recurring_transaction
+    return next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
 
 
+@retry_on_serialization_failure()
 async def preview_declined_recurring_transaction(recurring_transaction_id: int,
-                                                 amount: float,
                                                  status: str,
                                                  condition_action: str,
                                                  current_user: int):
@@ -341,41 +343,39 @@ async def preview_declined_recurring_transaction(recurring_transaction_id: int,
     Parameters:\n
     - recurring_transaction_id : int\n
         - The ID of the recurring transaction to retrieve details for.\n
-    - amount: float
-        The amount of the recurring transaction.
-    - status: str
-        The new status of the recurring transaction.
-    - condition_action: str
-        The new condition of the recurring transaction.
-    - current_user: int
-        The ID of the currently authenticated user.
+    - status: str\n
+        - The new status of the recurring transaction.\n
+    - condition_action: str\n
+        - The new condition of the recurring transaction.\n
+    - current_user: int\n
+        - The ID of the currently authenticated user.\n
+    It returns None if the user isn't the receiver or the recurring transaction isn't waiting for them any more.
     '''
 
-    recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                              sql_params=(recurring_transaction_id,))
-
-    recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
+    async with unit_of_work():
+        recurring_transactions = await read_query(sql=declined_recurring_transactions,
+                                                  sql_params=(recurring_transaction_id, status, condition_action, current_user))
 
-    if recurring_transaction is None:
-        return None 
+        recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in recurring_transactions), None)
+        if recurring_transaction is not None:
+            await _post_recurring_transition(recurring_transaction, 'declined')
 
-    declined_amount = amount
-    sender = recurring_transaction.sender_id
-    receiver = current_user
+    return recurring_transaction
 
-    updated_user_balance = await update_query(sql='UPDATE users SET balance = balance + $1 WHERE id = $2',
-                                              sql_params=(declined_amount, sender))
 
-    declined_recurring_transaction = await update_query(sql='UPDATE recurring_transactions SET status = $1, condition = $2 WHERE id = $3',
-                                                        sql_params=(status, condition_action, recurring_transaction_id))
-     
-
-    declined_recurring_transactions = await read_query(sql=id_recurring_transactions,
-                                                       sql_params=(recurring_transaction_id,))
-
-    declined_recurring_transaction = next((RecurringTransaction.from_query_result(*row) for row in declined_recurring_transactions), None)
+async def _post_recurring_transition(recurring_transaction: RecurringTransaction, transition: str):
+    # The amount waits on the clearing account from sending until the receiver confirms or declines it.
+    if transition == 'sent':
+        debit, credit = ledger_service.user_account(recurring_transaction.sender_id), ledger_service.CLEARING
+    elif transition == 'confirmed':
+        debit, credit = ledger_service.CLEARING, ledger_service.user_account(recurring_transaction.receiver_id)
+    else:
+        debit, credit = ledger_service.CLEARING, ledger_service.user_account(recurring_transaction.sender_id)
 
-    return declined_recurring_transaction
+    await ledger_service.post_transfer(debit=debit,
+                                       credit=credit,
+                                       amount=ledger_service.to_minor_units(recurring_transaction.amount),
+                                       ref=f'recurring_transaction:{recurring_transaction.id}:{transition}')
 
 
 async def recurring_transaction_id_exists(recurring_transaction_id: int) -> bool:
@@ -386,5 +386,7 @@ async def recurring_transaction_id_exists(recurring_transaction_id: int) -> bool
         - The ID of the recurring transaction to check for existence.
     '''
 
-    return any(await read_query(sql=id_recurring_transactions,
-                                         sql_params=(recurring_transaction_id,)))
\ No newline at end of file
+    # The transition that follows is decided on this read, a lagging replica may not have the row yet.
+    async with use_primary():
+        return any(await read_query(sql=id_recurring_transactions,
+                                    sql_params=(recurring_transaction_id,)))
\ No newline at end of file
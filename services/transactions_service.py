@@ -1,134 +1,311 @@
 from data.models.transactions import Transaction
-from data.database_queries import read_query, insert_query, update_query
-from common.responses import BadRequest
-from services import cards_services
-from datetime import datetime
+from schemas.transactions import TransactionViewAll, TransactionView
+from data.statements import register_statement
+from data.connection import use_primary
+from data.database_queries import read_query, insert_query, insert_many_returning
+from data.unit_of_work import unit_of_work, retry_on_serialization_failure, StaleVersionError
+from common.pagination import encode_cursor, decode_cursor, keyset_condition
+from services import cards_services, ledger_service
+from datetime import datetime, timedelta
+
+id_transactions = register_statement('id_transactions', '''SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id
+                                                           FROM transactions
+                                                           WHERE id = $1''')
+
+id_transaction_views = register_statement('id_transaction_views', '''SELECT transactions.status, transactions.condition, transactions.transaction_date, transactions.amount, transactions.category_name,
+                                                                           senders.username AS sender, receivers.username AS receiver,
+                                                                           CASE WHEN transactions.receiver_id = $2 THEN 'incoming' ELSE 'outgoing' END AS direction, transactions.version
+                                                                    FROM transactions
+                                                                    JOIN users AS senders ON senders.id = transactions.sender_id
+                                                                    JOIN users AS receivers ON receivers.id = transactions.receiver_id
+                                                                    WHERE transactions.id = $1 AND (transactions.sender_id = $2 OR transactions.receiver_id = $2)''')
+
+# The state transitions of a transaction. Each one is a single conditional update: the WHERE clause checks who
+# makes it and the state it starts from, so a repeated or concurrent click finds no row. The money moves through
+# the ledger in the same unit of work, see _post_transition. $1 is the transaction, $2 and $3 the new status and
+# condition, $4 the user.
+sent_transactions = register_statement('sent_transactions', '''UPDATE transactions
+                                                             SET status = $2, condition = $3, version = version + 1
+                                                             WHERE id = $1 AND sender_id = $4 AND status = 'pending' AND condition = 'edited'
+                                                             RETURNING id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id, version''')
+
+confirmed_transactions = register_statement('confirmed_transactions', '''UPDATE transactions
+                                                                       SET status = $2, condition = $3, version = version + 1
+                                                                       WHERE id = $1 AND receiver_id = $4 AND sender_id <> $4 AND status = 'pending' AND condition = 'sent'
+                                                                       RETURNING id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id, version''')
+
+cancelled_transactions = register_statement('cancelled_transactions', '''UPDATE transactions
+                                                                       SET status = $2, condition = $3, version = version + 1
+                                                                       WHERE id = $1 AND sender_id = $4 AND status = 'pending' AND condition = 'edited'
+                                                                       RETURNING id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id, version''')
+
+declined_transactions = register_statement('declined_transactions', '''UPDATE transactions
+                                                                     SET status = $2, condition = $3, version = version + 1
+                                                                     WHERE id = $1 AND receiver_id = $4 AND status = 'pending' AND condition = 'sent'
+                                                                     RETURNING id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id, version''')
+
+values_transactions = register_statement('values_transactions', '''INSERT INTO transactions(status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id) 
+                                                                   VALUES($1, $2, $3, $4, $5, $6, $7, $8)''')
+
+
+# Transactions created by a batch have been sent already, see create_sent_transactions. The ids are drawn for the
+# rows numbered WITH ORDINALITY before they are inserted, so they come back in the order of the arrays.
+values_many_transactions = register_statement('values_many_transactions', '''WITH input AS (SELECT nextval(pg_get_serial_sequence('transactions', 'id')) AS id, input.*
+                                                                                            FROM unnest($1::text[], $2::text[], $3::timestamp[], $4::float8[], $5::text[], $6::int[], $7::int[], $8::int[])
+                                                                                                 WITH ORDINALITY AS input(status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id, ordinality)),
+                                                                                  inserted AS (INSERT INTO transactions(id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id)
+                                                                                               SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id
+                                                                                               FROM input)
+                                                                             SELECT id FROM input ORDER BY ordinality''')
+
+TRANSACTIONS_SORT_COLUMNS = ('transaction_date', 'amount')
+
+
+async def view_transactions_page(current_user: int,
+                                 transaction_date: str | None = None,
+                                 sender: int | None = None,
+                                 receiver: int | None = None,
+                                 direction: str | None = None,
+                                 sort: str | None = None,
+                                 sort_by: str | None = None,
+                                 page: int | None = None,
+                                 transactions_per_page: int = 5) -> tuple[list[TransactionViewAll], int, str | None]:
+     '''
+     This function returns one page of the transactions of the specified user, the total number of
+     transactions that match the filters and the cursor of the next page, if page is given and this page is full.
+     Filtering, sorting and pagination are done by the database, which also adds the usernames and the direction.\n
+     Parameters:\n
+     - current_user: int\n
+          - The ID of the currently authenticated user. Only transactions they sent or received are returned.\n
+     - transaction_date: str | None\n
+          - Only transactions made on this day, in the YYYY-MM-DD format.\n
+     - sender: int | None\n
+          - Only transactions sent by this user.\n
+     - receiver: int | None\n
+          - Only transactions received by this user.\n
+     - direction: str | None\n
+          - 'incoming' or 'outgoing', relative to the current user.\n
+     - sort: str | None\n
+          - 'asc' or 'desc'. Default is ascending.\n
+     - sort_by: str | None\n
+          - 'transaction_date' or 'amount'. Default is 'transaction_date'.\n
+     - page: int | None\n
+          - The page number to retrieve. If not specified, all transactions are returned.\n
+     - transactions_per_page: int\n
+          - The number of transactions per page. Default is 5.\n
+     It raises ValueError for a wrong date format or an unsupported sort attribute.
+     '''
+
+     sql, sql_parameters = _transactions_page_query(current_user=current_user,
+                                                    transaction_date=transaction_date,
+                                                    sender=sender,
+                                                    receiver=receiver,
+                                                    direction=direction,
+                                                    sort=sort,
+                                                    sort_by=sort_by,
+                                                    page=page,
+                                                    transactions_per_page=transactions_per_page)
+
+     rows = await read_query(sql=sql, sql_params=sql_parameters)
+
+     if rows:
+          next_cursor = next_transactions_cursor(rows, sort=sort, sort_by=sort_by,
+                                                 transactions_per_page=transactions_per_page) if page else None
+          return [TransactionViewAll.from_query_result(*row[1:-1]) for row in rows], rows[0]['total_count'], next_cursor
+
+     if page and page > 1:
+          # A page past the end has no rows to carry the total, count it separately.
+          count_sql, count_parameters = _transactions_page_query(current_user=current_user,
+                                                                 transaction_date=transaction_date,
+                                                                 sender=sender,
+                                                                 receiver=receiver,
+                                                                 direction=direction,
+                                                                 count_only=True)
+          count = await read_query(sql=count_sql, sql_params=count_parameters)
+          return [], count[0][0], None
+
+     return [], 0, None
+
+
+def _transactions_page_query(current_user: int,
+                             transaction_date: str | None = None,
+                             sender: int | None = None,
+                             receiver: int | None = None,
+                             direction: str | None = None,
+                             sort: str | None = None,
+                             sort_by: str | None = None,
+                             page: int | None = None,
+                             transactions_per_page: int = 5,
+                             count_only: bool = False):
+     '''
+     This function builds the SQL and the parameters of a page of a user's transactions.
+     Sort columns are taken from TRANSACTIONS_SORT_COLUMNS only, never from the request as they are.
+     '''
+
+     sort_by, sort_order = _transactions_sort(sort=sort, sort_by=sort_by)
+     sql_parameters = [current_user]
+     filter_by = ['(sender_id = $1 OR receiver_id = $1)'] + _transactions_filters(sql_parameters=sql_parameters,
+                                                                                   transaction_date=transaction_date,
+                                                                                   sender=sender,
+                                                                                   receiver=receiver,
+                                                                                   direction=direction)
 
-sql_transactions = '''SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id
-                      FROM transactions'''
+     where = ' WHERE ' + ' AND '.join(filter_by)
 
-sender_id_transactions = '''SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id
-                            FROM transactions
-                            WHERE sender_id = $1'''
+     if count_only:
+          return 'SELECT COUNT(*) FROM transactions' + where, tuple(sql_parameters)
 
-receiver_id_transactions = '''SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id
-                              FROM transactions
-                              WHERE receiver_id = $1'''
+     sql = f'''SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id,
+                   COUNT(*) OVER() AS total_count
+              FROM transactions{where}
+              ORDER BY {sort_by} {sort_order}, id {sort_order}'''
 
-id_transactions = '''SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id
-                     FROM transactions
-                     WHERE id = $1'''
+     if page:
+          sql += f' LIMIT ${len(sql_parameters) + 1} OFFSET ${len(sql_parameters) + 2}'
+          sql_parameters.extend([transactions_per_page, (page - 1) * transactions_per_page])
 
-values_transactions = '''INSERT INTO transactions(status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id) 
-                         VALUES($1, $2, $3, $4, $5, $6, $7, $8)'''
+     return _transaction_views_query(sql, sort_by=sort_by, sort_order=sort_order, total_count=True), tuple(sql_parameters)
 
 
-async def view_all_transactions(current_user: int,
-                                transaction_date: str | None = None,
-                                sender: str | None = None,
-                                receiver: str | None = None,
-                                direction: str | None = None):
+def _transaction_views_query(sql: str, sort_by: str, sort_order: str, total_count: bool = False) -> str:
+     '''
+     This function wraps a query of a page of transactions into one that returns the rows of TransactionViewAll,
+     after the ID of the transaction: the usernames of the sender and the receiver, joined for the page only,
+     and the direction for the current user, who must be parameter $1.
      '''
-     This function returns a list of all the transactions for the specified user.\n
-     Parameters:\n
-     - current_user: int\n
-          - The ID of the currently authenticated user, automatically injected by Depends(get_current_user).\n
-          - This parameter is used to ensure that the request is made by an authenticated user.\n
-     - transaction_date: str | None\n
-          - Filter transactions by a specific date.\n
-     - sender: int | None\n
-          - Filter transactions by the sender's user ID.\n
-     - receiver: int | None\n
-          - Filter transactions by the receiver's user ID.\n
-     - direction: str | None\n
-          - Filter transactions by direction ('incoming' or 'outgoing').\n
-     '''
-
-     sql_parameters = []
-     loc_sql_transactions = sql_transactions
-
-     if transaction_date or sender or receiver or direction:
-          filter_by = []
-          if transaction_date:
-               try:
-                    transaction_date = datetime.strptime(transaction_date, '%Y-%m-%d').date()
-               except ValueError:
-                    return BadRequest(content=f'Incorrect date format, should be YYYY-MM-DD.')
-               filter_by.append(f'DATE(transaction_date) = ${len(sql_parameters) + 1}')
-               sql_parameters.append(transaction_date)
-          if sender:
-               filter_by.append(f'sender_id = ${len(sql_parameters) + 1}')
-               sql_parameters.append(sender)
-          if receiver:
-               filter_by.append(f'receiver_id = ${len(sql_parameters) + 1}')
-               sql_parameters.append(receiver)
-          if direction:
-               if direction == 'outgoing' and current_user == receiver:
-                    filter_by.append(f'sender_id = ${len(sql_parameters) + 1}')
-                    sql_parameters.append(current_user)
-               elif direction == 'incoming':
-                    filter_by.append(f'receiver_id = ${len(sql_parameters) + 1}')
-                    sql_parameters.append(current_user)
-
-          if filter_by:
-               loc_sql_transactions += ' WHERE ' + ' AND '.join(filter_by)
-
-          sql_parameters = tuple(sql_parameters)
-          rows = await read_query(sql=loc_sql_transactions,
-                                  sql_params=sql_parameters)
-
-          if rows != []:
-               return [Transaction.from_query_result(*row) for row in rows]
-          else:
-               return None
 
-     else:
-          transactions_incoming = await read_query(sql=receiver_id_transactions,
-                                                   sql_params=(current_user,))
-          transactions_outgoing = await read_query(sql=sender_id_transactions,
-                                                   sql_params=(current_user,))
-          transactions = transactions_incoming + transactions_outgoing
-
-          transactions_all = []
-          for row in transactions:
-               transaction = Transaction.from_query_result(*row)
-               if transaction not in transactions_all:
-                    transactions_all.append(transaction)
-
-          if transactions_all != []:
-               return transactions_all
-          else:
-               return None
+     return f'''SELECT history.id, history.transaction_date, history.amount,
+                    senders.username AS sender, receivers.username AS receiver,
+                    CASE WHEN history.receiver_id = $1 THEN 'incoming' ELSE 'outgoing' END AS direction{', history.total_count' if total_count else ''}
+               FROM ({sql}) AS history
+               JOIN users AS senders ON senders.id = history.sender_id
+               JOIN users AS receivers ON receivers.id = history.receiver_id
+               ORDER BY history.{sort_by} {sort_order}, history.id {sort_order}'''
+
+
+def _transactions_sort(sort: str | None, sort_by: str | None) -> tuple[str, str]:
+     sort_by = sort_by or 'transaction_date'
+     if sort_by not in TRANSACTIONS_SORT_COLUMNS:
+          raise ValueError(f'Unsupported sort attribute: {sort_by}.')
+     return sort_by, 'DESC' if sort == 'desc' else 'ASC'
 
 
-def sort_transactions(transactions: list[Transaction], *,
-                      attribute='transaction_date',
-                      reverse=False):
+def _transactions_filters(sql_parameters: list,
+                          transaction_date: str | None = None,
+                          sender: int | None = None,
+                          receiver: int | None = None,
+                          direction: str | None = None) -> list[str]:
      '''
-     This function sorts a list of recurring transactions based on a specified attribute.\n
+     This function returns the filter conditions of a user's transaction history and appends their
+     parameters to sql_parameters, which must start with the ID of the current user.
+     '''
+
+     filter_by = []
+     if transaction_date:
+          try:
+               day = datetime.strptime(transaction_date, '%Y-%m-%d')
+          except ValueError:
+               raise ValueError('Incorrect date format, should be YYYY-MM-DD.')
+          # A range instead of DATE(transaction_date) = $n, so an index on transaction_date can be used.
+          filter_by.append(f'transaction_date >= ${len(sql_parameters) + 1} AND transaction_date < ${len(sql_parameters) + 2}')
+          sql_parameters.extend([day, day + timedelta(days=1)])
+     if sender:
+          filter_by.append(f'sender_id = ${len(sql_parameters) + 1}')
+          sql_parameters.append(sender)
+     if receiver:
+          filter_by.append(f'receiver_id = ${len(sql_parameters) + 1}')
+          sql_parameters.append(receiver)
+     if direction == 'outgoing':
+          filter_by.append('sender_id = $1')
+     elif direction == 'incoming':
+          filter_by.append('receiver_id = $1')
+
+     return filter_by
+
+
+async def view_transactions_after(current_user: int,
+                                  cursor: str,
+                                  transaction_date: str | None = None,
+                                  sender: int | None = None,
+                                  receiver: int | None = None,
+                                  direction: str | None = None,
+                                  sort: str | None = None,
+                                  sort_by: str | None = None,
+                                  transactions_per_page: int = 5) -> tuple[list[TransactionViewAll], str | None]:
+     '''
+     This function returns the page of the specified user's transactions that follows a cursor and the
+     cursor of the next page, or None if this is the last one.\n
      Parameters:\n
-     - recurring_transactions: list[RecurringTransaction]\n
-          - A list of RecurringTransaction objects to be sorted.\n
-     - attribute: str\n
-          - The attribute to sort the transactions by. Default is 'recurring_transaction_date'.\n
-     - reverse: bool\n
-          - Whether to sort in reverse order. Default is False (ascending order).
+     - current_user: int\n
+          - The ID of the currently authenticated user.\n
+     - cursor: str\n
+          - A next_cursor returned with the previous page.\n
+     - transaction_date, sender, receiver, direction, sort, sort_by\n
+          - The same filters and sort as in view_transactions_page, they must not change between pages.\n
+     - transactions_per_page: int\n
+          - The number of transactions per page. Default is 5.\n
+     Unlike page numbers, the cost of a page doesn't grow with its depth: the outgoing and the incoming
+     transactions are each read as an index range scan and merged. It raises ValueError for an invalid cursor.
      '''
-     
-     if attribute == 'transaction_date':
-          def sort_fn(t: Transaction): return t.transaction_date
-     elif attribute == 'amount':
-          def sort_fn(t: Transaction): return t.amount
-     else:
-        return BadRequest(content=f'Unsupported sort attribute: {attribute}.')
 
-     return sorted(transactions, key=sort_fn, reverse=reverse)
+     sort_by, sort_order = _transactions_sort(sort=sort, sort_by=sort_by)
+     sort = sort_order.lower()
+     value, last_id = decode_cursor(cursor, sort_by=sort_by, sort=sort)
+
+     sql_parameters = [current_user]
+     filter_by = _transactions_filters(sql_parameters=sql_parameters,
+                                       transaction_date=transaction_date,
+                                       sender=sender,
+                                       receiver=receiver,
+                                       direction=direction)
+     filter_by.append(keyset_condition(sort_by, sort, len(sql_parameters) + 1))
+     sql_parameters.extend([value, last_id, transactions_per_page])
+     limit = f'${len(sql_parameters)}'
+
+     conditions = ''.join(f' AND {condition}' for condition in filter_by)
+     order_by = f'ORDER BY {sort_by} {sort_order}, id {sort_order}'
+     # A transaction the user sent to themselves is read by the outgoing branch only, so every id comes from exactly
+     # one branch and UNION ALL merges them without comparing whole rows to drop duplicates.
+     branches = [f'''(SELECT id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id
+                       FROM transactions
+                       WHERE {user_condition}{conditions}
+                       {order_by}
+                       LIMIT {limit})''' for user_condition in ('sender_id = $1', 'receiver_id = $1 AND sender_id <> $1')]
+
+     sql = f'SELECT * FROM ({branches[0]} UNION ALL {branches[1]}) AS page {order_by} LIMIT {limit}'
+     rows = await read_query(sql=_transaction_views_query(sql, sort_by=sort_by, sort_order=sort_order),
+                             sql_params=tuple(sql_parameters))
+
+     next_cursor = next_transactions_cursor(rows, sort=sort, sort_by=sort_by,
+                                            transactions_per_page=transactions_per_page)
+
+     return [TransactionViewAll.from_query_result(*row[1:]) for row in rows], next_cursor
+
+
+def next_transactions_cursor(rows: list,
+                             sort: str | None = None,
+                             sort_by: str | None = None,
+                             transactions_per_page: int = 5) -> str | None:
+     '''
+     This function returns the cursor of the page after the given rows, or None if the page isn't full.
+     The rows must have the id and the sort column of the transactions, by name.
+     '''
+
+     if len(rows) < transactions_per_page:
+          return None
+
+     sort_by, sort_order = _transactions_sort(sort=sort, sort_by=sort_by)
+     last = rows[-1]
+     return encode_cursor(sort_by, sort_order.lower(), last[sort_by], last['id'])
 
 
 async def view_transaction_by_id(transaction_id: int,
-                                 current_user: int):
+                                 current_user: int) -> TransactionView | None:
      '''
-     This function returns a more detailed information about a user's transactions.\n
+     This function returns a more detailed information about a user's transactions, ready to be returned:
+     the usernames of the sender and the receiver and the direction come from the same query.
+     The transaction is looked up by its primary key together with the ownership check, so it is None both
+     when there is no such transaction and when the user neither sent nor received it.\n
      Parameters:\n
      - transaction_id : int\n
           - The ID of the transaction to retrieve details for.\n
@@ -137,19 +314,10 @@ async def view_transaction_by_id(transaction_id: int,
           - This parameter is used to ensure that the request is made by an authenticated user.
      '''
 
-     transactions_outgoing = await read_query(sql=sender_id_transactions,
-                                              sql_params=(current_user,))
-     transactions_incoming = await read_query(sql=receiver_id_transactions,
-                                              sql_params=(current_user,))
-     transactions_all = transactions_outgoing + transactions_incoming
+     transaction_by_id = await read_query(sql=id_transaction_views,
+                                          sql_params=(transaction_id, current_user))
 
-     if transactions_all:
-          transaction_by_id = await read_query(sql=id_transactions,
-                                               sql_params=(transaction_id,))
-     else:
-          return None
-     
-     transaction = next((Transaction.from_query_result(*row) for row in transaction_by_id), None)
+     transaction = next((TransactionView.from_query_result(*row) for row in transaction_by_id), None)
 
      return transaction 
 
@@ -262,7 +430,71 @@ async def create_transaction_to_users_category(transaction: Transaction,
           return None
 
 
+@retry_on_serialization_failure()
+async def create_sent_transactions(transactions: list[Transaction],
+                                   current_user: int,
+                                   card_id: int,
+                                   all_or_nothing: bool = True) -> list[int | None]:
+     '''
+     This function creates many transactions to other users' balances that are sent straight away.\n
+     Parameters:\n
+     - transactions : list[Transaction]\n
+        - The transactions to create, already checked against their receivers.\n
+     - current_user: int\n
+        - The ID of the currently authenticated user, who sends the transactions.\n
+     - card_id: int\n
+        - The ID of the card of the current user.\n
+     - all_or_nothing: bool\n
+        - Create none of the transactions if the wallet can't cover all of them. Otherwise they are taken in order
+          while it covers them. Default is True.\n
+     The sender's balance is locked first, every row is inserted with one statement and the amounts are moved to the
+     clearing account with one ledger posting, all in one unit of work; the receivers confirm or decline them as usual.
+     Returns the ID of every created transaction in the order of transactions, None for the ones the wallet can't cover.
+     '''
+
+     sender = ledger_service.user_account(current_user)
+     amounts = [ledger_service.to_minor_units(transaction.amount) for transaction in transactions]
+
+     async with unit_of_work():
+          balances = await ledger_service.lock_accounts([sender])
+          available = balances[sender]
+
+          if all_or_nothing:
+               covered = [sum(amounts) <= available] * len(amounts)
+          else:
+               covered = []
+               for amount in amounts:
+                    covered.append(amount <= available)
+                    if covered[-1]:
+                         available -= amount
+
+          created = [(transaction, amount) for transaction, amount, is_covered in zip(transactions, amounts, covered) if is_covered]
+          now = datetime.now()
+          generated_ids = await insert_many_returning(sql=values_many_transactions,
+                                                      rows=[('pending',
+                                                             'sent',
+                                                             transaction.transaction_date or now,
+                                                             transaction.amount,
+                                                             transaction.category_name or 'no category',
+                                                             current_user,
+                                                             transaction.receiver_id,
+                                                             card_id) for transaction, _ in created])
+
+          await ledger_service.post_transfers([ledger_service.Transfer(debit=sender,
+                                                                       credit=ledger_service.CLEARING,
+                                                                       amount=amount,
+                                                                       ref=f'transaction:{generated_id}:sent')
+                                               for generated_id, (_, amount) in zip(generated_ids, created)],
+                                              require_funds=True)
+
+     generated_ids = iter(generated_ids)
+     return [next(generated_ids) if is_covered else None for is_covered in covered]
+
+
+@retry_on_serialization_failure()
 async def preview_edited_transaction(transaction_id: int,
+                                     current_user: int,
+                                     version: int,
                                      new_amount: float | None = None,
                                      new_category_name: str | None = None,
                                      new_receiver_id: int | None = None):
@@ -271,42 +503,48 @@ async def preview_edited_transaction(transaction_id: int,
      Parameters:\n
      - transaction_id : int\n
           - The ID of the transaction to be previewed.\n
+     - current_user : int\n
+          - The ID of the user editing the transaction, only its sender can.\n
+     - version : int\n
+          - The version of the transaction the edit is based on. If the transaction has been changed since,
+            StaleVersionError is raised instead of overwriting the other change.\n
      - new_amount : float\n
           - The new amount for the transaction. If None, the amount remains unchanged.\n
      - new_category_name : str\n
           - The new category name for the transaction. If None, the category remains unchanged.\n
      - new_receiver_id : int\n
-          - The new receiver ID for the transaction. If None, the receiver remains unchanged.
+          - The new receiver ID for the transaction. If None, the receiver remains unchanged.\n
+     The supplied fields are changed by one UPDATE that returns the edited transaction. Only pending transactions
+     that haven't been sent can be edited, for others it returns None.
      '''
 
-     transactions = await read_query(sql=id_transactions,
-                                     sql_params=(transaction_id,))
-
-     transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
+     sql_parameters = [transaction_id, current_user, version]
+     assignments = []
+     changes = {'amount': new_amount, 'category_name': new_category_name, 'receiver_id': new_receiver_id}
+     for column, value in changes.items():
+          if value is not None:
+               sql_parameters.append(value)
+               assignments.append(f'{column} = ${len(sql_parameters)}')
+     assignments.append('version = version + 1')
 
-     if transaction is None:
-        return None
+     transactions = await read_query(sql=f'''UPDATE transactions SET {', '.join(assignments)}
+                                            WHERE id = $1 AND sender_id = $2 AND version = $3 AND status = 'pending' AND condition = 'edited'
+                                            RETURNING id, status, condition, transaction_date, amount, category_name, sender_id, receiver_id, cards_id, version''',
+                                     sql_params=tuple(sql_parameters))
 
-     if new_amount is not None:
-          edited_transaction = await update_query(sql='UPDATE transactions SET amount = $1 WHERE id = $2',
-                                                  sql_params=(new_amount, transaction_id))
-     if new_category_name is not None:
-          edited_transaction = await update_query(sql='UPDATE transactions SET category_name = $1 WHERE id = $2',
-                                                  sql_params=(new_category_name, transaction_id))
-     if new_receiver_id is not None:
-          edited_transaction = await update_query(sql='UPDATE transactions SET receiver_id = $1 WHERE id = $2',
-                                                  sql_params=(new_receiver_id, transaction_id))
-          
-     edited_transactions = await read_query(sql=id_transactions,
-                                            sql_params=(transaction_id,))
+     edited_transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
 
-     edited_transaction = next((Transaction.from_query_result(*row) for row in edited_transactions), None)
+     if edited_transaction is None:
+          current = await read_query(sql='SELECT version FROM transactions WHERE id = $1 AND sender_id = $2',
+                                     sql_params=(transaction_id, current_user))
+          if current and current[0][0] != version:
+               raise StaleVersionError(f'Transaction {transaction_id} has been changed since version {version}.')
 
      return edited_transaction
 
 
+@retry_on_serialization_failure()
 async def preview_sent_transaction(transaction_id: int,
-                                   amount: float,
                                    status: str,
                                    condition_action: str,
                                    current_user: int):
@@ -315,173 +553,128 @@ async def preview_sent_transaction(transaction_id: int,
      Parameters:\n
      - transaction_id : int\n
           - The ID of the transaction to be previewed.\n
-     - amount : float\n
-          - The amount of the transaction.\n
      - status : str\n
           - The new status for the transaction.\n
      - condition_action : str\n
           - The new condition of the transaction.\n
      - current_user : int\n
-          - The ID of the current user initiating the preview.
+          - The ID of the current user initiating the preview.\n
+     The transition and the transfer of the amount commit together, see _post_transition.
+     It returns None if the user didn't send the transaction or it isn't pending and edited any more.
      '''
-     transactions = await read_query(sql=id_transactions,
-                                     sql_params=(transaction_id,))
 
-     transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
+     async with unit_of_work():
+          transactions = await read_query(sql=sent_transactions,
+                                          sql_params=(transaction_id, status, condition_action, current_user))
 
-     if transaction is None:
-        return None 
+          transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
+          if transaction is not None:
+               await _post_transition(transaction, 'sent')
 
-     sender_id = transaction.sender_id
-     receiver_id = transaction.receiver_id
-     cards_id = transaction.cards_id
-
-     sent_transaction = await update_query(sql='UPDATE transactions SET status = $1, condition = $2 WHERE id = $3',
-                                           sql_params=(status, condition_action, transaction_id))
-     
-     if current_user == transaction.sender_id and current_user == transaction.receiver_id:
-          # updated_card_balance
-          await update_query(sql='UPDATE cards SET balance = balance - $1 WHERE id = $2',
-                       sql_params=(amount, cards_id))
-     if current_user == sender_id and current_user != receiver_id:
-          # updated_user_balance
-          await update_query(sql='UPDATE users SET balance = balance - $1 WHERE id = $2',
-                       sql_params=(amount, sender_id))
-     if current_user == sender_id and current_user == receiver_id:
-          # updated_user_balance
-          await update_query(sql='UPDATE users SET balance = balance + $1 WHERE id = $2',
-                       sql_params=(amount, receiver_id))
-
-     sent_transactions = await read_query(sql=id_transactions,
-                                          sql_params=(transaction_id,))
-
-     sent_transaction = next((Transaction.from_query_result(*row) for row in sent_transactions), None)
-
-     return sent_transaction
+     return transaction
 
 
+@retry_on_serialization_failure()
 async def preview_confirmed_transaction(transaction_id: int,
-                                      amount: float,
-                                      status: str,
-                                      condition_action: str,
-                                      current_user: int):
+                                        status: str,
+                                        condition_action: str,
+                                        current_user: int):
      '''
-     This function previews a recurring transaction if it will be confirmed.\n
+     This function previews a transaction if it will be confirmed.\n
      Parameters:\n
      - transaction_id : int\n
         - The ID of the transaction to retrieve details for.\n
-     - amount: float\n
-        - The amount to be updated in the recurring transaction.\n
      - status: str\n
-        - The new status of the recurring transaction.\n
+        - The new status of the transaction.\n
      - condition_action: str\n
-        - The new condition of the recurring transaction.\n
+        - The new condition of the transaction.\n
      - current_user: int\n
-        - The ID of the currently authenticated user.
+        - The ID of the currently authenticated user.\n
+     It returns None if the user isn't the receiver or the transaction isn't waiting for them any more.
      '''
-     
-     transactions = await read_query(sql=id_transactions,
-                                     sql_params=(transaction_id,))
-
-     transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
-
-     if transaction is None:
-        return None 
 
-     sender_id = transaction.sender_id
-     receiver_id = transaction.receiver_id
-
-     confirmed_transaction = await update_query(sql='UPDATE transactions SET status = $1, condition = $2 WHERE id = $3',
-                                                sql_params=(status, condition_action, transaction_id))
-
-     if current_user != sender_id and current_user == receiver_id:
-          updated_user_balance = await update_query(sql='UPDATE users SET balance = balance + $1 WHERE id = $2',
-                                                    sql_params=(amount, receiver_id))
-          
-     confirmed_transactions = await read_query(sql=id_transactions,
-                                               sql_params=(transaction_id,))
+     async with unit_of_work():
+          transactions = await read_query(sql=confirmed_transactions,
+                                          sql_params=(transaction_id, status, condition_action, current_user))
 
-     confirmed_transaction = next((Transaction.from_query_result(*row) for row in confirmed_transactions), None)
+          transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
+          if transaction is not None:
+               await _post_transition(transaction, 'confirmed')
 
-     return confirmed_transaction
+     return transaction
 
 
+@retry_on_serialization_failure()
 async def preview_cancelled_transaction(transaction_id: int,
-                                     status: str,
-                                     condition_action: str):
+                                        status: str,
+                                        condition_action: str,
+                                        current_user: int):
      '''
-     This function previews a recurring transaction if it will be cancelled.\n
+     This function previews a transaction if it will be cancelled.\n
      Parameters:\n
-     - recurring_transaction_id : int\n
-        - The ID of the recurring transaction to retrieve details for.\n
+     - transaction_id : int\n
+        - The ID of the transaction to retrieve details for.\n
      - status: str\n
-        - The new status of the recurring transaction.\n
+        - The new status of the transaction.\n
      - condition_action: str\n
-        - The new condition of the recurring transaction.\n
+        - The new condition of the transaction.\n
+     - current_user: int\n
+        - The ID of the currently authenticated user.\n
+     It returns None if the user didn't send the transaction or it has been sent already.
      '''
-     
-     transactions = await read_query(sql=id_transactions,
-                                     sql_params=(transaction_id,))
-
-     transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
 
-     if transaction is None:
-        return None 
-
-     cancelled_transaction = await update_query(sql='UPDATE transactions SET status = $1, condition = $2 WHERE id = $3',
-                                                sql_params=(status, condition_action, transaction_id))
-     
-     cancelled_transactions = await read_query(sql=id_transactions,
-                                               sql_params=(transaction_id,))
+     transactions = await read_query(sql=cancelled_transactions,
+                                     sql_params=(transaction_id, status, condition_action, current_user))
 
-     cancelled_transaction = next((Transaction.from_query_result(*row) for row in cancelled_transactions), None)
-
-     return cancelled_transaction
+     return next((Transaction.from_query_result(*row) for row in transactions), None)
 
 
+@retry_on_serialization_failure()
 async def preview_declined_transaction(transaction_id: int,
-                                      amount: float,
-                                      status: str,
-                                      condition_action: str,
-                                      current_user: int):
+                                       status: str,
+                                       condition_action: str,
+                                       current_user: int):
      '''
-     This function previews a recurring transaction if it will be declined.\n
+     This function previews a transaction if it will be declined.\n
      Parameters:\n
-     - recurring_transaction_id : int\n
-        - The ID of the recurring transaction to retrieve details for.\n
-     - amount: float
-        The amount of the recurring transaction.
-     - status: str
-        The new status of the recurring transaction.
-     - condition_action: str
-        The new condition of the recurring transaction.
-     - current_user: int
-        The ID of the currently authenticated user.
+     - transaction_id : int\n
+        - The ID of the transaction to retrieve details for.\n
+     - status: str\n
+        - The new status of the transaction.\n
+     - condition_action: str\n
+        - The new condition of the transaction.\n
+     - current_user: int\n
+        - The ID of the currently authenticated user.\n
+     It returns None if the user isn't the receiver or the transaction isn't waiting for them any more.
      '''
-     transactions = await read_query(sql=id_transactions,
-                                     sql_params=(transaction_id,))
-
-     transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
 
-     if transaction is None:
-        return None 
+     async with unit_of_work():
+          transactions = await read_query(sql=declined_transactions,
+                                          sql_params=(transaction_id, status, condition_action, current_user))
 
-     declined_amount = amount
-     sender = transaction.sender_id
-     receiver = current_user
+          transaction = next((Transaction.from_query_result(*row) for row in transactions), None)
+          if transaction is not None:
+               await _post_transition(transaction, 'declined')
 
-     updated_user_balance = await update_query(sql='UPDATE users SET balance = balance + $1 WHERE id = $2',
-                                               sql_params=(declined_amount, sender))
+     return transaction
 
-     declined_transaction = await update_query(sql='UPDATE transactions SET status = $1, condition = $2 WHERE id = $3',
-                                               sql_params=(status, condition_action, transaction_id))
 
-     declined_transactions = await read_query(sql=id_transactions,
-                                              sql_params=(transaction_id,))
-
-     declined_transaction = next((Transaction.from_query_result(*row) for row in declined_transactions), None)
+async def _post_transition(transaction: Transaction, transition: str):
+     # Money sent to another user waits on the clearing account until the receiver confirms or declines it,
+     # money sent to the own wallet comes from the card straight away.
+     if transition == 'sent' and transaction.receiver_id == transaction.sender_id:
+          debit, credit = ledger_service.card_account(transaction.cards_id), ledger_service.user_account(transaction.sender_id)
+     elif transition == 'sent':
+          debit, credit = ledger_service.user_account(transaction.sender_id), ledger_service.CLEARING
+     elif transition == 'confirmed':
+          debit, credit = ledger_service.CLEARING, ledger_service.user_account(transaction.receiver_id)
+     else:
+          debit, credit = ledger_service.CLEARING, ledger_service.user_account(transaction.sender_id)
 
-     return declined_transaction
+     await ledger_service.post_transfer(debit=debit,
+                                        credit=credit,
+                                        amount=ledger_service.to_minor_units(transaction.amount),
+                                        ref=f'transaction:{transaction.id}:{transition}')
 
 
 async def transaction_id_exists(transaction_id: int) -> bool:
@@ -491,5 +684,7 @@ async def transaction_id_exists(transaction_id: int) -> bool:
      - recurring_transaction_id: int\n
      - The ID of the recurring transaction to check for existence.
      '''
-     return any(await read_query(sql=id_transactions,
-                                          sql_params=(transaction_id,)))
\ No newline at end of file
+     # The transition that follows is decided on this read, a lagging replica may not have the row yet.
+     async with use_primary():
+          return any(await read_query(sql=id_transactions,
+                                      sql_params=(transaction_id,)))
\ No newline at end of file
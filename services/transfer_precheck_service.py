@@ -0,0 +1,109 @@
+from data.models.transfer_precheck import TransferPrecheck, BatchTransferPrecheck
+from data.statements import register_statement
+from data.connection import use_primary
+from data.database_queries import read_query
+from services import user_services, cards_services, categories_service
+
+
+transfer_precheck = register_statement('transfer_precheck', '''WITH sender AS (SELECT id, email, username, password, phone_number, is_admin, create_at, status, balance
+                                                                                FROM users
+                                                                                WHERE id = $1),
+                                                                    receiver AS (SELECT id, email, username, password, phone_number, is_admin, create_at, status, balance
+                                                                                 FROM users
+                                                                                 WHERE id = $2),
+                                                                    card AS (SELECT id, card_number, cvv, card_holder, expiration_date, card_status, user_id, balance
+                                                                             FROM cards
+                                                                             WHERE user_id = $3
+                                                                             ORDER BY id
+                                                                             LIMIT 1),
+                                                                    category AS (SELECT id, name
+                                                                                 FROM categories
+                                                                                 WHERE id = $4)
+                                                               SELECT (SELECT row_to_json(sender) FROM sender),
+                                                                      (SELECT row_to_json(receiver) FROM receiver),
+                                                                      EXISTS (SELECT 1 FROM contacts WHERE users_id = $1 AND contact_user_id = $2),
+                                                                      (SELECT row_to_json(card) FROM card),
+                                                                      (SELECT row_to_json(category) FROM category)''')
+
+batch_transfer_precheck = register_statement('batch_transfer_precheck', '''WITH sender AS (SELECT id, email, username, password, phone_number, is_admin, create_at, status, balance
+                                                                                            FROM users
+                                                                                            WHERE id = $1),
+                                                                                card AS (SELECT id, card_number, cvv, card_holder, expiration_date, card_status, user_id, balance
+                                                                                         FROM cards
+                                                                                         WHERE user_id = $1
+                                                                                         ORDER BY id
+                                                                                         LIMIT 1),
+                                                                                receivers AS (SELECT users.id, users.email, users.username, users.password, users.phone_number, users.is_admin,
+                                                                                                     users.create_at, users.status, users.balance,
+                                                                                                     contacts.contact_user_id IS NOT NULL AS is_contact
+                                                                                              FROM users
+                                                                                              LEFT JOIN contacts ON contacts.users_id = $1 AND contacts.contact_user_id = users.id
+                                                                                              WHERE users.id = ANY($2::int[]))
+                                                                           SELECT (SELECT row_to_json(sender) FROM sender),
+                                                                                  (SELECT row_to_json(card) FROM card),
+                                                                                  (SELECT json_agg(receivers) FROM receivers)''')
+
+
+async def precheck_transfer(sender_id: int,
+                            receiver_id: int,
+                            card_user_id: int,
+                            categories_id: int | None = None) -> TransferPrecheck:
+    '''
+    This function loads everything an outgoing transfer is validated against in a single query.\n
+    Parameters:\n
+    - sender_id : int\n
+        - The ID of the sending user.\n
+    - receiver_id : int\n
+        - The ID of the receiving user.\n
+    - card_user_id : int\n
+        - The ID of the user whose card is checked.\n
+    - categories_id : int | None\n
+        - The ID of the category of a recurring transaction, if any.\n
+    Returns the sender, the receiver, whether the receiver is in the sender's contacts, the card and the category;
+    rows that don't exist are None. The loaded rows are cached for the rest of the request, so creating the
+    transaction afterwards doesn't look them up again.
+    '''
+
+    # The transfer is decided on this read, it must not come from a replica that lags behind the primary.
+    async with use_primary():
+        rows = await read_query(sql=transfer_precheck,
+                                sql_params=(sender_id, receiver_id, card_user_id, categories_id))
+
+    precheck = TransferPrecheck.from_query_result(*rows[0])
+
+    for user in (precheck.sender, precheck.receiver):
+        if user is not None:
+            user_services.prime_user(user)
+    if precheck.card is not None:
+        cards_services.prime_card(precheck.card)
+    if precheck.category is not None:
+        categories_service.prime_category(precheck.category)
+
+    return precheck
+
+
+async def precheck_batch_transfer(sender_id: int, receiver_ids: list[int]) -> BatchTransferPrecheck:
+    '''
+    This function loads everything a batch of outgoing transfers is validated against in a single query.\n
+    Parameters:\n
+    - sender_id : int\n
+        - The ID of the sending user, whose card is checked too.\n
+    - receiver_ids : list[int]\n
+        - The IDs of the receiving users.\n
+    Returns the sender, their card and the receivers that exist by ID, with the IDs of those in the sender's contacts.
+    The contacts have (users_id, contact_user_id) as primary key, so a receiver is joined to at most one of them.
+    '''
+
+    async with use_primary():
+        rows = await read_query(sql=batch_transfer_precheck,
+                                sql_params=(sender_id, list(dict.fromkeys(receiver_ids))))
+
+    precheck = BatchTransferPrecheck.from_query_result(*rows[0])
+
+    for user in (precheck.sender, *precheck.receivers.values()):
+        if user is not None:
+            user_services.prime_user(user)
+    if precheck.card is not None:
+        cards_services.prime_card(precheck.card)
+
+    return precheck
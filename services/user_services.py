@@ -1,14 +1,17 @@
 import datetime
+from uuid import uuid4
 from typing import Optional
 from mariadb import IntegrityError
 import security.password_hashing
 from common.helper_functions import convert_to_datetime
 from data.database_queries import insert_query, read_query, delete_query, update_query
+from data.loaders import load, load_many, get_loader
 from data.models.cards import Card
 from data.models.user import User
 from schemas.cards import ViewCard
 from schemas.transactions import TransactionView, TransactionFilters
-from schemas.user import UserInfo
+from schemas.user import UserInfo, BalanceUpdate
+from services import ledger_service
 from security import password_hashing
 
 
@@ -174,27 +177,27 @@ async def update_profile(user_id: int, email: str, password: str, phone_number:
     return result
 
 
-async def deposit_money(user_id: int, balance: int):
+async def deposit_money(user_id: int, balance: int) -> BalanceUpdate:
     if balance < 25:
-        return "Minimum deposit is $25."
-    get_user_balance = await read_query('SELECT balance from users WHERE id=$1', (user_id,))
-    new_balance = balance + get_user_balance[0][0]
-    update_result = await update_query('UPDATE users SET balance = $1 WHERE id = $2', (new_balance, user_id))
-    if update_result:
-        return f"You have successfully deposited ${balance} into your virtual wallet."
-    else:
-        return f"Unable to deposit ${balance} into your account."
-
-async def withdraw_money(user_id: int, withdraw: int):
-    get_user_balance = await read_query('SELECT balance from users WHERE id=$1', (user_id,))
-    if withdraw > get_user_balance[0][0]:
-        return "Unable to withdraw. You don't have enough cash in your virtual wallet."
-    new_balance = get_user_balance[0][0] - withdraw
-    update_result = await update_query('UPDATE users SET balance = $1 WHERE id = $2', (new_balance, user_id))
-    if update_result:
-        return f"You have successfully withdrawn ${withdraw} from your virtual wallet."
-    else:
-        return f"Unable to withdraw ${withdraw} into your account."
+        return BalanceUpdate(message="Minimum deposit is $25.")
+    new_balance = await ledger_service.post_external_transfer(user_id=user_id,
+                                                              amount=ledger_service.to_minor_units(balance),
+                                                              ref=f'deposit:{uuid4().hex}')
+    if new_balance is None:
+        return BalanceUpdate(message=f"Unable to deposit ${balance} into your account.")
+    return BalanceUpdate(message=f"You have successfully deposited ${balance} into your virtual wallet.",
+                         balance=new_balance)
+
+async def withdraw_money(user_id: int, withdraw: int) -> BalanceUpdate:
+    if withdraw <= 0:
+        return BalanceUpdate(message=f"Unable to withdraw ${withdraw} from your account.")
+    new_balance = await ledger_service.post_external_transfer(user_id=user_id,
+                                                              amount=-ledger_service.to_minor_units(withdraw),
+                                                              ref=f'withdrawal:{uuid4().hex}')
+    if new_balance is None:
+        return BalanceUpdate(message="Unable to withdraw. You don't have enough cash in your virtual wallet.")
+    return BalanceUpdate(message=f"You have successfully withdrawn ${withdraw} from your virtual wallet.",
+                         balance=new_balance)
     
 
 async def user_id_exists(user_id: int) -> bool:
@@ -205,10 +208,7 @@ async def user_id_exists(user_id: int) -> bool:
         - The ID of the user to check for existence.\n
     '''
 
-    return any(await read_query(sql='''SELECT id, email, username, password, phone_number, is_admin, create_at, status, balance 
-                                                FROM users 
-                                                WHERE id = $1''',
-                                         sql_params=(user_id,)))
+    return await get_user_by_id(user_id=user_id) is not None
 
 
 async def get_user_by_id(user_id: int) -> User:
@@ -218,14 +218,38 @@ async def get_user_by_id(user_id: int) -> User:
     - user_id : int\n
         - The ID of the user to retrieve.
     '''
-    user_data = await read_query(sql='''SELECT id, email, username, password, phone_number, is_admin, create_at, status, balance
-                                        FROM users
-                                        WHERE id = $1''',
-                                sql_params=(user_id,))
-    
-    user = next((User.from_query_result(*row) for row in user_data), None)
 
-    return user
+    return await load('users', _fetch_users_by_ids, user_id)
+
+
+async def get_users_by_ids(user_ids) -> dict[int, User]:
+    '''
+    This function retrieves many users in one query.\n
+    Parameters:\n
+    - user_ids\n
+        - The IDs of the users to retrieve, duplicates are allowed.\n
+    Returns a dict of the found users by ID; IDs that don't exist are left out.
+    '''
+
+    return await load_many('users', _fetch_users_by_ids, user_ids)
+
+
+def prime_user(user: User):
+    '''
+    This function caches a user loaded by another query for the rest of the request.
+    '''
+    loader = get_loader('users', _fetch_users_by_ids)
+    if loader is not None:
+        loader.prime(user.id, user)
+
+
+async def _fetch_users_by_ids(user_ids: list[int]) -> dict[int, User]:
+    users_data = await read_query(sql='''SELECT id, email, username, password, phone_number, is_admin, create_at, status, balance
+                                         FROM users
+                                         WHERE id = ANY($1::int[])''',
+                                  sql_params=(user_ids,))
+
+    return {row[0]: User.from_query_result(*row) for row in users_data}
 
 
 async def get_user_by_status(user_id: int) -> str:
@@ -236,12 +260,6 @@ async def get_user_by_status(user_id: int) -> str:
         - The ID of the user whose status is being retrieved.
     '''
      
-    user_status = await read_query(sql='''SELECT status
-                                          FROM users
-                                          WHERE id = $1''',
-                                   sql_params=(user_id,))
-    
-    user_status = next((row[0] for row in user_status), None)
-
-    return user_status
+    user = await get_user_by_id(user_id=user_id)
 
+    return user.status if user is not None else None
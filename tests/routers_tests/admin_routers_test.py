@@ -1,4 +1,6 @@
+import json
 import unittest
+from datetime import datetime
 from unittest.mock import patch, AsyncMock
 from fastapi import HTTPException, status
 from schemas.transactions import TransactionFilters
@@ -8,6 +10,7 @@ from routers.admin import (
     unblock_user,
     approve_user,
     get_user_transactions_,
+    stream_user_transactions_,
     deny_user_pending_transactions
 )
 
@@ -117,6 +120,32 @@ class TestAdminRouter(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(context.exception.detail, 'Not authorized')
 
 
+    @patch('routers.admin.stream_user_transactions')
+    @patch('routers.admin.admin_services.check_if_not_admin', new_callable=AsyncMock)
+    async def test_stream_user_transactions_sends_a_json_array(self, mock_check_if_not_admin, mock_stream_user_transactions):
+        async def transactions(user_id, filters):
+            yield {"status": "pending", "transaction_date": datetime(2024, 6, 6), "amount": 50.0}
+            yield {"status": "confirmed", "transaction_date": datetime(2024, 6, 7), "amount": 20.0}
+        mock_check_if_not_admin.return_value = False
+        mock_stream_user_transactions.side_effect = transactions
+
+        response = await stream_user_transactions_(user_id=2, current_user=1, filters=TransactionFilters())
+        body = ''.join([chunk async for chunk in response.body_iterator])
+
+        self.assertEqual(response.media_type, 'application/json')
+        self.assertEqual(json.loads(body), [{"status": "pending", "transaction_date": "2024-06-06T00:00:00", "amount": 50.0},
+                                            {"status": "confirmed", "transaction_date": "2024-06-07T00:00:00", "amount": 20.0}])
+
+    @patch('routers.admin.stream_user_transactions')
+    @patch('routers.admin.admin_services.check_if_not_admin', new_callable=AsyncMock)
+    async def test_stream_user_transactions_not_admin(self, mock_check_if_not_admin, mock_stream_user_transactions):
+        mock_check_if_not_admin.return_value = True
+
+        with self.assertRaises(HTTPException) as context:
+            await stream_user_transactions_(user_id=2, current_user=1, filters=TransactionFilters())
+        self.assertEqual(context.exception.status_code, status.HTTP_403_FORBIDDEN)
+        mock_stream_user_transactions.assert_not_called()
+
     @patch('routers.admin.pending_transactions', new_callable=AsyncMock)
     @patch('common.authorization.get_current_user', new_callable=AsyncMock)
     async def test_deny_user_pending_transactions_error(self, mock_get_current_user, mock_pending_transactions):
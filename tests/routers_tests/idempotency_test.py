@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch, AsyncMock
+from common import idempotency
+from common.idempotency import idempotent, StoredResponse
+from common.responses import BadRequest
+from data.models.transactions import Transaction
+
+
+class TestIdempotency(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        idempotency._cache.clear()
+        self.calls = 0
+
+        @idempotent(scope='test')
+        async def create(transaction: Transaction, current_user: int):
+            self.calls += 1
+            if transaction.amount <= 0:
+                raise ValueError
+            if transaction.amount > 100:
+                return BadRequest(content='Too much.')
+            return [{'id': self.calls, 'amount': transaction.amount}]
+
+        self.create = create
+
+    @patch('common.idempotency.update_query', new_callable=AsyncMock)
+    @patch('common.idempotency.read_query', new_callable=AsyncMock)
+    async def test_retry_returns_the_stored_response_without_running_the_handler(self, mock_read_query, mock_update_query):
+        mock_read_query.return_value = [(True, None, None, None, None)]
+
+        first = await self.create(Transaction(amount=5.0, receiver_id=2), current_user=1, idempotency_key='abc')
+        retry = await self.create(Transaction(amount=5.0, receiver_id=2), current_user=1, idempotency_key='abc')
+
+        self.assertEqual(first, [{'id': 1, 'amount': 5.0}])
+        self.assertEqual(retry, first)
+        self.assertEqual(self.calls, 1)
+        mock_read_query.assert_awaited_once()
+        self.assertEqual(mock_update_query.call_args.kwargs['sql_params'][:3], (1, 'test', 'abc'))
+
+    @patch('common.idempotency.update_query', new_callable=AsyncMock)
+    @patch('common.idempotency.read_query', new_callable=AsyncMock)
+    async def test_response_stored_by_another_process_is_replayed(self, mock_read_query, mock_update_query):
+        first = await self._stored_by_another_process(Transaction(amount=500.0, receiver_id=2))
+        mock_read_query.return_value = [(False, *first)]
+
+        retry = await self.create(Transaction(amount=500.0, receiver_id=2), current_user=1, idempotency_key='abc')
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual((retry.status_code, retry.body), (400, b'Too much.'))
+
+    @patch('common.idempotency.update_query', new_callable=AsyncMock)
+    @patch('common.idempotency.read_query', new_callable=AsyncMock)
+    async def test_key_reused_for_another_request_is_a_conflict(self, mock_read_query, mock_update_query):
+        mock_read_query.return_value = [(True, None, None, None, None)]
+        await self.create(Transaction(amount=5.0, receiver_id=2), current_user=1, idempotency_key='abc')
+
+        response = await self.create(Transaction(amount=6.0, receiver_id=2), current_user=1, idempotency_key='abc')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.calls, 1)
+
+    @patch('common.idempotency.delete_query', new_callable=AsyncMock)
+    @patch('common.idempotency.update_query', new_callable=AsyncMock)
+    @patch('common.idempotency.read_query', new_callable=AsyncMock)
+    async def test_failed_request_releases_its_key(self, mock_read_query, mock_update_query, mock_delete_query):
+        mock_read_query.return_value = [(True, None, None, None, None)]
+
+        with self.assertRaises(ValueError):
+            await self.create(Transaction(amount=0.0, receiver_id=2), current_user=1, idempotency_key='abc')
+
+        mock_delete_query.assert_awaited_once()
+        self.assertEqual(mock_delete_query.call_args.kwargs['sql_params'], (1, 'test', 'abc'))
+        self.assertIsNone(idempotency._cache.get((1, 'test', 'abc')))
+
+    async def test_request_without_key_runs_the_handler(self):
+        await self.create(Transaction(amount=5.0, receiver_id=2), current_user=1)
+        await self.create(Transaction(amount=5.0, receiver_id=2), current_user=1)
+
+        self.assertEqual(self.calls, 2)
+
+    async def _stored_by_another_process(self, transaction: Transaction) -> StoredResponse:
+        with patch('common.idempotency.read_query', new=AsyncMock(return_value=[(True, None, None, None, None)])), \
+                patch('common.idempotency.update_query', new_callable=AsyncMock):
+            await self.create(transaction, current_user=1, idempotency_key='abc')
+        stored = idempotency._cache.get((1, 'test', 'abc'))
+        idempotency._cache.clear()
+        return stored
+
+
+if __name__ == '__main__':
+    unittest.main()
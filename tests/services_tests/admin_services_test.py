@@ -3,6 +3,7 @@ from unittest.mock import patch, AsyncMock
 from services.admin_services import *
 from schemas.user import AdminUserInfo
 from schemas.transactions import TransactionFilters
+from services.ledger_service import Account, CLEARING, Transfer
 
 
 class TestAdminServices(unittest.IsolatedAsyncioTestCase):
@@ -71,17 +72,43 @@ class TestAdminServices(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result[0]['receiver_id'], 2)
         self.assertEqual(result[0]['card_id'], 3)
 
+    @patch('services.admin_services.stream_query')
+    async def test_stream_user_transactions(self, mock_stream_query):
+        async def rows(*args):
+            yield ("pending", "2024-06-06 11:36:53.231564", 50.0, 1, 2, 3)
+            yield ("confirmed", "2024-06-07 11:36:53.231564", 20.0, 2, 1, 4)
+        mock_stream_query.side_effect = rows
+
+        filters = TransactionFilters(start_date="2024-06-01T00:00:00", limit=1)
+
+        result = [transaction async for transaction in stream_user_transactions(1, filters)]
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[1]['status'], "confirmed")
+        self.assertEqual(result[1]['card_id'], 4)
+
+        query, params, batch_size = mock_stream_query.call_args.args
+        self.assertIn("transaction_date >= $2", query)
+        self.assertNotIn("LIMIT", query)
+        self.assertEqual(len(params), 2)
+
+    @patch('services.ledger_service.post_transfers', new_callable=AsyncMock)
+    @patch('services.admin_services.unit_of_work')
     @patch('services.admin_services.read_query', new_callable=AsyncMock)
-    @patch('services.admin_services.update_query', new_callable=AsyncMock)
-    async def test_pending_transactions(self, mock_update_query, mock_read_query):
+    async def test_pending_transactions(self, mock_read_query, mock_unit_of_work, mock_post_transfers):
         mock_read_query.side_effect = [
             [(True,)],  # Admin status check
-            [(1, 100.0)]  # Pending transactions
+            [(1, 100.0, 'sent'), (2, 50.0, 'edited'), (3, 25.5, 'sent')]  # Declined pending transactions
         ]
-        mock_update_query.return_value = True
 
         result = await pending_transactions(1, 1)
         self.assertEqual(result, "All pending transactions have been declined.")
+        mock_unit_of_work.assert_called_once()
+        self.assertIn("version = version + 1", mock_read_query.call_args_list[1].args[0])
+        # The edited transaction was never sent, there is nothing to refund. The refunds are booked together.
+        mock_post_transfers.assert_awaited_once_with([
+            Transfer(debit=CLEARING, credit=Account('user', 1), amount=10000, ref='transaction:1:declined'),
+            Transfer(debit=CLEARING, credit=Account('user', 1), amount=2550, ref='transaction:3:declined')
+        ])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+import io
+import unittest
+from unittest.mock import patch, AsyncMock
+from services.bulk_copy_service import import_table
+
+TRANSACTIONS_CSV = '''amount,sender_id,receiver_id,cards_id,transaction_date
+100.5,1,2,3,2024-06-06 11:36:53
+20,2,1,4,
+7,1,1,3,2024-06-08 09:00:00
+'''
+
+
+class TestBulkCopyServices(unittest.IsolatedAsyncioTestCase):
+
+    @patch('services.bulk_copy_service.unit_of_work')
+    @patch('services.bulk_copy_service.read_query', new_callable=AsyncMock)
+    @patch('services.bulk_copy_service.copy_records', new_callable=AsyncMock)
+    async def test_import_transactions_in_chunks(self, mock_copy_records, mock_read_query, mock_unit_of_work):
+        progress = []
+
+        result = await import_table('transactions', io.StringIO(TRANSACTIONS_CSV), chunk_size=2,
+                                    on_progress=progress.append)
+
+        self.assertEqual(result, 3)
+        self.assertEqual(progress, [2, 3])
+        self.assertEqual(mock_copy_records.await_count, 2)
+
+        table_name, records, columns = mock_copy_records.await_args_list[0].args
+        self.assertEqual(table_name, 'transactions')
+        self.assertEqual(columns, ['amount', 'sender_id', 'receiver_id', 'cards_id', 'transaction_date'])
+        self.assertEqual(records[0][:4], (100.5, 1, 2, 3))
+        self.assertIsNone(records[1][4])
+        mock_read_query.assert_not_called()
+
+    @patch('services.bulk_copy_service.unit_of_work')
+    @patch('services.bulk_copy_service.copy_records', new_callable=AsyncMock)
+    async def test_import_invalid_row_reports_line(self, mock_copy_records, mock_unit_of_work):
+        source = io.StringIO('amount,receiver_id\n10,2\nabc,3\n')
+
+        with self.assertRaises(ValueError) as context:
+            await import_table('transactions', source)
+
+        self.assertIn('line 3', str(context.exception))
+        mock_copy_records.assert_not_called()
+
+    @patch('services.bulk_copy_service.unit_of_work')
+    @patch('services.bulk_copy_service.copy_records', new_callable=AsyncMock)
+    async def test_import_sent_transaction_is_rejected(self, mock_copy_records, mock_unit_of_work):
+        source = io.StringIO('status,condition,amount,receiver_id\npending,edited,10,2\nconfirmed,sent,20,3\n')
+
+        with self.assertRaises(ValueError) as context:
+            await import_table('transactions', source)
+
+        self.assertIn('line 3', str(context.exception))
+        mock_copy_records.assert_not_called()
+
+    @patch('services.bulk_copy_service.unit_of_work')
+    @patch('services.bulk_copy_service.copy_records', new_callable=AsyncMock)
+    async def test_import_user_balance_is_rejected(self, mock_copy_records, mock_unit_of_work):
+        source = io.StringIO('email,username,password,phone_number,balance\na@b.com,user,Pass123!,0888888888,100\n')
+
+        with self.assertRaises(ValueError) as context:
+            await import_table('users', source)
+
+        self.assertIn('balance', str(context.exception))
+        mock_copy_records.assert_not_called()
+
+    @patch('services.bulk_copy_service.unit_of_work')
+    @patch('services.bulk_copy_service.update_query', new_callable=AsyncMock)
+    @patch('services.bulk_copy_service.read_query', new_callable=AsyncMock)
+    @patch('services.bulk_copy_service.copy_file_to_table', new_callable=AsyncMock)
+    async def test_import_binary_sent_transactions_is_rejected(self, mock_copy_file, mock_read_query,
+                                                               mock_update_query, mock_unit_of_work):
+        mock_read_query.return_value = [(2,)]
+
+        with self.assertRaises(ValueError):
+            await import_table('transactions', io.BytesIO(b''), format='binary')
+
+        self.assertEqual(mock_copy_file.await_args.args[0], 'transactions_import')
+        mock_update_query.assert_awaited_once()
+
+    async def test_import_unknown_table(self):
+        with self.assertRaises(ValueError):
+            await import_table('cards', io.StringIO('id\n1\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
+import asyncio
 import unittest
 from unittest.mock import patch, AsyncMock
-from services.cards_services import create, delete, get_card_by_id
+from services.cards_services import create, delete, get_card_by_id, get_card_info_by_id, get_card_by_user_id
+from data.loaders import request_loaders_scope
 from data.models.cards import Card
 
 
@@ -67,5 +69,38 @@ class TestCardServices(unittest.IsolatedAsyncioTestCase):
         result = await get_card_by_id(1)
         self.assertIsNone(result)
 
+    @patch('services.cards_services.read_query', new_callable=AsyncMock)
+    async def test_card_loads_are_batched_and_cached_per_request(self, mock_read_query):
+        mock_read_query.return_value = [(1, "1234567812345678", "123", "DANI DIMITROV", "2028-07-01", "active", 1, 100.0),
+                                        (2, "8765432187654321", "321", "DANI DIMITROV", "2028-07-01", "active", 1, 50.0)]
+
+        scope = request_loaders_scope()
+        await scope.__anext__()
+        try:
+            first, second, missing = await asyncio.gather(get_card_info_by_id(1), get_card_by_id(2), get_card_info_by_id(3))
+            again = await get_card_info_by_id(1)
+        finally:
+            await scope.aclose()
+
+        self.assertEqual((first.id, second.id, missing), (1, 2, None))
+        self.assertIs(again, first)
+        mock_read_query.assert_called_once()
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], ([1, 2, 3],))
+
+    @patch('services.cards_services.read_query', new_callable=AsyncMock)
+    async def test_card_of_user_is_cached_by_id_too(self, mock_read_query):
+        mock_read_query.return_value = [(4, "1234567812345678", "123", "DANI DIMITROV", "2028-07-01", "active", 1, 100.0)]
+
+        scope = request_loaders_scope()
+        await scope.__anext__()
+        try:
+            card_id = await get_card_by_user_id(1)
+            card = await get_card_info_by_id(card_id)
+        finally:
+            await scope.aclose()
+
+        self.assertEqual(card.id, 4)
+        mock_read_query.assert_called_once()
+
 if __name__ == '__main__':
     unittest.main()
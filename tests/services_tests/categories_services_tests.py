@@ -1,6 +1,6 @@
 import unittest
 from unittest.mock import patch, AsyncMock
-from services.categories_service import get_all, create, name_exists, Category
+from services.categories_service import get_all, create, name_exists, get_categories_by_ids, Category
 
 class TestCategoriesService(unittest.IsolatedAsyncioTestCase):
     @patch('services.categories_service.read_query', new_callable=AsyncMock)
@@ -43,5 +43,26 @@ class TestCategoriesService(unittest.IsolatedAsyncioTestCase):
         # Assertions
         self.assertTrue(result)
 
+    @patch('services.categories_service.read_query', new_callable=AsyncMock)
+    async def test_get_categories_by_ids(self, mock_read_query):
+        # Mock data
+        mock_read_query.return_value = [(1, "Category 1"), (2, "Category 2")]
+
+        # Call the function
+        result = await get_categories_by_ids([2, 1, 2])
+
+        # Assertions
+        self.assertEqual(result[1].name, "Category 1")
+        self.assertEqual(result[2].name, "Category 2")
+        self.assertEqual(mock_read_query.call_count, 1)
+        self.assertEqual(sorted(mock_read_query.call_args.kwargs['sql_params'][0]), [1, 2])
+
+    @patch('services.categories_service.read_query', new_callable=AsyncMock)
+    async def test_get_categories_by_ids_without_ids(self, mock_read_query):
+        result = await get_categories_by_ids([])
+
+        self.assertEqual(result, {})
+        mock_read_query.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
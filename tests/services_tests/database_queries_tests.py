@@ -0,0 +1,35 @@
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+from data.database_queries import insert_many_returning
+
+
+class TestDatabaseQueries(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.conn = AsyncMock()
+        uow = MagicMock(connection=self.conn)
+        patcher = patch('data.database_queries.current_unit_of_work', return_value=uow)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_insert_many_returning_passes_one_array_per_column_and_keeps_the_order_of_the_ids(self):
+        sql = '''WITH input AS (SELECT nextval(pg_get_serial_sequence('transactions', 'id')) AS id, input.*
+                                FROM unnest($1::float8[], $2::int[], $3::int[]) WITH ORDINALITY AS input(amount, sender_id, receiver_id, ordinality)),
+                      inserted AS (INSERT INTO transactions(id, amount, sender_id, receiver_id)
+                                   SELECT id, amount, sender_id, receiver_id FROM input)
+                 SELECT id FROM input ORDER BY ordinality'''
+        self.conn.fetch.return_value = [{'id': 12}, {'id': 10}, {'id': 11}]
+
+        ids = await insert_many_returning(sql, [(10.0, 1, 2), (20.0, 1, 3), (30.0, 1, 4)])
+
+        self.conn.fetch.assert_awaited_once_with(sql, [10.0, 20.0, 30.0], [1, 1, 1], [2, 3, 4])
+        self.assertEqual(ids, [12, 10, 11])
+
+    async def test_insert_many_returning_without_rows_returns_no_ids(self):
+        self.assertEqual(await insert_many_returning('INSERT INTO transactions ...', []), [])
+
+        self.conn.fetch.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
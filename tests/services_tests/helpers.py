@@ -0,0 +1,15 @@
+class Row(tuple):
+    '''
+    A tuple that can also be indexed by column name, like asyncpg.Record.
+    The positional values come first, followed by the named ones in order.
+    '''
+
+    def __new__(cls, values=(), **named):
+        row = super().__new__(cls, tuple(values) + tuple(named.values()))
+        row.named = named
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.named[key]
+        return super().__getitem__(key)
@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import patch, AsyncMock
+from services.ledger_service import post_transfer, post_transfers, Transfer, to_minor_units, user_account, card_account, \
+    InsufficientFundsError, EXTERNAL, CLEARING, locked_cards, locked_users, posted_ledger_entries
+
+
+class TestLedgerServices(unittest.IsolatedAsyncioTestCase):
+
+    def test_to_minor_units_rounds_to_whole_cents(self):
+        self.assertEqual(to_minor_units(0.1 + 0.2), 30)
+        self.assertEqual(to_minor_units(19.999), 2000)
+        self.assertEqual(to_minor_units(25), 2500)
+
+    @patch('services.ledger_service.unit_of_work')
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_post_transfer_locks_cards_before_users_and_posts_both_entries(self, mock_read_query, mock_unit_of_work):
+        mock_read_query.side_effect = [[(3, 40.0)], [(1, 0.0)], [(2,)]]
+
+        await post_transfer(debit=card_account(3), credit=user_account(1), amount=1250, ref='transaction:7:sent')
+
+        calls = mock_read_query.call_args_list
+        self.assertEqual([call.kwargs['sql'] for call in calls], [locked_cards, locked_users, posted_ledger_entries])
+        self.assertEqual(calls[0].kwargs['sql_params'], ([3],))
+        self.assertEqual(calls[1].kwargs['sql_params'], ([1],))
+        self.assertEqual(calls[2].kwargs['sql_params'], (['transaction:7:sent', 'transaction:7:sent'], ['card', 'user'], [3, 1],
+                                                         [-1250, 1250]))
+        mock_unit_of_work.assert_called_once()
+
+    @patch('services.ledger_service.unit_of_work')
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_post_transfer_locks_users_by_id_whichever_is_debited(self, mock_read_query, mock_unit_of_work):
+        mock_read_query.side_effect = [[(2, 10.0), (5, 10.0)], [(2,)]]
+
+        await post_transfer(debit=user_account(5), credit=user_account(2), amount=100, ref='payout:1')
+
+        self.assertEqual(mock_read_query.call_args_list[0].kwargs['sql_params'], ([2, 5],))
+
+    @patch('services.ledger_service.unit_of_work')
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_post_transfer_without_funds_posts_nothing(self, mock_read_query, mock_unit_of_work):
+        mock_read_query.side_effect = [[(1, 9.99)]]
+
+        with self.assertRaises(InsufficientFundsError):
+            await post_transfer(debit=user_account(1), credit=EXTERNAL, amount=1000, ref='withdrawal:1', require_funds=True)
+
+        mock_read_query.assert_awaited_once()
+
+    @patch('services.ledger_service.unit_of_work')
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_post_transfer_between_accounts_without_balance_locks_nothing(self, mock_read_query, mock_unit_of_work):
+        mock_read_query.return_value = [(2,)]
+
+        await post_transfer(debit=EXTERNAL, credit=CLEARING, amount=100, ref='adjustment:1')
+
+        mock_read_query.assert_awaited_once()
+        self.assertEqual(mock_read_query.call_args.kwargs['sql'], posted_ledger_entries)
+
+    @patch('services.ledger_service.unit_of_work')
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_post_transfers_checks_funds_against_the_total_of_an_account(self, mock_read_query, mock_unit_of_work):
+        mock_read_query.return_value = [(1, 10.0)]
+        transfers = [Transfer(debit=user_account(1), credit=CLEARING, amount=600, ref='transaction:1:sent'),
+                     Transfer(debit=user_account(1), credit=CLEARING, amount=600, ref='transaction:2:sent')]
+
+        with self.assertRaises(InsufficientFundsError):
+            await post_transfers(transfers, require_funds=True)
+
+        mock_read_query.assert_awaited_once()
+
+    @patch('services.ledger_service.unit_of_work')
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_post_transfers_inserts_all_entries_with_one_statement(self, mock_read_query, mock_unit_of_work):
+        mock_read_query.side_effect = [[(1, 10.0)], [(4,)]]
+        transfers = [Transfer(debit=user_account(1), credit=CLEARING, amount=600, ref='transaction:1:sent'),
+                     Transfer(debit=user_account(1), credit=CLEARING, amount=400, ref='transaction:2:sent')]
+
+        await post_transfers(transfers, require_funds=True)
+
+        refs, kinds, ids, amounts = mock_read_query.call_args.kwargs['sql_params']
+        self.assertEqual(refs, ['transaction:1:sent', 'transaction:1:sent', 'transaction:2:sent', 'transaction:2:sent'])
+        self.assertEqual(kinds, ['user', 'clearing', 'user', 'clearing'])
+        self.assertEqual(amounts, [-600, 600, -400, 400])
+        self.assertEqual(sum(amounts), 0)
+
+    async def test_post_transfer_rejects_non_positive_amounts_and_same_account(self):
+        with self.assertRaises(ValueError):
+            await post_transfer(debit=user_account(1), credit=user_account(2), amount=0, ref='transaction:1:sent')
+        with self.assertRaises(ValueError):
+            await post_transfer(debit=user_account(1), credit=user_account(1), amount=100, ref='transaction:1:sent')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+from contextvars import ContextVar
+from data.loaders import DataLoader
+
+caller: ContextVar[str | None] = ContextVar('caller', default=None)
+
+
+class TestDataLoader(unittest.IsolatedAsyncioTestCase):
+
+    async def test_loads_of_one_tick_are_fetched_in_one_batch(self):
+        batches = []
+
+        async def batch_load(keys):
+            batches.append(keys)
+            return {key: key * 10 for key in keys if key != 3}
+
+        loader = DataLoader(batch_load)
+        values = await asyncio.gather(loader.load(1), loader.load(2), loader.load(3), loader.load(1))
+
+        self.assertEqual(values, [10, 20, None, 10])
+        self.assertEqual(batches, [[1, 2, 3]])
+        self.assertEqual(loader._tasks, set())
+
+    async def test_batch_of_a_cancelled_caller_runs_again_for_the_others(self):
+        started = asyncio.Event()
+        contexts = []
+
+        async def batch_load(keys):
+            contexts.append((caller.get(), keys))
+            if len(contexts) == 1:
+                started.set()
+                await asyncio.sleep(10)
+            return {key: key * 10 for key in keys}
+
+        loader = DataLoader(batch_load)
+
+        async def load(name, key):
+            caller.set(name)
+            return await loader.load(key)
+
+        first = asyncio.create_task(load('first', 1))
+        second = asyncio.create_task(load('second', 2))
+        await started.wait()
+        self.assertEqual(len(loader._tasks), 1)
+
+        first.cancel()
+
+        self.assertEqual(await second, 20)
+        self.assertTrue(first.cancelled())
+        self.assertEqual(contexts, [('first', [1, 2]), ('second', [2])])
+
+
+if __name__ == '__main__':
+    unittest.main()
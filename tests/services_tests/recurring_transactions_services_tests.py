@@ -0,0 +1,90 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch, AsyncMock
+from services.recurring_transactions_service import view_recurring_transactions_page, view_recurring_transaction_by_id, \
+    preview_confirmed_recurring_transaction, preview_edited_recurring_transaction
+from data.models.recurring_transactions import RecurringTransaction
+from services.ledger_service import Account, CLEARING
+from tests.services_tests.helpers import Row
+
+
+class TestRecurringTransactionsServices(unittest.IsolatedAsyncioTestCase):
+
+    @patch('services.recurring_transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_recurring_transactions_page_returns_next_cursor(self, mock_read_query):
+        mock_read_query.return_value = [Row((3, datetime(2024, 5, 1), datetime(2024, 6, 1), 'pending', 'edited',
+                                             25.0, 1, 2, 4), total_count=9)]
+
+        recurring_transactions, total, next_cursor = await view_recurring_transactions_page(current_user=1,
+                                                                                            sort_by='amount',
+                                                                                            page=1,
+                                                                                            recurring_transactions_per_page=1)
+
+        sql, params = mock_read_query.call_args.kwargs['sql'], mock_read_query.call_args.kwargs['sql_params']
+        self.assertIn('WHERE sender_id = $1', sql)
+        self.assertIn('ORDER BY amount ASC, id ASC', sql)
+        self.assertEqual(params, (1, 1, 0))
+        self.assertIsInstance(recurring_transactions[0], RecurringTransaction)
+        self.assertEqual(total, 9)
+        self.assertIsNotNone(next_cursor)
+
+        mock_read_query.return_value = []
+        recurring_transactions, total, next_cursor = await view_recurring_transactions_page(current_user=1,
+                                                                                            sort_by='amount',
+                                                                                            cursor=next_cursor,
+                                                                                            recurring_transactions_per_page=1)
+
+        sql, params = mock_read_query.call_args.kwargs['sql'], mock_read_query.call_args.kwargs['sql_params']
+        self.assertIn('(amount, id) > ($2, $3)', sql)
+        self.assertNotIn('OFFSET', sql)
+        self.assertEqual(params, (1, 25.0, 3, 1))
+        self.assertEqual((recurring_transactions, total, next_cursor), ([], None, None))
+
+    async def test_view_recurring_transactions_page_rejects_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await view_recurring_transactions_page(current_user=1, cursor='not-a-cursor')
+
+    @patch('services.recurring_transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_recurring_transaction_by_id_checks_ownership_in_one_query(self, mock_read_query):
+        mock_read_query.return_value = [(3, datetime(2024, 5, 1), datetime(2024, 6, 1), 'pending', 'edited', 25.0, 1, 2, 4)]
+
+        recurring_transaction = await view_recurring_transaction_by_id(recurring_transaction_id=3, current_user=2)
+
+        mock_read_query.assert_awaited_once()
+        self.assertIn('WHERE id = $1 AND (sender_id = $2 OR receiver_id = $2)', mock_read_query.call_args.kwargs['sql'])
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], (3, 2))
+        self.assertEqual(recurring_transaction.id, 3)
+
+        mock_read_query.return_value = []
+        self.assertIsNone(await view_recurring_transaction_by_id(recurring_transaction_id=3, current_user=5))
+
+    @patch('services.ledger_service.post_transfer', new_callable=AsyncMock)
+    @patch('services.recurring_transactions_service.unit_of_work')
+    @patch('services.recurring_transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_confirmed_recurring_transaction_credits_receiver_from_clearing(self, mock_read_query,
+                                                                                          mock_unit_of_work,
+                                                                                          mock_post_transfer):
+        mock_read_query.return_value = [(3, datetime(2024, 5, 1), datetime(2024, 6, 1), 'confirmed', 'sent', 25.0, 1, 2, 4)]
+
+        recurring_transaction = await preview_confirmed_recurring_transaction(recurring_transaction_id=3, status='confirmed',
+                                                                              condition_action='sent', current_user=2)
+
+        mock_read_query.assert_awaited_once()
+        sql = mock_read_query.call_args.kwargs['sql']
+        self.assertIn("receiver_id = $4 AND sender_id <> $4 AND status = 'pending' AND condition = 'sent'", sql)
+        mock_unit_of_work.assert_called_once()
+        mock_post_transfer.assert_awaited_once_with(debit=CLEARING, credit=Account('user', 2), amount=2500,
+                                                    ref='recurring_transaction:3:confirmed')
+        self.assertEqual(recurring_transaction.status, 'confirmed')
+
+    @patch('services.recurring_transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_edited_recurring_transaction_without_conflict_returns_none_when_not_editable(self, mock_read_query):
+        mock_read_query.side_effect = [[], [(2,)]]
+
+        recurring_transaction = await preview_edited_recurring_transaction(recurring_transaction_id=3, current_user=1, version=2,
+                                                                           new_amount=10.0, new_categories_id=5)
+
+        self.assertIsNone(recurring_transaction)
+        update_sql = mock_read_query.call_args_list[0].kwargs['sql']
+        self.assertIn('SET amount = $4, categories_id = $5, version = version + 1', update_sql)
+        self.assertIn("WHERE id = $1 AND sender_id = $2 AND version = $3 AND status = 'pending' AND condition = 'edited'", update_sql)
@@ -0,0 +1,245 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch, AsyncMock
+from services.transactions_service import view_transactions_page, view_transactions_after, next_transactions_cursor, \
+    view_transaction_by_id, preview_sent_transaction, preview_declined_transaction, \
+    preview_edited_transaction, create_sent_transactions, transaction_id_exists
+from data.unit_of_work import StaleVersionError
+from data.connection import _use_primary
+from services.ledger_service import Account, CLEARING, Transfer
+from data.models.transactions import Transaction
+from schemas.transactions import TransactionViewAll, TransactionView
+from tests.services_tests.helpers import Row
+
+
+class TestTransactionsServices(unittest.IsolatedAsyncioTestCase):
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_transactions_page_sorts_and_paginates_in_sql(self, mock_read_query):
+        mock_read_query.return_value = [Row(id=7, transaction_date=datetime(2024, 5, 1), amount=30.0, sender='alice',
+                                            receiver='bob', direction='outgoing', total_count=12)]
+
+        transactions, total, next_cursor = await view_transactions_page(current_user=1, sort='desc', sort_by='amount',
+                                                                        page=3, transactions_per_page=5)
+
+        sql, params = mock_read_query.call_args.kwargs['sql'], mock_read_query.call_args.kwargs['sql_params']
+        self.assertIn('(sender_id = $1 OR receiver_id = $1)', sql)
+        self.assertIn('ORDER BY amount DESC, id DESC', sql)
+        self.assertIn('LIMIT $2 OFFSET $3', sql)
+        self.assertEqual(params, (1, 5, 10))
+        self.assertEqual(total, 12)
+        self.assertEqual(transactions, [TransactionViewAll(transaction_date='2024/05/01 00:00', amount=30.0, sender='alice',
+                                                           receiver='bob', direction='outgoing')])
+        self.assertIsNone(next_cursor)
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_transactions_page_joins_usernames_and_direction(self, mock_read_query):
+        mock_read_query.return_value = [Row(id=7, transaction_date=datetime(2024, 5, 1), amount=30.0, sender='alice',
+                                            receiver='bob', direction='outgoing', total_count=6)]
+
+        transactions, total, next_cursor = await view_transactions_page(current_user=1, page=1, transactions_per_page=1)
+
+        sql = mock_read_query.call_args.kwargs['sql']
+        self.assertIn('JOIN users AS senders ON senders.id = history.sender_id', sql)
+        self.assertIn('JOIN users AS receivers ON receivers.id = history.receiver_id', sql)
+        self.assertIn("CASE WHEN history.receiver_id = $1 THEN 'incoming' ELSE 'outgoing' END", sql)
+        self.assertEqual(next_cursor, next_transactions_cursor([Row(id=7, transaction_date=datetime(2024, 5, 1))],
+                                                               transactions_per_page=1))
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_transactions_page_filters_by_date_range(self, mock_read_query):
+        mock_read_query.return_value = []
+
+        transactions, total, _ = await view_transactions_page(current_user=1, transaction_date='2024-05-01',
+                                                              direction='incoming')
+
+        sql, params = mock_read_query.call_args.kwargs['sql'], mock_read_query.call_args.kwargs['sql_params']
+        self.assertIn('transaction_date >= $2 AND transaction_date < $3', sql)
+        self.assertIn('receiver_id = $1', sql)
+        self.assertNotIn('LIMIT', sql)
+        self.assertEqual(params, (1, datetime(2024, 5, 1), datetime(2024, 5, 2)))
+        self.assertEqual((transactions, total), ([], 0))
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_transactions_page_past_the_end_counts_separately(self, mock_read_query):
+        mock_read_query.side_effect = [[], [(4,)]]
+
+        transactions, total, _ = await view_transactions_page(current_user=1, page=9)
+
+        self.assertEqual((transactions, total), ([], 4))
+        self.assertTrue(mock_read_query.call_args.kwargs['sql'].startswith('SELECT COUNT(*) FROM transactions'))
+
+    async def test_view_transactions_page_rejects_unknown_sort_attribute(self):
+        with self.assertRaises(ValueError):
+            await view_transactions_page(current_user=1, sort_by='id; DROP TABLE transactions')
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_transactions_after_continues_from_cursor(self, mock_read_query):
+        last = Row(id=7, transaction_date=datetime(2024, 5, 1, 12, 30), amount=30.0)
+        cursor = next_transactions_cursor([last], sort='desc', transactions_per_page=1)
+        mock_read_query.return_value = [Row(id=5, transaction_date=datetime(2024, 4, 30), amount=10.0, sender='bob',
+                                            receiver='alice', direction='incoming')]
+
+        transactions, next_cursor = await view_transactions_after(current_user=1, cursor=cursor, sort='desc',
+                                                                  transactions_per_page=2)
+
+        sql, params = mock_read_query.call_args.kwargs['sql'], mock_read_query.call_args.kwargs['sql_params']
+        self.assertIn('WHERE sender_id = $1 AND (transaction_date, id) < ($2, $3)', sql)
+        self.assertIn('WHERE receiver_id = $1 AND sender_id <> $1 AND (transaction_date, id) < ($2, $3)', sql)
+        self.assertIn('UNION ALL', sql)
+        self.assertEqual(params, (1, datetime(2024, 5, 1, 12, 30), 7, 2))
+        self.assertEqual(transactions[0].direction, 'incoming')
+        self.assertIsNone(next_cursor)
+
+    async def test_view_transactions_after_rejects_cursor_of_another_sort(self):
+        last = Row(id=7, transaction_date=datetime(2024, 5, 1), amount=30.0)
+        cursor = next_transactions_cursor([last], sort_by='amount', transactions_per_page=1)
+
+        with self.assertRaises(ValueError):
+            await view_transactions_after(current_user=1, cursor=cursor, sort_by='transaction_date')
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_transaction_id_exists_reads_from_the_primary(self, mock_read_query):
+        pinned = []
+        mock_read_query.side_effect = lambda **kwargs: pinned.append(_use_primary.get()) or [(7,)]
+
+        self.assertTrue(await transaction_id_exists(transaction_id=7))
+        self.assertEqual(pinned, [True])
+        self.assertFalse(_use_primary.get())
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_transaction_by_id_returns_ready_view(self, mock_read_query):
+        mock_read_query.return_value = [('confirmed', 'sent', datetime(2024, 5, 1), 30.0, 'rent', 'alice', 'bob', 'outgoing')]
+
+        transaction = await view_transaction_by_id(transaction_id=7, current_user=1)
+
+        mock_read_query.assert_awaited_once()
+        self.assertIn('WHERE transactions.id = $1 AND (transactions.sender_id = $2 OR transactions.receiver_id = $2)',
+                      mock_read_query.call_args.kwargs['sql'])
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], (7, 1))
+        self.assertEqual(transaction, TransactionView(status='confirmed', condition='sent', transaction_date='2024/05/01 00:00',
+                                                      amount=30.0, category_name='rent', sender='alice', receiver='bob',
+                                                      direction='outgoing', message='This transaction has been successfully sent.'))
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_view_transaction_by_id_of_another_user_returns_none(self, mock_read_query):
+        mock_read_query.return_value = []
+
+        self.assertIsNone(await view_transaction_by_id(transaction_id=7, current_user=3))
+        mock_read_query.assert_awaited_once()
+
+    @patch('services.ledger_service.post_transfer', new_callable=AsyncMock)
+    @patch('services.transactions_service.unit_of_work')
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_sent_transaction_moves_amount_to_clearing(self, mock_read_query, mock_unit_of_work, mock_post_transfer):
+        mock_read_query.return_value = [(7, 'pending', 'sent', datetime(2024, 5, 1), 30.1, 'no category', 1, 2, 3)]
+
+        transaction = await preview_sent_transaction(transaction_id=7, status='pending', condition_action='sent', current_user=1)
+
+        mock_read_query.assert_awaited_once()
+        sql = mock_read_query.call_args.kwargs['sql']
+        self.assertIn("WHERE id = $1 AND sender_id = $4 AND status = 'pending' AND condition = 'edited'", sql)
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], (7, 'pending', 'sent', 1))
+        self.assertEqual((transaction.id, transaction.condition), (7, 'sent'))
+        mock_unit_of_work.assert_called_once()
+        mock_post_transfer.assert_awaited_once_with(debit=Account('user', 1), credit=CLEARING, amount=3010,
+                                                    ref='transaction:7:sent')
+
+    @patch('services.ledger_service.post_transfer', new_callable=AsyncMock)
+    @patch('services.transactions_service.unit_of_work')
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_sent_transaction_to_own_wallet_moves_amount_from_card(self, mock_read_query, mock_unit_of_work,
+                                                                                 mock_post_transfer):
+        mock_read_query.return_value = [(7, 'confirmed', 'sent', datetime(2024, 5, 1), 30.0, 'no category', 1, 1, 3)]
+
+        await preview_sent_transaction(transaction_id=7, status='confirmed', condition_action='sent', current_user=1)
+
+        mock_post_transfer.assert_awaited_once_with(debit=Account('card', 3), credit=Account('user', 1), amount=3000,
+                                                    ref='transaction:7:sent')
+
+    @patch('services.ledger_service.post_transfer', new_callable=AsyncMock)
+    @patch('services.transactions_service.unit_of_work')
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_declined_transaction_in_another_state_returns_none(self, mock_read_query, mock_unit_of_work,
+                                                                              mock_post_transfer):
+        mock_read_query.return_value = []
+
+        transaction = await preview_declined_transaction(transaction_id=7, status='declined', condition_action='cancelled',
+                                                         current_user=2)
+
+        self.assertIsNone(transaction)
+        mock_post_transfer.assert_not_awaited()
+        self.assertIn("receiver_id = $4 AND status = 'pending' AND condition = 'sent'", mock_read_query.call_args.kwargs['sql'])
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_edited_transaction_sets_supplied_fields_in_one_update(self, mock_read_query):
+        mock_read_query.return_value = [(7, 'pending', 'edited', datetime(2024, 5, 1), 45.0, 'rent', 1, 4, 3, 3)]
+
+        transaction = await preview_edited_transaction(transaction_id=7, current_user=1, version=2, new_amount=45.0,
+                                                       new_receiver_id=4)
+
+        mock_read_query.assert_awaited_once()
+        sql = mock_read_query.call_args.kwargs['sql']
+        self.assertIn('SET amount = $4, receiver_id = $5, version = version + 1', sql)
+        self.assertIn('WHERE id = $1 AND sender_id = $2 AND version = $3', sql)
+        self.assertNotIn('category_name =', sql)
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], (7, 1, 2, 45.0, 4))
+        self.assertEqual((transaction.amount, transaction.version), (45.0, 3))
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_edited_transaction_with_stale_version_raises(self, mock_read_query):
+        mock_read_query.side_effect = [[], [(3,)]]
+
+        with self.assertRaises(StaleVersionError):
+            await preview_edited_transaction(transaction_id=7, current_user=1, version=2, new_amount=45.0)
+
+    @patch('services.transactions_service.read_query', new_callable=AsyncMock)
+    async def test_preview_edited_transaction_of_another_sender_returns_none(self, mock_read_query):
+        mock_read_query.side_effect = [[], []]
+
+        transaction = await preview_edited_transaction(transaction_id=7, current_user=2, version=2, new_amount=45.0)
+
+        self.assertIsNone(transaction)
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], (7, 2))
+
+
+    @patch('services.ledger_service.post_transfers', new_callable=AsyncMock)
+    @patch('services.ledger_service.lock_accounts', new_callable=AsyncMock)
+    @patch('services.transactions_service.insert_many_returning', new_callable=AsyncMock)
+    @patch('services.transactions_service.unit_of_work')
+    async def test_create_sent_transactions_best_effort_skips_what_the_wallet_cannot_cover(self, mock_unit_of_work,
+                                                                                          mock_insert_many_returning,
+                                                                                          mock_lock_accounts,
+                                                                                          mock_post_transfers):
+        mock_lock_accounts.return_value = {Account('user', 1): 5000}
+        mock_insert_many_returning.return_value = [11, 12]
+        transactions = [Transaction(amount=30.0, receiver_id=2), Transaction(amount=30.0, receiver_id=3),
+                        Transaction(amount=20.0, receiver_id=4)]
+
+        generated_ids = await create_sent_transactions(transactions=transactions, current_user=1, card_id=3,
+                                                       all_or_nothing=False)
+
+        self.assertEqual(generated_ids, [11, None, 12])
+        rows = mock_insert_many_returning.call_args.kwargs['rows']
+        self.assertEqual([(row[0], row[1], row[6]) for row in rows], [('pending', 'sent', 2), ('pending', 'sent', 4)])
+        mock_post_transfers.assert_awaited_once_with([Transfer(Account('user', 1), CLEARING, 3000, 'transaction:11:sent'),
+                                                      Transfer(Account('user', 1), CLEARING, 2000, 'transaction:12:sent')],
+                                                     require_funds=True)
+
+    @patch('services.ledger_service.post_transfers', new_callable=AsyncMock)
+    @patch('services.ledger_service.lock_accounts', new_callable=AsyncMock)
+    @patch('services.transactions_service.insert_many_returning', new_callable=AsyncMock)
+    @patch('services.transactions_service.unit_of_work')
+    async def test_create_sent_transactions_all_or_nothing_creates_none_without_funds(self, mock_unit_of_work,
+                                                                                     mock_insert_many_returning,
+                                                                                     mock_lock_accounts,
+                                                                                     mock_post_transfers):
+        mock_lock_accounts.return_value = {Account('user', 1): 5000}
+        mock_insert_many_returning.return_value = []
+        transactions = [Transaction(amount=30.0, receiver_id=2), Transaction(amount=30.0, receiver_id=3)]
+
+        generated_ids = await create_sent_transactions(transactions=transactions, current_user=1, card_id=3)
+
+        self.assertEqual(generated_ids, [None, None])
+        self.assertEqual(mock_insert_many_returning.call_args.kwargs['rows'], [])
+        mock_post_transfers.assert_awaited_once_with([], require_funds=True)
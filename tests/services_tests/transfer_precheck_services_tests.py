@@ -0,0 +1,62 @@
+import json
+import unittest
+from unittest.mock import patch, AsyncMock
+from services.transfer_precheck_service import precheck_transfer, precheck_batch_transfer
+from data.models.transfer_precheck import TransferPrecheck
+
+SENDER = '{"id": 1, "email": "test@test.bg", "username": "sender", "password": "testpassword", "phone_number": "1234567890", ' \
+         '"is_admin": false, "create_at": "2023-01-01T00:00:00", "status": "activated", "balance": 10.0}'
+RECEIVER = '{"id": 2, "email": "other@test.bg", "username": "receiver", "password": "testpassword", "phone_number": "0987654321", ' \
+           '"is_admin": false, "create_at": "2023-01-01T00:00:00", "status": "blocked", "balance": 0.0}'
+CARD = '{"id": 3, "card_number": "1234567812345678", "cvv": "123", "card_holder": "DANI DIMITROV", ' \
+       '"expiration_date": "2028-07-01", "card_status": "active", "user_id": 1, "balance": 100.0}'
+
+
+class TestTransferPrecheckServices(unittest.IsolatedAsyncioTestCase):
+
+    @patch('services.transfer_precheck_service.read_query', new_callable=AsyncMock)
+    async def test_precheck_transfer_loads_everything_in_one_query(self, mock_read_query):
+        mock_read_query.return_value = [(SENDER, RECEIVER, True, CARD, None)]
+
+        result = await precheck_transfer(sender_id=1, receiver_id=2, card_user_id=1)
+
+        mock_read_query.assert_called_once()
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], (1, 2, 1, None))
+        self.assertIsInstance(result, TransferPrecheck)
+        self.assertEqual(result.sender.username, 'sender')
+        self.assertEqual(result.card.balance, 100.0)
+        self.assertTrue(result.is_contact)
+        self.assertIsNone(result.category)
+        self.assertFalse(result.sender_blocked)
+        self.assertFalse(result.receiver_available)
+
+    @patch('services.transfer_precheck_service.read_query', new_callable=AsyncMock)
+    async def test_precheck_transfer_with_missing_rows(self, mock_read_query):
+        mock_read_query.return_value = [(None, None, False, None, None)]
+
+        result = await precheck_transfer(sender_id=1, receiver_id=99, card_user_id=1, categories_id=5)
+
+        self.assertIsNone(result.sender)
+        self.assertIsNone(result.receiver)
+        self.assertIsNone(result.card)
+        self.assertFalse(result.receiver_available)
+
+
+    @patch('services.transfer_precheck_service.read_query', new_callable=AsyncMock)
+    async def test_precheck_batch_transfer_loads_all_receivers_in_one_query(self, mock_read_query):
+        receivers = json.dumps([{**json.loads(RECEIVER), 'is_contact': True},
+                                {**json.loads(RECEIVER), 'id': 4, 'is_contact': False}])
+        mock_read_query.return_value = [(SENDER, CARD, receivers)]
+
+        result = await precheck_batch_transfer(sender_id=1, receiver_ids=[2, 4, 2, 99])
+
+        mock_read_query.assert_called_once()
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'], (1, [2, 4, 99]))
+        self.assertEqual(result.sender.username, 'sender')
+        self.assertEqual(sorted(result.receivers), [2, 4])
+        self.assertEqual(result.contacts, {2})
+        self.assertFalse(result.receiver_available(2))
+        self.assertFalse(result.receiver_available(99))
+
+if __name__ == '__main__':
+    unittest.main()
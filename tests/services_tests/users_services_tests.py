@@ -1,6 +1,8 @@
 import unittest
 from unittest.mock import patch, AsyncMock
-from services.user_services import create, find_by_email, try_login, User, IntegrityError
+from services.user_services import create, find_by_email, try_login, get_users_by_ids, deposit_money, withdraw_money, \
+    User, IntegrityError
+from services.ledger_service import posted_external_transfer
 
 ID = 1
 EMAIL = 'test@test.bg'
@@ -91,6 +93,40 @@ class TestWalletServices(unittest.IsolatedAsyncioTestCase):
 
         self.assertIsNone(result)
 
+    @patch('services.user_services.read_query', new_callable=AsyncMock)
+    async def test_get_users_by_ids_uses_one_query(self, mock_read_query):
+        mock_read_query.return_value = [(ID, EMAIL, USERNAME, PASSWORD, PHONE, IS_ADMIN, CREATE_AT, STATUS, BALANCE)]
+
+        result = await get_users_by_ids([ID, ID, 2])
+
+        self.assertEqual(list(result), [ID])
+        self.assertEqual(result[ID].username, USERNAME)
+        mock_read_query.assert_called_once()
+        self.assertIn('= ANY($1::int[])', mock_read_query.call_args.kwargs['sql'])
+
+
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_deposit_money_is_one_statement_returning_the_new_balance(self, mock_read_query):
+        mock_read_query.return_value = [(125.5,)]
+
+        result = await deposit_money(ID, 25)
+
+        mock_read_query.assert_awaited_once()
+        self.assertEqual(mock_read_query.call_args.kwargs['sql'], posted_external_transfer)
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'][:2], (ID, 2500))
+        self.assertTrue(result.successful)
+        self.assertEqual(result.balance, 125.5)
+        self.assertIn('successfully', result.message)
+
+    @patch('services.ledger_service.read_query', new_callable=AsyncMock)
+    async def test_withdraw_money_without_enough_cash_changes_nothing(self, mock_read_query):
+        mock_read_query.return_value = []
+
+        result = await withdraw_money(ID, 50)
+
+        self.assertEqual(mock_read_query.call_args.kwargs['sql_params'][:2], (ID, -5000))
+        self.assertFalse(result.successful)
+        self.assertEqual(result.message, "Unable to withdraw. You don't have enough cash in your virtual wallet.")
 
 if __name__ == '__main__':
     unittest.main()